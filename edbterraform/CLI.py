@@ -1,6 +1,7 @@
 import platform
 import sys
 import os
+import fcntl
 from pathlib import Path
 import shutil
 from urllib import request as Request
@@ -8,12 +9,64 @@ import subprocess
 import json
 import textwrap
 from typing import Union
+from tempfile import TemporaryDirectory
+from contextlib import contextmanager
 import venv
 
 from edbterraform import __dot_project__
 from edbterraform.utils.logs import logger
 from edbterraform.utils.files import checksum_verify
 from edbterraform.utils.script import execute_shell, binary_path, Version
+from edbterraform.targets import target_arguments
+
+@contextmanager
+def install_lock(tool):
+    '''
+    Serialize installations of a tool version between processes sharing the same bin directory.
+    The lock file is kept next to the version directories, ex: <bin_dir>/terraform/.1.5.5.lock
+    '''
+    lock_file = Path(tool.bin_dir) / tool.binary_name / f'.{tool.default_path.parent.name}.lock'
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(f'Waiting for another installation of {tool.binary_name} {tool.version} to finish')
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def is_installed(tool) -> bool:
+    # The binary of the version directory is found first and reports the expected version
+    try:
+        return tool.get_binary() == tool.binary_full_path \
+            and tool.check_version().to_tuple() == tool.version.to_tuple()
+    except Exception:
+        return False
+
+def staging_directory(tool) -> TemporaryDirectory:
+    # Staged on the same filesystem as the version directories so files are renamed into place atomically
+    parent = Path(tool.bin_dir) / tool.binary_name
+    parent.mkdir(parents=True, exist_ok=True)
+    return TemporaryDirectory(prefix=f'.{tool.default_path.parent.name}-', dir=parent)
+
+def install_file(source: Path, destination: Path, mode=0o770):
+    # A concurrent reader sees either the previous or the new file, never a partial one
+    source.chmod(mode)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(source, destination)
+
+def install_symlink(target: Path, link: Path):
+    link.parent.mkdir(parents=True, exist_ok=True)
+    temporary = link.with_name(f'.{link.name}.{os.getpid()}.tmp')
+    temporary.unlink(missing_ok=True)
+    temporary.symlink_to(target)
+    os.replace(temporary, link)
+
+# Versions reported by terraform binaries, keyed by path, modification time and size
+TERRAFORM_VERSIONS = {}
 
 class TerraformCLI:
     binary_name = 'terraform'
@@ -23,9 +76,11 @@ class TerraformCLI:
     max_version = Version("1.5.5")
     arch_alias = {
         'x86_64': 'amd64',
+        'aarch64': 'arm64',
     }
     DOT_PATH = __dot_project__
     plan_file = 'terraform.plan'
+    versions_file = Path(__file__).parent.resolve() / 'data' / 'terraform' / 'versions.tf'
 
     def __init__(self, binary_dir=None, version=None):
         self.bin_dir = binary_dir if binary_dir else self.DOT_PATH
@@ -36,10 +91,30 @@ class TerraformCLI:
         self.binary_full_path = Path(self.bin_path) / self.binary_name
         self.architecture = self.arch_alias.get(platform.machine().lower(),platform.machine().lower())
         self.operating_system = platform.system().lower()
+        self.mirror_path = Path(self.bin_dir) / self.binary_name / 'mirror'
+        self.cli_config_file = Path(self.bin_dir) / self.binary_name / 'mirror.tfrc'
+        self.plugin_cache_dir = Path(self.bin_dir) / self.binary_name / 'plugin-cache'
 
     def get_binary(self):
         return binary_path(self.binary_name, self.bin_path, self.default_path)
 
+    def environment(self, plugin_cache=False):
+        '''
+        Environment for terraform commands.
+        When a provider mirror was created with `setup --mirror-providers`,
+          its cli configuration is used unless TF_CLI_CONFIG_FILE is already set.
+        With plugin_cache, providers are shared between projects through BIN_PATH/terraform/plugin-cache
+          unless TF_PLUGIN_CACHE_DIR is already set.
+          Terraform does not support concurrent use of the cache, callers need to run init one at a time.
+        '''
+        environment = os.environ.copy()
+        if 'TF_CLI_CONFIG_FILE' not in environment and self.cli_config_file.exists():
+            environment['TF_CLI_CONFIG_FILE'] = str(self.cli_config_file)
+        if plugin_cache and 'TF_PLUGIN_CACHE_DIR' not in environment:
+            self.plugin_cache_dir.mkdir(parents=True, exist_ok=True)
+            environment['TF_PLUGIN_CACHE_DIR'] = str(self.plugin_cache_dir)
+        return environment
+
     def get_compatible_terraform(self):
         version = self.check_version()
         binary = self.get_binary()
@@ -68,19 +143,28 @@ class TerraformCLI:
         try:
             version_keyname = 'terraform_version'
             terraform_path = self.get_binary()
+            # Every terraform command checks the version, reuse it until the binary changes
+            key = None
+            if terraform_path and Path(terraform_path).is_file():
+                status = Path(terraform_path).stat()
+                key = (str(terraform_path), status.st_mtime_ns, status.st_size)
+            if key in TERRAFORM_VERSIONS:
+                return TERRAFORM_VERSIONS[key]
             command = [terraform_path, '--version', '-json']
             output = execute_shell(
                 args=command,
-                environment=os.environ.copy(),
+                environment=self.environment(),
             )
             result = json.loads(output.decode("utf-8"))
 
             version = Version(result[version_keyname])
+            if key:
+                TERRAFORM_VERSIONS[key] = version
             return version
         except KeyError as e:
             raise e(f'version keyname was not found')
     
-    def init_command(self, cwd):
+    def init_command(self, cwd, plugin_cache=False):
         try:
             terraform_path = self.get_compatible_terraform()
             command = [
@@ -89,14 +173,43 @@ class TerraformCLI:
             ]
             output = execute_shell(
                 args=command,
-                environment=os.environ.copy(),
+                environment=self.environment(plugin_cache),
+                cwd=cwd,
+            )
+        except subprocess.CalledProcessError as e:
+            logger.error(f'Error: ({e.output})')
+            raise e
+
+    def prefetch_command(self, cwd, data_dir):
+        '''
+        Install providers for the configuration in cwd without initializing a backend or modules.
+        TF_DATA_DIR redirects the installed providers into data_dir,
+          which lets a later `terraform init` of the project reuse them instead of downloading them again.
+        '''
+        try:
+            terraform_path = self.get_compatible_terraform()
+            command = [
+                terraform_path,
+                'init',
+                '-backend=false',
+                '-input=false',
+            ]
+            environment = self.environment()
+            environment['TF_DATA_DIR'] = str(Path(data_dir).resolve())
+            output = execute_shell(
+                args=command,
+                environment=environment,
                 cwd=cwd,
             )
         except subprocess.CalledProcessError as e:
             logger.error(f'Error: ({e.output})')
             raise e
 
-    def plan_command(self, cwd):
+    def plan_command(self, cwd, targets=None):
+        '''
+        Save a plan of the project, limited to the target addresses and their dependencies when targets are set.
+        Applying the saved plan keeps the same targets.
+        '''
         try:
             terraform_path = self.get_compatible_terraform()
             command = [
@@ -105,34 +218,95 @@ class TerraformCLI:
                 '-input=false',
                 f'-out={self.plan_file}'
             ]
+            command.extend(target_arguments(targets))
             output = execute_shell(
                     args=command,
-                    environment=os.environ.copy(),
+                    environment=self.environment(),
                     cwd=cwd,
             )
         except subprocess.CalledProcessError as e:
             logger.error(f'Error: ({e.output})')
             raise e
 
-    def apply_command(self, cwd, validate_only=False):
+    def apply_command(self, cwd, validate_only=False, parallelism=None):
+        '''
+        Apply the saved plan, with at most parallelism concurrent operations when it is set
+        '''
         try:
             terraform_path = self.get_compatible_terraform()
             command = [terraform_path, 'apply', '-input=false', '-auto-approve',]
             if validate_only:
                 command.append('-target=null_resource.validation')
+            if parallelism:
+                command.append(f'-parallelism={parallelism}')
             command.append(self.plan_file)
             output = execute_shell(
                     args=command,
-                    environment=os.environ.copy(),
+                    environment=self.environment(),
                     cwd=cwd,
             )
         except subprocess.CalledProcessError as e:
             logger.error(f'Error: ({e.output})')
             raise e
 
-    def destroy_command(self, cwd):
+    def output_command(self, cwd, name=None, stderr=None):
+        '''
+        Start `terraform output -json [name]` without waiting for it to finish.
+        The caller reads stdout incrementally and is responsible for waiting on the process.
+        stderr should be a file, such as a TemporaryFile, read once the process finished,
+          a pipe left unread while stdout is read fills up and blocks terraform.
+        '''
+        terraform_path = self.get_compatible_terraform()
+        command = [terraform_path, 'output', '-json',]
+        if name:
+            command.append(name)
+        logger.info("Executing command: %s", ' '.join([str(x) for x in command]))
+        return subprocess.Popen(
+            [str(x) for x in command],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=cwd,
+            env=self.environment(),
+        )
+
+    def show_command(self, cwd, plan_file=None, stderr=None):
+        '''
+        Start `terraform show -json <plan_file>` without waiting for it to finish.
+        The caller reads stdout incrementally and is responsible for waiting on the process.
+        stderr should be a file, such as a TemporaryFile, read once the process finished,
+          a pipe left unread while stdout is read fills up and blocks terraform.
+        '''
+        terraform_path = self.get_compatible_terraform()
+        command = [terraform_path, 'show', '-json', plan_file or self.plan_file,]
+        logger.info("Executing command: %s", ' '.join([str(x) for x in command]))
+        return subprocess.Popen(
+            [str(x) for x in command],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=cwd,
+            env=self.environment(),
+        )
+
+    def refresh_plan_command(self, cwd, stdout):
         '''
-        Attempt to destroy resources.
+        Start a refresh-only plan with machine readable output written to stdout, without waiting for it to finish.
+        The state is not locked or changed and the exit code is 0 without drift, 2 with drift or 1 on errors.
+        The caller is responsible for waiting on the process.
+        '''
+        terraform_path = self.get_compatible_terraform()
+        command = [terraform_path, 'plan', '-refresh-only', '-input=false', '-lock=false', '-detailed-exitcode', '-json',]
+        logger.info("Executing command: %s", ' '.join([str(x) for x in command]))
+        return subprocess.Popen(
+            [str(x) for x in command],
+            stdout=stdout,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            env=self.environment(),
+        )
+
+    def destroy_command(self, cwd, parallelism=None):
+        '''
+        Attempt to destroy resources, with at most parallelism concurrent operations when it is set.
         If previously destroyed, a second attempt will fail with our custom modules,
           and instead requires checking of the state to confirm destruction.
         Some destructions will require manual intervention if state is left incomplete.
@@ -159,7 +333,7 @@ class TerraformCLI:
                 stderr=subprocess.PIPE,
                 shell=True,
                 cwd=cwd,
-                env=os.environ.copy(),
+                env=self.environment(),
             )
 
             if "No state file was found!" in process.stderr.decode("utf-8") \
@@ -173,9 +347,11 @@ class TerraformCLI:
                 return True
 
             command = [terraform_path, 'destroy', '-input=false', '-auto-approve',]
+            if parallelism:
+                command.append(f'-parallelism={parallelism}')
             output = execute_shell(
                     args=command,
-                    environment=os.environ.copy(),
+                    environment=self.environment(),
                     cwd=cwd,
             )
         except subprocess.CalledProcessError as e:
@@ -184,44 +360,97 @@ class TerraformCLI:
 
         return True
 
+    def mirror_providers(self, lock_file=None):
+        '''
+        Create a filesystem mirror of the providers pinned by versions.tf for the current platform
+          and a cli configuration which installs the mirrored providers only from that mirror.
+        Providers required by registry modules, such as hashicorp/cloudinit of the eks module,
+          are not known ahead of time and are still installed from their registry.
+        When a lock file is given, the versions recorded within it are mirrored.
+        The mirror is reused by terraform commands through the environment.
+
+        Returns the cli configuration file path.
+        '''
+        try:
+            terraform_path = self.get_compatible_terraform()
+            self.mirror_path.mkdir(parents=True, exist_ok=True)
+            with TemporaryDirectory(prefix='edb-terraform-mirror-') as scratch:
+                scratch = Path(scratch)
+                shutil.copyfile(self.versions_file, scratch / self.versions_file.name)
+                if lock_file:
+                    logger.info(f'Mirroring providers from lock file: {lock_file}')
+                    shutil.copyfile(lock_file, scratch / '.terraform.lock.hcl')
+                command = [
+                    terraform_path,
+                    'providers',
+                    'mirror',
+                    f'-platform={self.operating_system}_{self.architecture}',
+                    str(self.mirror_path),
+                ]
+                # The mirror is built from the registry, ignore any previously written mirror configuration
+                environment = os.environ.copy()
+                environment.pop('TF_CLI_CONFIG_FILE', None)
+                output = execute_shell(
+                    args=command,
+                    environment=environment,
+                    cwd=scratch,
+                )
+
+            # Mirrored providers are saved as <hostname>/<namespace>/<type>/
+            providers = ', '.join(
+                json.dumps('/'.join(path.relative_to(self.mirror_path).parts))
+                for path in sorted(self.mirror_path.glob('*/*/*')) if path.is_dir()
+            )
+            logger.info(f'Writing terraform cli configuration: {self.cli_config_file}')
+            self.cli_config_file.write_text(textwrap.dedent('''
+            provider_installation {{
+              filesystem_mirror {{
+                path    = "{mirror}"
+                include = [{providers}]
+              }}
+              direct {{
+                exclude = [{providers}]
+              }}
+            }}
+            ''').lstrip().format(mirror=self.mirror_path, providers=providers))
+            return self.cli_config_file
+        except Exception as e:
+            raise Exception(f'Failed to mirror providers into {self.mirror_path} - ({e})') from e
+
     def install(self):
         if self.skip_install:
             logger.info('Terraform 0 version used, skipping installation')
             return
 
-        terraform_bin = self.get_binary()
         # Skip installation if version is already installed
-        if terraform_bin == self.binary_full_path \
-            and self.check_version().to_tuple() == self.version.to_tuple():
+        if is_installed(self):
             logger.info(f'Terraform {self.version} is already installed')
             return
 
         try:
-            logger.info(f'Installing Terraform {self.version} in {self.binary_full_path}')
-            full_path = Path(self.binary_full_path)
-            full_path.unlink(missing_ok=True)
-            bin_path = Path(self.bin_path)
-            bin_path.mkdir(parents=True, exist_ok=True)
-
-            base = f'https://releases.hashicorp.com/terraform/{self.version.to_string()}/terraform_{self.version.to_string()}'
-            source_url = base + f'_{self.operating_system}_{self.architecture}.zip'
-            zip_file = Path(Request.urlretrieve(source_url)[0])
-
-            # Get sha256 checksum file
-            checksum_url = base + f'_SHA256SUMS'
-            checksum_file = Path(Request.urlretrieve(checksum_url)[0])
-
-            # Verify checksum
-            if not checksum_verify(zip_file, checksum_file, 'sha256'):
-                checksum_file.unlink(missing_ok=True)
-                zip_file.unlink(missing_ok=True)
-                raise Exception(f'Failed to verify Terraform {self.version} checksum')
-            logger.info(f'Verified Terraform {self.version} checksum')
-            checksum_file.unlink(missing_ok=True)
-
-            shutil.unpack_archive(zip_file, bin_path, 'zip')
-            zip_file.unlink(missing_ok=True)
-            full_path.chmod(0o770)
+            with install_lock(self), staging_directory(self) as staging:
+                # Reuse the installation of a concurrent setup
+                if is_installed(self):
+                    logger.info(f'Terraform {self.version} was installed by another process')
+                    return
+
+                logger.info(f'Installing Terraform {self.version} in {self.binary_full_path}')
+                staging = Path(staging)
+                base = f'https://releases.hashicorp.com/terraform/{self.version.to_string()}/terraform_{self.version.to_string()}'
+                source_url = base + f'_{self.operating_system}_{self.architecture}.zip'
+                zip_file = Path(Request.urlretrieve(source_url, staging / 'terraform.zip')[0])
+
+                # Get sha256 checksum file
+                checksum_url = base + f'_SHA256SUMS'
+                checksum_file = Path(Request.urlretrieve(checksum_url, staging / 'SHA256SUMS')[0])
+
+                # Verify checksum
+                if not checksum_verify(zip_file, checksum_file, 'sha256'):
+                    raise Exception(f'Failed to verify Terraform {self.version} checksum')
+                logger.info(f'Verified Terraform {self.version} checksum')
+
+                shutil.unpack_archive(zip_file, staging / 'bin', 'zip')
+                install_file(staging / 'bin' / self.binary_name, Path(self.binary_full_path))
         except Exception as e:
             raise Exception(f'Failed to install Terraform {self.version} - ({e})') from e
 
@@ -269,68 +498,61 @@ class JqCLI:
             logger.info('JQ 0 version used, skipping installation')
             return
 
-        jq_bin = self.get_binary()
         # Skip installation if latest already installed
-        if jq_bin == self.binary_full_path \
-            and self.check_version().to_tuple() == self.version.to_tuple():
+        if is_installed(self):
             logger.info(f'JQ {self.version} is already installed')
             return
 
         try:
-            logger.info(f'Installing JQ {self.version} in {self.binary_full_path}')
-            full_path = Path(self.binary_full_path)
-            full_path.unlink(missing_ok=True)
-            bin_path = Path(self.bin_path)
-            bin_path.mkdir(parents=True, exist_ok=True)
-
-            # Starting with version jq 1.7, the artifact release names have changed:
-            # - jq-linux64 -> jq-linux-amd64
-            # - jq-osx-amd64 -> jq-macos-amd64
-            # - arm/darwin does not exist -> jq-macos-arm64
-            base = f"https://github.com/jqlang/jq/releases/download/jq-{self.format_version}/"
-            source_url = base + f'jq-{self.operating_system}-{self.architecture}'
-            # Macos release constains macos in the name
-            if self.operating_system == "darwin":
-                source_url = base + f'jq-macos-{self.architecture}'
-            # Handle version 1.6 releases
-            if self.version.to_string().startswith('1.6'):
-                if self.architecture == "arm64":
-                    raise Exception("JQ 1.6 does not support arm64 architecture")
-
-                if self.operating_system == "linux":
-                    source_url = base + 'jq-linux64'
-
+            with install_lock(self), staging_directory(self) as staging:
+                # Reuse the installation of a concurrent setup
+                if is_installed(self):
+                    logger.info(f'JQ {self.version} was installed by another process')
+                    return
+
+                logger.info(f'Installing JQ {self.version} in {self.binary_full_path}')
+                staging = Path(staging)
+
+                # Starting with version jq 1.7, the artifact release names have changed:
+                # - jq-linux64 -> jq-linux-amd64
+                # - jq-osx-amd64 -> jq-macos-amd64
+                # - arm/darwin does not exist -> jq-macos-arm64
+                base = f"https://github.com/jqlang/jq/releases/download/jq-{self.format_version}/"
+                source_url = base + f'jq-{self.operating_system}-{self.architecture}'
+                # Macos release constains macos in the name
                 if self.operating_system == "darwin":
-                    source_url = base + 'jq-osx-amd64'
-
-            binary_file = Path(Request.urlretrieve(source_url)[0])
-
-            # Get sha256 checksum file
-            checksum_url = base + f'sha256sum.txt'
-            checksum_file = ""
-            # unzip file and get signature froms from sig/v1.6/sha256sum.txt
-            if self.version == Version("1.6"):
-                checksum_url = base + f'jq-1.6.zip'
-                checksum_zip = Path(Request.urlretrieve(checksum_url, '/tmp/jq.zip')[0])
-                checksum_file = Path('/tmp/jq-checksums')
-                temp_dir = Path('/tmp/jq')
-                shutil.unpack_archive(checksum_zip, temp_dir, 'zip')
-                shutil.move(temp_dir / 'jq-1.6/sig/v1.6/sha256sum.txt', checksum_file)
-                shutil.rmtree(temp_dir)
-            else:
-                checksum_file = Path(Request.urlretrieve(checksum_url)[0])
-
-            # Verify checksum
-            if not checksum_verify(binary_file, checksum_file, 'sha256'):
-                binary_file.unlink(missing_ok=True)
-                checksum_file.unlink(missing_ok=True)
-                raise Exception(f'Failed to verify JQ {self.version} checksum')
-            logger.info(f'Verified JQ {self.version} checksum')
-            checksum_file.unlink(missing_ok=True)
-
-            binary_file.rename(full_path)
-            binary_file.unlink(missing_ok=True)
-            full_path.chmod(0o770)
+                    source_url = base + f'jq-macos-{self.architecture}'
+                # Handle version 1.6 releases
+                if self.version.to_string().startswith('1.6'):
+                    if self.architecture == "arm64":
+                        raise Exception("JQ 1.6 does not support arm64 architecture")
+
+                    if self.operating_system == "linux":
+                        source_url = base + 'jq-linux64'
+
+                    if self.operating_system == "darwin":
+                        source_url = base + 'jq-osx-amd64'
+
+                binary_file = Path(Request.urlretrieve(source_url, staging / self.binary_name)[0])
+
+                # Get sha256 checksum file
+                checksum_url = base + f'sha256sum.txt'
+                checksum_file = ""
+                # unzip file and get signature froms from sig/v1.6/sha256sum.txt
+                if self.version == Version("1.6"):
+                    checksum_url = base + f'jq-1.6.zip'
+                    checksum_zip = Path(Request.urlretrieve(checksum_url, staging / 'jq-1.6.zip')[0])
+                    shutil.unpack_archive(checksum_zip, staging / 'sources', 'zip')
+                    checksum_file = staging / 'sources' / 'jq-1.6/sig/v1.6/sha256sum.txt'
+                else:
+                    checksum_file = Path(Request.urlretrieve(checksum_url, staging / 'sha256sum.txt')[0])
+
+                # Verify checksum
+                if not checksum_verify(binary_file, checksum_file, 'sha256'):
+                    raise Exception(f'Failed to verify JQ {self.version} checksum')
+                logger.info(f'Verified JQ {self.version} checksum')
+
+                install_file(binary_file, Path(self.binary_full_path))
         except Exception as e:
             raise Exception(f'Failed to install JQ {self.version} - ({e})') from e
 
@@ -374,36 +596,37 @@ class AwsCLI:
             return
 
         # Skip installation if latest already installed
-        if self.get_binary() == self.binary_full_path \
-            and self.check_version().to_tuple() == self.version.to_tuple():
+        if is_installed(self):
             logger.info(f'AwsCLIv2 {self.version} is already installed')
             return
 
         try:
-            logger.info(f'Installing AwsCLIv2 {self.version} in {self.binary_full_path}')
-            full_path = Path(self.binary_full_path)
-            full_path.unlink(missing_ok=True)
-            bin_path = Path(self.bin_path)
-            bin_path.mkdir(parents=True, exist_ok=True)
-
-            base = f"https://github.com/aws/aws-cli/archive/refs/tags/{self.version.to_string()}.zip"
-            source_url = base
-
-            logger.info(f'AwsCLIv2 {self.version} checksum not available')
-
-            # Create a clean virtual environment with pip available
-            builder = venv.EnvBuilder(with_pip=True, system_site_packages=False)
-            builder.create(self.default_venv)
-            pip_cmd = str(self.default_venv / 'bin' / 'pip')
-            aws_cmd = str(self.default_venv / 'bin' / 'aws')
-            command = [pip_cmd, 'install', source_url]
-            output = execute_shell(
-                args=command,
-                environment=os.environ.copy(),
-            )
+            with install_lock(self):
+                # Reuse the installation of a concurrent setup
+                if is_installed(self):
+                    logger.info(f'AwsCLIv2 {self.version} was installed by another process')
+                    return
+
+                logger.info(f'Installing AwsCLIv2 {self.version} in {self.binary_full_path}')
+                base = f"https://github.com/aws/aws-cli/archive/refs/tags/{self.version.to_string()}.zip"
+                source_url = base
+
+                logger.info(f'AwsCLIv2 {self.version} checksum not available')
+
+                # Create a clean virtual environment with pip available,
+                #   virtual environments are not relocatable so it is built in place while the lock is held
+                builder = venv.EnvBuilder(with_pip=True, system_site_packages=False, clear=True)
+                builder.create(self.default_venv)
+                pip_cmd = str(self.default_venv / 'bin' / 'pip')
+                aws_cmd = str(self.default_venv / 'bin' / 'aws')
+                command = [pip_cmd, 'install', source_url]
+                output = execute_shell(
+                    args=command,
+                    environment=os.environ.copy(),
+                )
 
-            full_path.symlink_to(aws_cmd)
-            full_path.chmod(0o770)
+                install_symlink(aws_cmd, Path(self.binary_full_path))
+                Path(self.binary_full_path).chmod(0o770)
         except Exception as e:
             raise Exception(f'Failed to install AwsCLIv2 {self.version} - ({e})') from e
 
@@ -448,31 +671,32 @@ class AzureCLI:
             return
 
         # Skip installation if latest already installed
-        if self.get_binary() == self.binary_full_path \
-            and self.check_version().to_tuple() == self.version.to_tuple():
+        if is_installed(self):
             logger.info(f'AzCLI {self.version} is already installed')
             return
 
         try:
-            logger.info(f'Installing AzCLI {self.version} in {self.binary_full_path}')
-            full_path = Path(self.binary_full_path)
-            full_path.unlink(missing_ok=True)
-            bin_path = Path(self.bin_path)
-            bin_path.mkdir(parents=True, exist_ok=True)
-
-            logger.info(f'AzCLI {self.version} checksum not available, pip installation')
-
-            builder = venv.EnvBuilder(with_pip=True, system_site_packages=False)
-            builder.create(self.default_venv)
-            pip_cmd = str(self.default_venv / 'bin' / 'pip')
-            az_cmd = str(self.default_venv / 'bin' / 'az')
-            command = [pip_cmd, 'install', f'azure-cli=={self.version.to_string()}']
-            output = execute_shell(
-                args=command,
-                environment=os.environ.copy(),
-            )
-            full_path.symlink_to(az_cmd)
-            full_path.chmod(0o770)
+            with install_lock(self):
+                # Reuse the installation of a concurrent setup
+                if is_installed(self):
+                    logger.info(f'AzCLI {self.version} was installed by another process')
+                    return
+
+                logger.info(f'Installing AzCLI {self.version} in {self.binary_full_path}')
+                logger.info(f'AzCLI {self.version} checksum not available, pip installation')
+
+                # Virtual environments are not relocatable so it is built in place while the lock is held
+                builder = venv.EnvBuilder(with_pip=True, system_site_packages=False, clear=True)
+                builder.create(self.default_venv)
+                pip_cmd = str(self.default_venv / 'bin' / 'pip')
+                az_cmd = str(self.default_venv / 'bin' / 'az')
+                command = [pip_cmd, 'install', f'azure-cli=={self.version.to_string()}']
+                output = execute_shell(
+                    args=command,
+                    environment=os.environ.copy(),
+                )
+                install_symlink(az_cmd, Path(self.binary_full_path))
+                Path(self.binary_full_path).chmod(0o770)
         except Exception as e:
             raise Exception(f'Failed to install AzCLIv2 {self.version} - ({e})') from e
 
@@ -518,33 +742,37 @@ class GoogleCLI:
             logger.info('GcloudCLI 0 version used, skipping installation')
             return
 
-        jq_bin = self.get_binary()
         # Skip installation if latest already installed
-        if jq_bin == self.binary_full_path \
-            and self.check_version() == self.version:
+        if is_installed(self):
             logger.info(f'GcloudCLI {self.version} is already installed')
             return
 
         try:
-            logger.info(f'Installing GcloudCLI {self.version} in {self.binary_full_path}')
-            full_path = Path(self.binary_full_path)
-            full_path.unlink(missing_ok=True)
-            bin_path = Path(self.bin_path)
-            bin_path.mkdir(parents=True, exist_ok=True)
-
-            base = f"https://dl.google.com/dl/cloudsdk/channels/rapid/downloads/google-cloud-cli-{self.version.to_string()}-{self.operating_system}-{self.architecture}.tar.gz"
-            source_url = base
-
-            targz_file = Path(Request.urlretrieve(source_url)[0])
-            shutil.unpack_archive(targz_file, self.default_venv, 'gztar')
-            targz_file.unlink(missing_ok=True)
-            gcloud_cmd = self.default_venv / 'google-cloud-sdk' / 'bin' / 'gcloud'
-
-            # Verify checksum
-            logger.info(f'GcloudCLI {self.version} checksum not verified')
-
-            full_path.symlink_to(gcloud_cmd)
-            full_path.chmod(0o770)
+            with install_lock(self), staging_directory(self) as staging:
+                # Reuse the installation of a concurrent setup
+                if is_installed(self):
+                    logger.info(f'GcloudCLI {self.version} was installed by another process')
+                    return
+
+                logger.info(f'Installing GcloudCLI {self.version} in {self.binary_full_path}')
+                staging = Path(staging)
+                base = f"https://dl.google.com/dl/cloudsdk/channels/rapid/downloads/google-cloud-cli-{self.version.to_string()}-{self.operating_system}-{self.architecture}.tar.gz"
+                source_url = base
+
+                targz_file = Path(Request.urlretrieve(source_url, staging / 'google-cloud-cli.tar.gz')[0])
+                shutil.unpack_archive(targz_file, staging, 'gztar')
+
+                # Verify checksum
+                logger.info(f'GcloudCLI {self.version} checksum not verified')
+
+                # Swap in the unpacked sdk, a previous sdk is removed along with the staging directory
+                sdk_path = self.default_venv / 'google-cloud-sdk'
+                sdk_path.parent.mkdir(parents=True, exist_ok=True)
+                if sdk_path.exists():
+                    os.replace(sdk_path, staging / 'previous-google-cloud-sdk')
+                os.replace(staging / 'google-cloud-sdk', sdk_path)
+                install_symlink(sdk_path / 'bin' / 'gcloud', Path(self.binary_full_path))
+                Path(self.binary_full_path).chmod(0o770)
         except Exception as e:
             raise Exception(f'Failed to install GcloudCLI {self.version} - ({e})') from e
 
@@ -589,38 +817,35 @@ class BigAnimalCLI:
             logger.info('BigAnimalCLI 0 version used, skipping installation')
             return
 
-        biganimal_bin = self.get_binary()
         # Skip installation if latest already installed
-        if biganimal_bin == self.binary_full_path \
-            and self.check_version() == self.version:
+        if is_installed(self):
             logger.info(f'BigAnimalCLI {self.version} is already installed')
             return
 
         try:
-            logger.info(f'Installing BigAnimalCLI {self.version} in {self.binary_full_path}')
-            full_path = Path(self.binary_full_path)
-            full_path.unlink(missing_ok=True)
-            bin_path = Path(self.bin_path)
-            bin_path.mkdir(parents=True, exist_ok=True)
-            script_path = Path(self.bin_path) / 'get-token.sh'
-            script_path.unlink(missing_ok=True)
-
-            base = f"https://cli.biganimal.com/download/{self.operating_system.capitalize()}/{self.architecture}/v{self.version.to_string()}/biganimal"
-            get_token = "https://raw.githubusercontent.com/EnterpriseDB/cloud-utilities/main/api/get-token.sh"
-            source_url = base
-
-            binary_file = Path(Request.urlretrieve(source_url)[0])
-            script_file = Path(Request.urlretrieve(get_token)[0])
-
-            # Verify checksum
-            logger.info(f'BigAnimalCLI {self.version} checksum not verified')
-
-            binary_file.rename(full_path)
-            binary_file.unlink(missing_ok=True)
-            script_file.rename(script_path)
-            script_file.unlink(missing_ok=True)
-            full_path.chmod(0o770)
-            script_path.chmod(0o770)
+            with install_lock(self), staging_directory(self) as staging:
+                # Reuse the installation of a concurrent setup
+                if is_installed(self):
+                    logger.info(f'BigAnimalCLI {self.version} was installed by another process')
+                    return
+
+                logger.info(f'Installing BigAnimalCLI {self.version} in {self.binary_full_path}')
+                staging = Path(staging)
+                script_path = Path(self.bin_path) / 'get-token.sh'
+
+                base = f"https://cli.biganimal.com/download/{self.operating_system.capitalize()}/{self.architecture}/v{self.version.to_string()}/biganimal"
+                get_token = "https://raw.githubusercontent.com/EnterpriseDB/cloud-utilities/main/api/get-token.sh"
+                source_url = base
+
+                binary_file = Path(Request.urlretrieve(source_url, staging / self.binary_name)[0])
+                script_file = Path(Request.urlretrieve(get_token, staging / 'get-token.sh')[0])
+
+                # Verify checksum
+                logger.info(f'BigAnimalCLI {self.version} checksum not verified')
+
+                # The binary is checked for an existing installation, so it is replaced last
+                install_file(script_file, script_path)
+                install_file(binary_file, Path(self.binary_full_path))
 
         except Exception as e:
             raise Exception(f'Failed to install BigAnimalCLI {self.version} - ({e})') from e
@@ -6,15 +6,20 @@ if not __package__:
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from edbterraform.args import Arguments
+from edbterraform.errors import EdbTerraformError
 
 def main(args=None):
     """ 
     args: can either be None or a list of arguments to be passed into parse_args
 
     Returns the dictionary from generate_terraform()
+    Errors of the library api exit with their exit code
     """
-    arg_parser = Arguments()
-    outputs = arg_parser.process_args()
+    arg_parser = Arguments(None if args is None else sys.argv[:1] + list(args))
+    try:
+        outputs = arg_parser.process_args()
+    except EdbTerraformError as e:
+        sys.exit(e.exit_code if e.exit_code != 1 else e.message)
     return outputs
 
 '''
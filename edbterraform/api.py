@@ -0,0 +1,342 @@
+'''
+Library api of edb-terraform, used by the command line and usable within a python process:
+- errors are raised as edbterraform.errors.EdbTerraformError subclasses and never exit the process
+- specs are accepted as dictionaries as well as infrastructure files
+- no global state is changed, so projects can be handled concurrently from threads
+
+ex:
+    from edbterraform import api
+    api.generate('/tmp/project', 'aws', {'regions': {...}, 'machines': {...}}, apply=True)
+    api.destroy('/tmp/project')
+'''
+import functools
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Type, Union
+
+from edbterraform import __dot_project__
+from edbterraform.CLI import TerraformCLI, JqCLI, AwsCLI, AzureCLI, GoogleCLI, BigAnimalCLI
+from edbterraform.cleanup import cleanup_tagged_resources, CleanupBackend, CLEANUP_MAX_WORKERS
+from edbterraform.drift import detect_projects_drift, DRIFT_MAX_WORKERS, DRIFT_TIMEOUT
+from edbterraform.errors import EdbTerraformError, GenerationError, TerraformCommandError, DestroyError
+from edbterraform.lib import generate_terraform, apply_project, run_terraform
+from edbterraform.network_pool import attach_project, create_network_pool, destroy_network_pool, list_network_pools, load_network_pool
+from edbterraform.outputs import save_servers_output
+from edbterraform.plan_summary import summarize_plan
+from edbterraform.reaper import reap_projects, REAP_MAX_WORKERS
+from edbterraform.scale import scale_machines
+from edbterraform.state_server import STATE_SERVER_PORT
+
+DEFAULT_BIN_PATH = Path(__dot_project__)
+DEFAULT_TERRAFORM_VERSION = TerraformCLI.max_version.to_string()
+CLOUD_SERVICE_PROVIDERS = ['aws', 'gcloud', 'azure']
+TOOLS = [TerraformCLI, JqCLI, AwsCLI, AzureCLI, GoogleCLI, BigAnimalCLI]
+
+def structured_errors(error_type: Type[EdbTerraformError]) -> Callable:
+    '''
+    Raise any unexpected exception as error_type so callers only need to handle EdbTerraformError
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except EdbTerraformError:
+                raise
+            except Exception as e:
+                message = str(e) if str(e).startswith('ERROR') else f'ERROR: {function.__name__} failed - ({e})'
+                project_path = kwargs.get('project_path', args[0] if args else None)
+                raise error_type(message, project_path=project_path if isinstance(project_path, (str, Path)) else None) from e
+        return wrapper
+    return decorator
+
+@structured_errors(GenerationError)
+def generate(
+        project_path: Union[str, Path],
+        csp: str,
+        spec: Union[Dict, str, Path],
+        *,
+        template_variables: Optional[Dict] = None,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        user_templates: Optional[List[Union[str, Path]]] = None,
+        hcl_lock_file: Optional[Union[str, Path]] = None,
+        validate: bool = False,
+        apply: bool = False,
+        destroy_existing: bool = False,
+        on_apply_failure: str = 'destroy',
+        only: Optional[List[str]] = None,
+        remote_state_type: str = 'local',
+        state_server_port: int = STATE_SERVER_PORT,
+        cloud_lookups: bool = True,
+        refresh_cloud_cache: bool = False,
+        compact_json: bool = False,
+        schedule: bool = False,
+        network_pool: Optional[str] = None,
+    ) -> Dict:
+    '''
+    Generate a project from an infrastructure spec, a dictionary or a yaml/jinja2 infrastructure file rendered with template_variables.
+    A dictionary is either the spec of csp or a whole infrastructure document keyed by csp.
+    The project is validated or applied when validate or apply is set
+      and an existing project is destroyed first with destroy_existing.
+    With schedule, apply and destroy wait for a slot of the host-wide scheduler, see edbterraform.scheduler
+    With network_pool, every region uses the network of the pool instead of creating its own
+
+    Returns project_path, terraform_output, ssh_filename and the apply report when apply is set
+    '''
+    if csp not in CLOUD_SERVICE_PROVIDERS:
+        raise GenerationError("ERROR: unknown cloud service provider %s, expected one of: %s" % (csp, ', '.join(CLOUD_SERVICE_PROVIDERS)))
+    if not isinstance(spec, (dict, str, Path)):
+        raise GenerationError("ERROR: spec must be a dictionary or an infrastructure file path, got %s" % type(spec).__name__)
+    is_file = not isinstance(spec, dict)
+    if not is_file and csp not in spec:
+        # Accept the spec itself as well as a whole infrastructure document keyed by csp
+        spec = {csp: spec}
+    pool = None
+    if network_pool:
+        if load_network_pool(network_pool)['csp'] != csp:
+            raise GenerationError("ERROR: network pool %s was not created for %s" % (network_pool, csp))
+        pool = attach_project(network_pool, project_path)
+    return generate_terraform(
+        infra_file=Path(spec).resolve() if is_file else None,
+        infra_spec=None if is_file else spec,
+        infra_template_variables=dict(template_variables or {}),
+        project_path=Path(project_path),
+        csp=csp,
+        bin_path=Path(bin_path),
+        terraform_version=terraform_version,
+        user_templates=[Path(template) for template in user_templates or []],
+        hcl_lock_file=Path(hcl_lock_file) if hcl_lock_file else None,
+        run_validation=validate,
+        apply=apply,
+        destroy=destroy_existing,
+        on_apply_failure=on_apply_failure,
+        only=list(only) if only else None,
+        remote_state_type=remote_state_type,
+        state_server_port=state_server_port,
+        cloud_lookups=cloud_lookups,
+        refresh_cloud_cache=refresh_cloud_cache,
+        compact_json=compact_json,
+        schedule=schedule,
+        network_pool=pool,
+    )
+
+@structured_errors(TerraformCommandError)
+def apply(
+        project_path: Union[str, Path],
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        only: Optional[List[str]] = None,
+        on_apply_failure: str = 'keep',
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Apply a generated project, or only the selected spec objects, ex: only=['machines:pg1,pg2']
+
+    Returns the apply report
+    '''
+    return apply_project(Path(project_path), Path(bin_path), terraform_version, list(only) if only else None, on_apply_failure, schedule)
+
+@structured_errors(DestroyError)
+def destroy(
+        project_path: Union[str, Path],
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Destroy the resources of a project and remove its directory
+    '''
+    run_terraform(Path(project_path), Path(bin_path), terraform_version, destroy=True, schedule=schedule)
+    return {'project_path': str(project_path), 'destroyed': True}
+
+@structured_errors(TerraformCommandError)
+def outputs(
+        project_path: Union[str, Path],
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        output_name: str = 'servers',
+        from_state: bool = False,
+    ) -> Dict:
+    '''
+    Save servers.yml and a file per server type from the servers output of a project
+
+    Returns the written files and the number of servers per type
+    '''
+    return save_servers_output(Path(project_path), Path(bin_path), terraform_version, output_name, from_state)
+
+@structured_errors(TerraformCommandError)
+def scale(
+        project_path: Union[str, Path],
+        machine_template: str,
+        count: int,
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        on_apply_failure: str = 'keep',
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Add or remove clones of machine_template until there are count machines and apply them
+
+    Returns the added and removed machines along with the apply report
+    '''
+    return scale_machines(Path(project_path), Path(bin_path), machine_template, count, terraform_version, on_apply_failure, schedule)
+
+@structured_errors(TerraformCommandError)
+def plan_summary(
+        project_path: Union[str, Path],
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        plan_file: Optional[str] = None,
+        create_plan: bool = False,
+        summary_file: Optional[Union[str, Path]] = None,
+    ) -> Dict:
+    '''
+    Summarize the planned actions of a saved plan per module, region and resource type
+    '''
+    return summarize_plan(Path(project_path), Path(bin_path), terraform_version, plan_file, create_plan, Path(summary_file) if summary_file else None)
+
+@structured_errors(TerraformCommandError)
+def drift(
+        project_paths: List[Union[str, Path]],
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        max_workers: int = DRIFT_MAX_WORKERS,
+        timeout: int = DRIFT_TIMEOUT,
+        report_file: Optional[Union[str, Path]] = None,
+    ) -> Dict:
+    '''
+    Detect drift of projects with concurrent refresh-only plans
+
+    Returns the status and drifted resources of each project
+    '''
+    return detect_projects_drift([Path(path) for path in project_paths], Path(bin_path), terraform_version, max_workers, timeout, Path(report_file) if report_file else None)
+
+@structured_errors(EdbTerraformError)
+def setup(
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        versions: Optional[Dict[str, str]] = None,
+        mirror_providers: bool = False,
+        lock_hcl_file: Optional[Union[str, Path]] = None,
+    ) -> Dict:
+    '''
+    Install tools into bin_path, versions is keyed by binary name, ex: {'terraform': '1.5.5', 'aws': '0'}
+      where the version 0 skips a tool and missing tools use their maximum version
+
+    Returns the binary of each tool and the terraform cli configuration when mirror_providers is set
+    '''
+    versions = versions or {}
+    installed = {}
+    for tool in TOOLS:
+        name = tool.binary_name
+        tool = tool(Path(bin_path), versions.get(name))
+        tool.install()
+        installed[name] = str(tool.get_binary())
+    if mirror_providers:
+        terraform = TerraformCLI(Path(bin_path), versions.get(TerraformCLI.binary_name))
+        installed['terraform_cli_config'] = str(terraform.mirror_providers(lock_hcl_file))
+    return installed
+
+@structured_errors(GenerationError)
+def network_pool(
+        name: str,
+        csp: str,
+        spec: Union[Dict, str, Path],
+        *,
+        template_variables: Optional[Dict] = None,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        on_apply_failure: str = 'destroy',
+        cloud_lookups: bool = True,
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Create a long-lived network pool from the regions of a spec, which projects use with generate(network_pool=name)
+
+    Returns the network pool
+    '''
+    if csp not in CLOUD_SERVICE_PROVIDERS:
+        raise GenerationError("ERROR: unknown cloud service provider %s, expected one of: %s" % (csp, ', '.join(CLOUD_SERVICE_PROVIDERS)))
+    return create_network_pool(name, csp, spec, Path(bin_path), terraform_version, template_variables, on_apply_failure, cloud_lookups, schedule)
+
+@structured_errors(DestroyError)
+def destroy_pool(
+        name: str,
+        *,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        force: bool = False,
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Destroy a network pool once no project is attached to it, or right away with force
+    '''
+    return destroy_network_pool(name, Path(bin_path), terraform_version, force, schedule)
+
+@structured_errors(EdbTerraformError)
+def network_pools() -> List[Dict]:
+    '''
+    List the network pools with the projects still attached to them
+    '''
+    return list_network_pools()
+
+@structured_errors(DestroyError)
+def reap(
+        project_paths: Optional[List[Union[str, Path]]] = None,
+        *,
+        path_prefix: Optional[Union[str, Path]] = None,
+        default_ttl: Optional[Union[int, str]] = None,
+        dry_run: bool = False,
+        max_workers: int = REAP_MAX_WORKERS,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        terraform_version: str = DEFAULT_TERRAFORM_VERSION,
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Destroy the projects whose ttl tag expired, out of project_paths or the registered projects under path_prefix.
+    Projects which lost their state have their resources deleted by tag instead.
+
+    Returns the status of each project and the number of projects per status
+    '''
+    return reap_projects(
+        [Path(path) for path in project_paths or []],
+        Path(bin_path),
+        terraform_version,
+        str(path_prefix) if path_prefix else None,
+        default_ttl,
+        max_workers,
+        dry_run,
+        schedule,
+    )
+
+@structured_errors(DestroyError)
+def force_cleanup(
+        csp: str,
+        regions: List[str],
+        tag_key: str,
+        tag_value: str,
+        *,
+        dry_run: bool = False,
+        max_workers: int = CLEANUP_MAX_WORKERS,
+        bin_path: Union[str, Path] = DEFAULT_BIN_PATH,
+        backend: Optional[CleanupBackend] = None,
+    ) -> Dict:
+    '''
+    Delete the resources tagged with tag_key=tag_value in each region, with regions cleaned concurrently.
+    With dry_run only the plan of what would be deleted is returned.
+    backend replaces the cloud provider calls, such as edbterraform.cleanup.MemoryCleanupBackend
+
+    Returns the found, deleted and failed resources per region and kind along with their totals
+    '''
+    report = cleanup_tagged_resources(csp, regions, tag_key, tag_value, Path(bin_path), dry_run, backend, max_workers)
+    counts = {
+        state: sum(len(result[state]) for kinds in report.values() for result in kinds.values())
+        for state in ['found', 'deleted', 'failed']
+    }
+    return {'regions': report, 'counts': counts}
@@ -8,7 +8,17 @@ from typing import List
 from datetime import datetime
 import json
 
-from edbterraform.lib import generate_terraform
+from edbterraform import api
+from edbterraform.lib import parse_apply_failure_policy
+from edbterraform.targets import parse_selectors
+from edbterraform.drift import DRIFT_MAX_WORKERS, DRIFT_TIMEOUT
+from edbterraform.cleanup import CLEANUP_MAX_WORKERS
+from edbterraform.registry import list_projects, project_status, REGISTRY_FILE
+from edbterraform.state_server import serve_states, STATE_SERVER_PORT, STATE_SERVER_DIRECTORY
+from edbterraform.serve import serve_jobs, SERVE_PORT, SERVE_DIRECTORY, SERVE_SOCKET, SERVE_TOKEN
+from edbterraform.scheduler import scheduler_status, SCHEDULER_FILE, SCHEDULER_LIMITS_FILE
+from edbterraform.network_pool import NETWORK_POOL_DIRECTORY
+from edbterraform.user_templates import load_servers, render_user_templates
 from edbterraform.CLI import TerraformCLI, JqCLI, AwsCLI, AzureCLI, GoogleCLI, BigAnimalCLI
 from edbterraform import __project_name__, __dot_project__, __version__
 from edbterraform.utils import logs, files
@@ -159,12 +169,81 @@ RemoteStateType = ArgumentConfig(
     When state is not set to `local`,
       force configuration of backend with `terraform init -backend-config="<KEY=VALUE | FILEPATH >"`.
     Use `cloud` to use the set cloud provider as the backend.
+    Use `local-http` to keep the state in the embedded state server with locking and versioning,
+      which is started in the background when it is not already running and configured as the project's http backend.
     Any other value can be passed as the backend type for use within providers.tf.json but will not be validated until `terraform init` is run.
 
     Default: %(default)s
     """
 )
 
+StateServerPort = ArgumentConfig(
+    names = ['--state-server-port',],
+    metavar='STATE_SERVER_PORT',
+    dest='state_server_port',
+    type=int,
+    required=False,
+    default=STATE_SERVER_PORT,
+    help='''
+        Localhost port of the embedded state server used with `--remote-state-type=local-http`.
+        Default: %(default)s
+        '''
+)
+
+StateDirectory = ArgumentConfig(
+    names = ['--state-directory',],
+    metavar='STATE_DIRECTORY',
+    dest='state_directory',
+    type=Path,
+    required=False,
+    default=STATE_SERVER_DIRECTORY,
+    help='''
+        Directory of the state server database, states.db, with compressed versions of each state.
+        Default: %(default)s
+        '''
+)
+
+ServePort = ArgumentConfig(
+    names = ['--serve-port',],
+    metavar='SERVE_PORT',
+    dest='serve_port',
+    type=int,
+    required=False,
+    default=None,
+    help=f'''
+        Localhost port of the job API instead of a unix socket, ex: {SERVE_PORT}.
+        Any local user can connect to it, so requests need the header `Authorization: Bearer <token>`
+          with the token saved under SERVE_DIRECTORY/{SERVE_TOKEN}.
+        Default: %(default)s
+        '''
+)
+
+ServeSocket = ArgumentConfig(
+    names = ['--serve-socket',],
+    metavar='SOCKET_PATH',
+    dest='serve_socket',
+    type=Path,
+    required=False,
+    default=None,
+    help=f'''
+        Unix socket path of the job API, only usable by its owner. Defaults to SERVE_DIRECTORY/{SERVE_SOCKET}
+        Default: %(default)s
+        '''
+)
+
+ServeDirectory = ArgumentConfig(
+    names = ['--serve-directory',],
+    metavar='SERVE_DIRECTORY',
+    dest='serve_directory',
+    type=Path,
+    required=False,
+    default=SERVE_DIRECTORY,
+    help='''
+        Directory of the job files and job logs, saved under jobs/<id>.json and jobs/<id>.log.
+        Default: %(default)s
+        '''
+)
+
 TerraformLockHcl = ArgumentConfig(
     names = ['--lock-hcl-file',],
     metavar='LOCK_HCL_FILE',
@@ -178,6 +257,215 @@ TerraformLockHcl = ArgumentConfig(
     '''
 )
 
+MirrorProviders = ArgumentConfig(
+    names = ['--mirror-providers',],
+    dest='mirror_providers',
+    action='store_true',
+    required=False,
+    default=False,
+    help=f'''
+        Requires terraform {TerraformCLI.min_version.to_string()} <= x <= {TerraformCLI.max_version.to_string()}
+        Create a filesystem mirror of the terraform providers for the current platform under BIN_PATH/terraform/mirror
+        along with a terraform cli configuration, BIN_PATH/terraform/mirror.tfrc, which only installs providers from the mirror.
+        edb-terraform sets TF_CLI_CONFIG_FILE to it when it runs terraform and TF_CLI_CONFIG_FILE is not already set.
+        Versions from LOCK_HCL_FILE are mirrored when it is provided.
+        Default: %(default)s
+        '''
+)
+
+OutputName = ArgumentConfig(
+    names = ['--output-name',],
+    metavar='OUTPUT_NAME',
+    dest='output_name',
+    required=False,
+    default='servers',
+    help='''
+        Terraform output which holds the servers of the project.
+        Default: %(default)s
+        '''
+)
+
+FromState = ArgumentConfig(
+    names = ['--from-state',],
+    dest='from_state',
+    action='store_true',
+    required=False,
+    default=False,
+    help='''
+        Read outputs directly from the local terraform.tfstate file instead of running `terraform output`.
+        Default: %(default)s
+        '''
+)
+
+RefreshCloudCache = ArgumentConfig(
+    names = ['--refresh-cloud-cache',],
+    dest='refresh_cloud_cache',
+    action='store_true',
+    required=False,
+    default=False,
+    help=f'''
+        Zones, image ids and instance types are looked up during generation and cached under {__dot_project__}/cache/cloud,
+        so terraform plans can skip the matching data sources.
+        Ignore the cached values and look them up again.
+        Default: %(default)s
+        '''
+)
+
+SkipCloudLookups = ArgumentConfig(
+    names = ['--skip-cloud-lookups',],
+    dest='skip_cloud_lookups',
+    action='store_true',
+    required=False,
+    default=False,
+    help='''
+        Do not look up zones, image ids and instance types during generation and only rely on terraform data sources.
+        Default: %(default)s
+        '''
+)
+
+CompactJson = ArgumentConfig(
+    names = ['--compact-json',],
+    dest='compact_json',
+    action='store_true',
+    required=False,
+    default=False,
+    help='''
+        Save terraform.tfvars.json and providers.tf.json without indentation, which is faster to write and parse with large specs.
+        Default: %(default)s
+        '''
+)
+
+Schedule = ArgumentConfig(
+    names = ['--schedule',],
+    dest='schedule',
+    action='store_true',
+    required=False,
+    default=False,
+    help=f'''
+        Wait for a slot of the host-wide scheduler before each apply or destroy.
+        Slots and terraform -parallelism are handed out per cloud service provider, account and region
+          with token buckets weighted by the planned resource changes, limits can be overridden in {SCHEDULER_LIMITS_FILE}
+        Default: %(default)s
+        '''
+)
+
+NetworkPool = ArgumentConfig(
+    names = ['--network-pool',],
+    metavar='POOL_NAME',
+    dest='network_pool',
+    required=False,
+    help=f'''
+        Use the networks of a pool created with `edb-terraform network-pool` instead of creating a vpc, subnets, routes and peering per project.
+        Every region of the infrastructure file has to be part of the pool, its cidr block and zones are replaced by the ones of the pool.
+        Pools are saved under {NETWORK_POOL_DIRECTORY}
+        Default: %(default)s
+        '''
+)
+
+PoolName = ArgumentConfig(
+    names = ['--pool-name',],
+    metavar='POOL_NAME',
+    dest='pool_name',
+    required=True,
+    help="Name of the network pool. Default: %(default)s"
+)
+
+ForceDestroy = ArgumentConfig(
+    names = ['--force',],
+    dest='force',
+    action='store_true',
+    required=False,
+    default=False,
+    help='''
+        Destroy the network pool even when projects are still attached to it.
+        Default: %(default)s
+        '''
+)
+
+ReapProjectPaths = ArgumentConfig(
+    names = ['--project-paths',],
+    metavar='PROJECT_PATH',
+    dest='project_paths',
+    type=Path,
+    nargs='+',
+    required=False,
+    help='''
+        Paths to terraform projects, the registered projects not destroyed yet are used when not set.
+        Default: %(default)s
+        '''
+)
+
+DefaultTtl = ArgumentConfig(
+    names = ['--default-ttl',],
+    metavar='TTL',
+    dest='default_ttl',
+    required=False,
+    help='''
+        Time to live of projects without a `ttl` tag within their spec, as seconds or a number followed by s, m, h, d or w. ex: 8h
+        Projects without a `ttl` tag are kept when not set.
+        Default: %(default)s
+        '''
+)
+
+CleanupProvider = ArgumentConfig(
+    names = ['--cloud-service-provider', '-c',],
+    metavar='CLOUD_SERVICE_PROVIDER',
+    dest='csp',
+    choices=['aws'],
+    default='aws',
+    help="Cloud Service Provider of the resources. Default: %(default)s"
+)
+
+TagKey = ArgumentConfig(
+    names = ['--tag-key',],
+    metavar='TAG_KEY',
+    dest='tag_key',
+    required=True,
+    help="Tag key of the resources to delete, such as terraform_hex. Default: %(default)s"
+)
+
+TagValue = ArgumentConfig(
+    names = ['--tag-value',],
+    metavar='TAG_VALUE',
+    dest='tag_value',
+    required=True,
+    help="Tag value of the resources to delete. Default: %(default)s"
+)
+
+CleanupRegions = ArgumentConfig(
+    names = ['--regions',],
+    metavar='REGION',
+    dest='regions',
+    nargs='+',
+    required=True,
+    help="Regions to clean. Default: %(default)s"
+)
+
+CleanupWorkers = ArgumentConfig(
+    names = ['--max-workers',],
+    metavar='MAX_WORKERS',
+    dest='max_workers',
+    type=int,
+    required=False,
+    default=CLEANUP_MAX_WORKERS,
+    help='''
+        Number of regions cleaned at the same time.
+        Default: %(default)s
+        '''
+)
+
+DryRun = ArgumentConfig(
+    names = ['--dry-run',],
+    dest='dry_run',
+    action='store_true',
+    required=False,
+    default=False,
+    help='''
+        Only report what would be destroyed or deleted.
+        Default: %(default)s
+        '''
+)
+
 class ProjectNameAction(argparse.Action):
     '''
     project name might be combined with Path
@@ -317,6 +605,214 @@ Apply = ArgumentConfig(
         '''
 )
 
+def apply_failure_policy(value):
+    try:
+        parse_apply_failure_policy(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+OnApplyFailure = ArgumentConfig(
+    names = ['--on-apply-failure',],
+    metavar='POLICY',
+    dest='on_apply_failure',
+    type=apply_failure_policy,
+    required=False,
+    default='destroy',
+    help='''
+        What happens to a partially applied project when `terraform apply` fails with --apply:
+        destroy - destroy the created resources and the project directory
+        keep - keep the partial state to resume with `terraform plan` and `terraform apply`
+        retry[:N] - plan and apply what is missing up to N times (default 3) with an increasing delay,
+          the partial state is kept if every attempt fails
+        The outcome and the failed resources are logged and saved under PROJECT_PATH/edb-terraform/apply-report.json
+        Default: %(default)s
+        '''
+)
+
+ApplyOnFailure = ArgumentConfig(
+    names = ['--on-apply-failure',],
+    metavar='POLICY',
+    dest='on_apply_failure',
+    type=apply_failure_policy,
+    required=False,
+    default='keep',
+    help='''
+        What happens to the project when `terraform apply` fails:
+        keep - keep the partial state to resume with `terraform plan` and `terraform apply`
+        destroy - destroy the whole project and the project directory
+        retry[:N] - plan and apply what is missing up to N times (default 3) with an increasing delay
+        Default: %(default)s
+        '''
+)
+
+def object_selector(value):
+    try:
+        parse_selectors([value])
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+Only = ArgumentConfig(
+    names = ['--only',],
+    metavar='TYPE:NAMES',
+    dest='only',
+    type=object_selector,
+    action='append',
+    required=False,
+    help='''
+        Only apply the selected spec objects along with the network of their regions, with `terraform plan -target=<address>`.
+        Types: machines, databases, aurora, alloy, kubernetes and biganimal.
+        Names are comma separated or * for every object of a type.
+        Can be repeated, ex: --only machines:pg1,pg2 --only biganimal:*
+        Default: %(default)s
+        '''
+)
+
+MachineTemplate = ArgumentConfig(
+    names = ['--machine-template',],
+    metavar='MACHINE_NAME',
+    dest='machine_template',
+    required=True,
+    help='''
+        Machine of the project to clone.
+        Clones are named with the machine name without its trailing number and an incremented number,
+          ex: pg1 -> pg2, pg3
+        Default: %(default)s
+        '''
+)
+
+MachineCount = ArgumentConfig(
+    names = ['--count',],
+    metavar='COUNT',
+    dest='count',
+    type=int,
+    required=True,
+    help='''
+        Number of machines wanted from the machine template, including the template.
+        Machines are added with their zones spread round-robin over the zones of the region,
+          or the clones with the highest numbers are removed.
+        Default: %(default)s
+        '''
+)
+
+PlanFile = ArgumentConfig(
+    names = ['--plan-file',],
+    metavar='PLAN_FILE',
+    dest='plan_file',
+    required=False,
+    default=TerraformCLI.plan_file,
+    help='''
+        Saved terraform plan, relative to PROJECT_PATH.
+        Default: %(default)s
+        '''
+)
+
+CreatePlan = ArgumentConfig(
+    names = ['--create-plan',],
+    dest='create_plan',
+    action='store_true',
+    required=False,
+    default=False,
+    help='''
+        Run `terraform init` and `terraform plan -out=PLAN_FILE` before summarizing the plan.
+        Default: %(default)s
+        '''
+)
+
+SummaryFile = ArgumentConfig(
+    names = ['--summary-file',],
+    metavar='SUMMARY_FILE',
+    dest='summary_file',
+    type=Path,
+    required=False,
+    help='''
+        Save the plan summary as json.
+        Default: %(default)s
+        '''
+)
+
+ProjectPaths = ArgumentConfig(
+    names = ['--project-paths',],
+    metavar='PROJECT_PATH',
+    dest='project_paths',
+    type=Path,
+    nargs='+',
+    required=True,
+    help="Paths to terraform projects",
+)
+
+MaxWorkers = ArgumentConfig(
+    names = ['--max-workers',],
+    metavar='MAX_WORKERS',
+    dest='max_workers',
+    type=int,
+    required=False,
+    default=DRIFT_MAX_WORKERS,
+    help='''
+        Number of projects handled at the same time.
+        Default: %(default)s
+        '''
+)
+
+ProjectTimeout = ArgumentConfig(
+    names = ['--timeout',],
+    metavar='SECONDS',
+    dest='timeout',
+    type=int,
+    required=False,
+    default=DRIFT_TIMEOUT,
+    help='''
+        Seconds each project has before terraform is stopped and the project is reported with a timeout.
+        Default: %(default)s
+        '''
+)
+
+ReportFile = ArgumentConfig(
+    names = ['--report-file',],
+    metavar='REPORT_FILE',
+    dest='report_file',
+    type=Path,
+    required=False,
+    help='''
+        Save the report as json.
+        Default: %(default)s
+        '''
+)
+
+StatusFilter = ArgumentConfig(
+    names = ['--status',],
+    metavar='STATUS',
+    dest='status',
+    required=False,
+    help='''
+        Only list projects with a status:
+        generated, applied, apply-failed, destroyed or destroy-failed
+        Default: %(default)s
+        '''
+)
+
+CloudServiceProviderFilter = ArgumentConfig(
+    names = ['--cloud-service-provider', '-c',],
+    metavar='CLOUD_SERVICE_PROVIDER',
+    dest='csp',
+    choices=['aws', 'gcloud', 'azure'],
+    required=False,
+    help="Only list projects of a Cloud Service Provider. Default: %(default)s"
+)
+
+PathPrefix = ArgumentConfig(
+    names = ['--path-prefix',],
+    metavar='PATH_PREFIX',
+    dest='path_prefix',
+    type=Path,
+    required=False,
+    help='''
+        Only list or reap projects under a directory, such as a WORK_PATH.
+        Default: %(default)s
+        '''
+)
+
 Destroy = ArgumentConfig(
     names = ['--destroy',],
     dest='destroy',
@@ -398,6 +894,8 @@ class Arguments:
             CloudServiceProvider,
             Validation,
             Apply,
+            OnApplyFailure,
+            Only,
             Destroy,
             BinPath,
             LogLevel,
@@ -408,6 +906,161 @@ class Arguments:
             TerraformLockHcl,
             TerraformVersion,
             RemoteStateType,
+            StateServerPort,
+            RefreshCloudCache,
+            SkipCloudLookups,
+            CompactJson,
+            Schedule,
+            NetworkPool,
+        ]],
+        'apply': ['Apply an existing project or only some of its spec objects\n', [
+            ProjectPath,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            Only,
+            ApplyOnFailure,
+            Schedule,
+        ]],
+        'scale': ['Add or remove clones of a machine in an existing project without generating it again\n', [
+            ProjectPath,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            MachineTemplate,
+            MachineCount,
+            ApplyOnFailure,
+            Schedule,
+        ]],
+        'plan-summary': ['Summarize the planned actions per module, region and resource type of a saved plan\n', [
+            ProjectPath,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            PlanFile,
+            CreatePlan,
+            SummaryFile,
+        ]],
+        'drift': ['Detect drift of projects with concurrent refresh-only plans\n', [
+            ProjectPaths,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            MaxWorkers,
+            ProjectTimeout,
+            ReportFile,
+        ]],
+        'list': [f'List projects registered by generate, apply and destroy under {REGISTRY_FILE}\n', [
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            StatusFilter,
+            CloudServiceProviderFilter,
+            PathPrefix,
+        ]],
+        'status': ['Print the registered status of a project\n', [
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            ProjectPath,
+        ]],
+        'scheduler': [f'Print the buckets, slots and waiting commands of the host-wide scheduler under {SCHEDULER_FILE}\n', [
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+        ]],
+        'network-pool': ['Create a long-lived pool of networks, with the regions of an infrastructure file, which projects use with `generate --network-pool`\n', [
+            PoolName,
+            InfrastructureFilePath,
+            InfrastructureTemplateVariables,
+            CloudServiceProvider,
+            OnApplyFailure,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            SkipCloudLookups,
+            Schedule,
+        ]],
+        'network-pool-destroy': ['Destroy a network pool once no project uses it\n', [
+            PoolName,
+            ForceDestroy,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            Schedule,
+        ]],
+        'reap': ['Destroy the projects whose `ttl` tag, counted from their `terraform_time` tag, expired\n', [
+            ReapProjectPaths,
+            PathPrefix,
+            DefaultTtl,
+            DryRun,
+            MaxWorkers,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            Schedule,
+        ]],
+        'force-cleanup': ['Delete the resources with a tag left behind when terraform can no longer destroy them, regions are cleaned concurrently\n', [
+            CleanupProvider,
+            TagKey,
+            TagValue,
+            CleanupRegions,
+            DryRun,
+            CleanupWorkers,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+        ]],
+        'network-pools': ['List the network pools and the projects attached to them\n', [
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+        ]],
+        'state-server': ['Serve terraform states for the http backend used by `--remote-state-type=local-http`\n', [
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            StateServerPort,
+            StateDirectory,
+        ]],
+        'serve': ['Serve a local job API which runs generate, apply, destroy and outputs jobs on a pool of workers\n', [
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            ServePort,
+            ServeSocket,
+            ServeDirectory,
+            MaxWorkers,
         ]],
         'setup': ['Install needed software such as Terraform inside a bin directory\n',[
             BinPath,
@@ -421,6 +1074,30 @@ class Arguments:
             AzureVersion,
             GcloudVersion,
             BigAnimalVersion,
+            MirrorProviders,
+            TerraformLockHcl,
+        ]],
+        'outputs': ['Stream the servers output of an applied project into servers.yml and servers/<type>.yml\n', [
+            ProjectPath,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            OutputName,
+            FromState,
+        ]],
+        'render-templates': ['Render user templates of an applied project with its servers output\n', [
+            ProjectPath,
+            BinPath,
+            LogLevel,
+            LogFile,
+            LogDirectory,
+            LogStdout,
+            TerraformVersion,
+            OutputName,
+            FromState,
         ]],
         'version': ['Print the version of edb-terraform\n', []],
         'help': ['(experimental) Print variable information about a given terraform project\n', [
@@ -434,10 +1111,13 @@ class Arguments:
     DEFAULT_COMMAND = next(iter(COMMANDS))
     VERSION_MESSAGE=f'Version: {__version__}\n'
 
-    def __init__(self, args:List[str]=sys.argv, parser=argparse.ArgumentParser()):
-        self.parser = parser
+    def __init__(self, args:List[str]=None, parser=None):
+        self.parser = parser if parser else argparse.ArgumentParser()
         self.subparsers = self.parser.add_subparsers()
-        self.command = self.override_sys_argv(args)
+        # Arguments are normalized on a copy, sys.argv is left as is
+        self.argv = list(sys.argv if args is None else args)
+        self.command = self.normalize_argv()
+        args = self.argv
         self.subparsers.default = Arguments.DEFAULT_COMMAND
 
         for name, arg_configs in self.COMMANDS.items():
@@ -465,50 +1145,50 @@ class Arguments:
 
             subparser.usage = arg_configs[0]+self.VERSION_MESSAGE+subparser.format_usage()
 
-        self.env = self.parser.parse_args()
+        self.env = self.parser.parse_args(self.argv[1:])
 
-    def override_sys_argv(self, args: List[str]):
+    def normalize_argv(self):
         '''
-        Override sys.argv and return the default command
+        Normalize self.argv and return the default command
         This is needed for backwards compatability,
         as we did not have multiple commands previously.
         '''
         # Set default subparser if not provided
-        sys.argv = args
+        argv = self.argv
         program_name = self.parser.prog
         program_index = 0 # programs index
         command_index = program_index+1 # First argument after program name
 
         # Find the programs initial index since it may not be the first argument
-        for index, argument in enumerate(sys.argv):
+        for index, argument in enumerate(argv):
             if argument == program_name:
                 program_index = index
                 command_index = index+1
                 break
 
-        if program_index < len(sys.argv)-1 and \
-            sys.argv[command_index] not in Arguments.COMMANDS and \
-            not any(x in sys.argv for x in ['-h', '--help', '-v', '--version']):
-            sys.argv.insert(command_index, Arguments.DEFAULT_COMMAND)
-            return sys.argv[command_index]
+        if program_index < len(argv)-1 and \
+            argv[command_index] not in Arguments.COMMANDS and \
+            not any(x in argv for x in ['-h', '--help', '-v', '--version']):
+            argv.insert(command_index, Arguments.DEFAULT_COMMAND)
+            return argv[command_index]
         # Set help if seen
-        elif program_index < len(sys.argv)-1 and \
-            '-h' in sys.argv or '--help' in sys.argv:
-            sys.argv = sys.argv[:command_index+1] + ['--help']
-            return sys.argv[command_index]
+        elif program_index < len(argv)-1 and \
+            '-h' in argv or '--help' in argv:
+            self.argv = argv = argv[:command_index+1] + ['--help']
+            return argv[command_index]
         # Set version command if seen
-        elif program_index < len(sys.argv)-1 and \
-            '-v' in sys.argv or '--version' in sys.argv:
-            sys.argv = sys.argv[:command_index] + ['version']
-            return sys.argv[command_index]
+        elif program_index < len(argv)-1 and \
+            '-v' in argv or '--version' in argv:
+            self.argv = argv = argv[:command_index] + ['version']
+            return argv[command_index]
         # Set help if no arguments are provided
-        elif program_index == len(sys.argv)-1:
-            sys.argv.insert(command_index, '-h')
-            return sys.argv[command_index]
-        elif program_index < len(sys.argv)-1:
-            return sys.argv[command_index]
+        elif program_index == len(argv)-1:
+            argv.insert(command_index, '-h')
+            return argv[command_index]
+        elif program_index < len(argv)-1:
+            return argv[command_index]
 
-        return sys.argv[program_index]
+        return argv[program_index]
 
     def get_env(self, key, default=None):
         '''
@@ -537,13 +1217,13 @@ class Arguments:
             stdout=not self.get_env('no_console_log'),
         )
         if self.command == 'depreciated':
-            outputs = generate_terraform(
-                infra_file=self.get_env('infra_file'),
+            outputs = api.generate(
                 project_path=self.get_env('project_path'),
                 csp=self.get_env('csp'),
+                spec=self.get_env('infra_file'),
                 bin_path=self.get_env('bin_path'),
-                run_validation=self.get_env('run_validation'),
-                terraform_version=self.get_env('terraform_version'),
+                validate=self.get_env('run_validation'),
+                terraform_version=self.get_env('terraform_cli_version'),
             )
 
         if self.command == 'help':
@@ -552,29 +1232,187 @@ class Arguments:
             print(hcl2.variable_help_message(results))
 
         if self.command == 'generate':
-            outputs = generate_terraform(
-                infra_file=self.get_env('infra_file'),
-                infra_template_variables=self.get_env('infra_template_variables'),
+            outputs = api.generate(
                 project_path=self.get_env('work_path') / self.get_env('project_name'),
                 csp=self.get_env('csp'),
+                spec=self.get_env('infra_file'),
+                template_variables=self.get_env('infra_template_variables'),
                 bin_path=self.get_env('bin_path'),
                 user_templates=self.get_env('user_templates'),
                 hcl_lock_file=self.get_env('lock_hcl_file'),
-                run_validation=self.get_env('run_validation'),
+                validate=self.get_env('run_validation'),
                 apply=self.get_env('apply'),
-                destroy=self.get_env('destroy'),
+                destroy_existing=self.get_env('destroy'),
                 remote_state_type = self.get_env('remote_state_type'),
-                terraform_version=self.get_env('terraform_version'),
+                state_server_port=self.get_env('state_server_port'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                cloud_lookups=not self.get_env('skip_cloud_lookups'),
+                refresh_cloud_cache=self.get_env('refresh_cloud_cache'),
+                on_apply_failure=self.get_env('on_apply_failure'),
+                only=self.get_env('only'),
+                compact_json=self.get_env('compact_json'),
+                schedule=self.get_env('schedule'),
+                network_pool=self.get_env('network_pool'),
             )
             print(json.dumps(outputs, separators=(',', ':')))
 
+        if self.command == 'apply':
+            outputs = api.apply(
+                project_path=self.get_env('project_path'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                only=self.get_env('only'),
+                on_apply_failure=self.get_env('on_apply_failure'),
+                schedule=self.get_env('schedule'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'outputs':
+            outputs = api.outputs(
+                project_path=self.get_env('project_path'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                output_name=self.get_env('output_name'),
+                from_state=self.get_env('from_state'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'render-templates':
+            servers = load_servers(
+                project_path=self.get_env('project_path'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                output_name=self.get_env('output_name'),
+                from_state=self.get_env('from_state'),
+            )
+            outputs = render_user_templates(self.get_env('project_path'), servers)
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'scale':
+            outputs = api.scale(
+                project_path=self.get_env('project_path'),
+                bin_path=self.get_env('bin_path'),
+                machine_template=self.get_env('machine_template'),
+                count=self.get_env('count'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                on_apply_failure=self.get_env('on_apply_failure'),
+                schedule=self.get_env('schedule'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'plan-summary':
+            outputs = api.plan_summary(
+                project_path=self.get_env('project_path'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                plan_file=self.get_env('plan_file'),
+                create_plan=self.get_env('create_plan'),
+                summary_file=self.get_env('summary_file'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'drift':
+            outputs = api.drift(
+                project_paths=self.get_env('project_paths'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                max_workers=self.get_env('max_workers'),
+                timeout=self.get_env('timeout'),
+                report_file=self.get_env('report_file'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'list':
+            outputs = list_projects(
+                status=self.get_env('status'),
+                csp=self.get_env('csp'),
+                path_prefix=self.get_env('path_prefix'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'status':
+            outputs = project_status(self.get_env('project_path'))
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'scheduler':
+            outputs = scheduler_status()
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'network-pool':
+            outputs = api.network_pool(
+                name=self.get_env('pool_name'),
+                csp=self.get_env('csp'),
+                spec=self.get_env('infra_file'),
+                template_variables=self.get_env('infra_template_variables'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                on_apply_failure=self.get_env('on_apply_failure'),
+                cloud_lookups=not self.get_env('skip_cloud_lookups'),
+                schedule=self.get_env('schedule'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'network-pool-destroy':
+            outputs = api.destroy_pool(
+                name=self.get_env('pool_name'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                force=self.get_env('force'),
+                schedule=self.get_env('schedule'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'network-pools':
+            outputs = api.network_pools()
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'reap':
+            outputs = api.reap(
+                project_paths=self.get_env('project_paths'),
+                path_prefix=self.get_env('path_prefix'),
+                default_ttl=self.get_env('default_ttl'),
+                dry_run=self.get_env('dry_run'),
+                max_workers=self.get_env('max_workers'),
+                bin_path=self.get_env('bin_path'),
+                terraform_version=self.get_env('terraform_cli_version'),
+                schedule=self.get_env('schedule'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'force-cleanup':
+            outputs = api.force_cleanup(
+                csp=self.get_env('csp'),
+                regions=self.get_env('regions'),
+                tag_key=self.get_env('tag_key'),
+                tag_value=self.get_env('tag_value'),
+                dry_run=self.get_env('dry_run'),
+                max_workers=self.get_env('max_workers'),
+                bin_path=self.get_env('bin_path'),
+            )
+            print(json.dumps(outputs, separators=(',', ':')))
+
+        if self.command == 'state-server':
+            serve_states(
+                directory=self.get_env('state_directory'),
+                port=self.get_env('state_server_port'),
+            )
+
+        if self.command == 'serve':
+            serve_jobs(
+                directory=self.get_env('serve_directory'),
+                port=self.get_env('serve_port'),
+                socket_path=self.get_env('serve_socket'),
+                max_workers=self.get_env('max_workers'),
+                bin_path=self.get_env('bin_path'),
+            )
+
         if self.command == 'setup':
-            installed = {}
-            for tool in [TerraformCLI, JqCLI, AwsCLI, AzureCLI, GoogleCLI, BigAnimalCLI]:
-                name = tool.binary_name
-                tool = tool(self.get_env('bin_path'), self.get_env(f'{name}_cli_version'))
-                tool.install()
-                installed[name] = str(tool.get_binary())
+            installed = api.setup(
+                bin_path=self.get_env('bin_path'),
+                versions={tool.binary_name: self.get_env(f'{tool.binary_name}_cli_version') for tool in api.TOOLS},
+                mirror_providers=self.get_env('mirror_providers'),
+                lock_hcl_file=self.get_env('lock_hcl_file'),
+            )
             print(json.dumps(installed, separators=(',', ':')))
             outputs = installed
 
@@ -0,0 +1,356 @@
+'''
+Force cleanup of the resources left behind once terraform can no longer destroy them, found by a tag.
+Regions are cleaned at the same time while the resource kinds of a region are deleted in CLEANUP_ORDER,
+  each kind with as few calls as the cloud provider allows.
+'''
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from edbterraform.CLI import AwsCLI
+from edbterraform.utils.logs import ContextThreadPoolExecutor, logger
+from edbterraform.utils.script import execute_command
+
+# Resource kinds deleted in order so dependencies are removed first,
+#   everything holding network interfaces within the subnets goes before the subnets and vpcs
+CLEANUP_ORDER = [
+    'eks_nodegroups',
+    'eks_clusters',
+    'load_balancers',
+    'target_groups',
+    'instances',
+    'db_instances',
+    'db_clusters',
+    'db_subnet_groups',
+    'db_parameter_groups',
+    'db_cluster_parameter_groups',
+    'nat_gateways',
+    'peering_connections',
+    'network_interfaces',
+    'volumes',
+    'key_pairs',
+    'security_groups',
+    'subnets',
+    'route_tables',
+    'internet_gateways',
+    'vpcs',
+]
+# Regions cleaned at the same time
+CLEANUP_MAX_WORKERS = 8
+
+class CleanupBackend(ABC):
+    '''
+    Cloud provider calls used to find and delete resources by tag.
+    Any object with the same methods can be used, such as MemoryCleanupBackend during tests,
+      subclasses have to implement every method.
+    '''
+    @abstractmethod
+    def find(self, region: str, kind: str, tag_key: str, tag_value: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    def delete(self, region: str, kind: str, resource_ids: List[str]) -> Dict[str, str]:
+        '''
+        Delete resources of the same kind
+
+        Returns {<id>: <error>} of the resources which could not be deleted
+        '''
+        ...
+
+class AwsCleanupBackend(CleanupBackend):
+    '''
+    Tagged resources found and deleted with the aws cli.
+    EC2 resources are found with their describe command,
+      other services with the resource groups tagging api and are identified by their ARN.
+    '''
+    # kind: (describe command, filters besides the tag, query of the ids)
+    DESCRIBE = {
+        'instances': ('describe-instances', ['Name=instance-state-name,Values=pending,running,stopping,stopped'], 'Reservations[].Instances[].InstanceId'),
+        'nat_gateways': ('describe-nat-gateways', ['Name=state,Values=pending,available,failed'], 'NatGateways[].NatGatewayId'),
+        'peering_connections': ('describe-vpc-peering-connections', ['Name=status-code,Values=pending-acceptance,provisioning,active'], 'VpcPeeringConnections[].VpcPeeringConnectionId'),
+        'network_interfaces': ('describe-network-interfaces', ['Name=status,Values=available'], 'NetworkInterfaces[].NetworkInterfaceId'),
+        'volumes': ('describe-volumes', [], 'Volumes[].VolumeId'),
+        'key_pairs': ('describe-key-pairs', [], 'KeyPairs[].KeyPairId'),
+        'security_groups': ('describe-security-groups', [], 'SecurityGroups[].GroupId'),
+        'subnets': ('describe-subnets', [], 'Subnets[].SubnetId'),
+        'route_tables': ('describe-route-tables', [], 'RouteTables[].RouteTableId'),
+        'internet_gateways': ('describe-internet-gateways', [], 'InternetGateways[].InternetGatewayId'),
+        'vpcs': ('describe-vpcs', [], 'Vpcs[].VpcId'),
+    }
+    # kind: resource type of the resource groups tagging api
+    TAGGED = {
+        'eks_nodegroups': 'eks:nodegroup',
+        'eks_clusters': 'eks:cluster',
+        'load_balancers': 'elasticloadbalancing:loadbalancer',
+        'target_groups': 'elasticloadbalancing:targetgroup',
+        'db_instances': 'rds:db',
+        'db_clusters': 'rds:cluster',
+        'db_subnet_groups': 'rds:subgrp',
+        'db_parameter_groups': 'rds:pg',
+        'db_cluster_parameter_groups': 'rds:cluster-pg',
+    }
+    # kind: (service, delete command, id option, wait command), deleted one resource per call and waited on once all are deleted
+    DELETE = {
+        'load_balancers': ('elbv2', 'delete-load-balancer', '--load-balancer-arn', None),
+        'target_groups': ('elbv2', 'delete-target-group', '--target-group-arn', None),
+        'db_instances': ('rds', 'delete-db-instance', '--db-instance-identifier', 'db-instance-deleted'),
+        'db_clusters': ('rds', 'delete-db-cluster', '--db-cluster-identifier', 'db-cluster-deleted'),
+        'db_subnet_groups': ('rds', 'delete-db-subnet-group', '--db-subnet-group-name', None),
+        'db_parameter_groups': ('rds', 'delete-db-parameter-group', '--db-parameter-group-name', None),
+        'db_cluster_parameter_groups': ('rds', 'delete-db-cluster-parameter-group', '--db-cluster-parameter-group-name', None),
+        'nat_gateways': ('ec2', 'delete-nat-gateway', '--nat-gateway-id', None),
+        'peering_connections': ('ec2', 'delete-vpc-peering-connection', '--vpc-peering-connection-id', None),
+        'network_interfaces': ('ec2', 'delete-network-interface', '--network-interface-id', None),
+        'volumes': ('ec2', 'delete-volume', '--volume-id', None),
+        'key_pairs': ('ec2', 'delete-key-pair', '--key-pair-id', None),
+        'security_groups': ('ec2', 'delete-security-group', '--group-id', None),
+        'subnets': ('ec2', 'delete-subnet', '--subnet-id', None),
+        'route_tables': ('ec2', 'delete-route-table', '--route-table-id', None),
+        'internet_gateways': ('ec2', 'delete-internet-gateway', '--internet-gateway-id', None),
+        'vpcs': ('ec2', 'delete-vpc', '--vpc-id', None),
+    }
+    # Extra options of delete commands
+    DELETE_OPTIONS = {
+        'db_instances': ['--skip-final-snapshot', '--delete-automated-backups'],
+        'db_clusters': ['--skip-final-snapshot'],
+    }
+    # Most ids accepted by a single call
+    BATCH_SIZE = 500
+    # Errors of resources already gone, the tagging api is eventually consistent and still lists them for a while
+    NOT_FOUND = ('NotFound', 'NotFoundFault', 'ResourceNotFoundException')
+
+    def __init__(self, bin_path=None):
+        self.binary = AwsCLI(bin_path).get_binary()
+        if not self.binary:
+            raise FileNotFoundError("ERROR: aws cli not found, install it with `edb-terraform setup`")
+
+    def aws(self, region, *arguments):
+        output = execute_command(
+            args=[self.binary, *arguments, '--region', region, '--output', 'json'],
+            environment=os.environ.copy(),
+        )
+        output = output.decode('utf-8').strip()
+        return json.loads(output) if output else None
+
+    def find(self, region, kind, tag_key, tag_value):
+        if kind in self.TAGGED:
+            return self.aws(region, 'resourcegroupstaggingapi', 'get-resources',
+                            '--resource-type-filters', self.TAGGED[kind],
+                            '--tag-filters', f'Key={tag_key},Values={tag_value}',
+                            '--query', 'ResourceTagMappingList[].ResourceARN') or []
+        command, filters, query = self.DESCRIBE[kind]
+        # describe-nat-gateways names its filters option differently
+        option = '--filter' if kind == 'nat_gateways' else '--filters'
+        return self.aws(region, 'ec2', command, option, f'Name=tag:{tag_key},Values={tag_value}', *filters, '--query', query) or []
+
+    def attempt(self, resource_id, call, failed):
+        try:
+            call()
+        except Exception as e:
+            error = error_message(e)
+            if not any(name in error for name in self.NOT_FOUND):
+                failed[resource_id] = error
+
+    def delete(self, region, kind, resource_ids):
+        failed = {}
+        if kind == 'instances':
+            for start in range(0, len(resource_ids), self.BATCH_SIZE):
+                batch = resource_ids[start:start + self.BATCH_SIZE]
+                try:
+                    self.aws(region, 'ec2', 'terminate-instances', '--instance-ids', *batch)
+                    self.aws(region, 'ec2', 'wait', 'instance-terminated', '--instance-ids', *batch)
+                except Exception as e:
+                    failed.update({resource_id: error_message(e) for resource_id in batch})
+            return failed
+
+        if kind in ('eks_nodegroups', 'eks_clusters'):
+            # arn:aws:eks:<region>:<account>:nodegroup/<cluster>/<nodegroup>/<id> or cluster/<cluster>
+            names = {arn: arn.split(':', 5)[5].split('/')[1:3] for arn in resource_ids}
+            for arn, name in names.items():
+                if kind == 'eks_nodegroups':
+                    self.attempt(arn, lambda: self.aws(region, 'eks', 'delete-nodegroup', '--cluster-name', name[0], '--nodegroup-name', name[1]), failed)
+                else:
+                    self.attempt(arn, lambda: self.aws(region, 'eks', 'delete-cluster', '--name', name[0]), failed)
+            for arn, name in names.items():
+                if arn in failed:
+                    continue
+                if kind == 'eks_nodegroups':
+                    self.attempt(arn, lambda: self.aws(region, 'eks', 'wait', 'nodegroup-deleted', '--cluster-name', name[0], '--nodegroup-name', name[1]), failed)
+                else:
+                    self.attempt(arn, lambda: self.aws(region, 'eks', 'wait', 'cluster-deleted', '--name', name[0]), failed)
+            return failed
+
+        if kind == 'route_tables':
+            # Associations of every route table are found with a single call
+            associations = self.aws(region, 'ec2', 'describe-route-tables', '--route-table-ids', *resource_ids,
+                                    '--query', 'RouteTables[].Associations[?!Main][].RouteTableAssociationId') or []
+            for association in associations:
+                self.aws(region, 'ec2', 'disassociate-route-table', '--association-id', association)
+        if kind == 'internet_gateways':
+            attachments = self.aws(region, 'ec2', 'describe-internet-gateways', '--internet-gateway-ids', *resource_ids,
+                                   '--query', 'InternetGateways[].{id: InternetGatewayId, vpcs: Attachments[].VpcId}') or []
+            for attachment in attachments:
+                for vpc in attachment['vpcs'] or []:
+                    self.aws(region, 'ec2', 'detach-internet-gateway', '--internet-gateway-id', attachment['id'], '--vpc-id', vpc)
+        if kind == 'vpcs':
+            self.delete_vpc_dependencies(region, resource_ids)
+
+        service, command, option, wait = self.DELETE[kind]
+        # rds resources are named by the end of their ARN, ex: arn:aws:rds:<region>:<account>:db:<identifier>
+        names = {resource_id: resource_id.split(':', 6)[6] if service == 'rds' else resource_id for resource_id in resource_ids}
+        for resource_id, name in names.items():
+            self.attempt(resource_id, lambda: self.aws(region, service, command, option, name, *self.DELETE_OPTIONS.get(kind, [])), failed)
+        if kind == 'nat_gateways':
+            deleted = [resource_id for resource_id in resource_ids if resource_id not in failed]
+            if deleted:
+                # The network interfaces of nat gateways are only released once they are deleted
+                try:
+                    self.aws(region, 'ec2', 'wait', 'nat-gateway-deleted', '--nat-gateway-ids', *deleted)
+                except Exception as e:
+                    failed.update({resource_id: error_message(e) for resource_id in deleted})
+        elif wait:
+            for resource_id, name in names.items():
+                if resource_id not in failed:
+                    self.attempt(resource_id, lambda: self.aws(region, service, 'wait', wait, option, name), failed)
+        return failed
+
+    def delete_vpc_dependencies(self, region, vpc_ids):
+        # Untagged resources created within the vpcs, such as those of other tools, which keep a vpc from being deleted
+        vpcs = 'Name=vpc-id,Values=%s' % ','.join(vpc_ids)
+        dependencies = [
+            ('describe-network-interfaces', "NetworkInterfaces[?Status == 'available'].NetworkInterfaceId", 'delete-network-interface', '--network-interface-id'),
+            ('describe-security-groups', "SecurityGroups[?GroupName != 'default'].GroupId", 'delete-security-group', '--group-id'),
+            ('describe-subnets', 'Subnets[].SubnetId', 'delete-subnet', '--subnet-id'),
+            ('describe-route-tables', 'RouteTables[?!(Associations[?Main])].RouteTableId', 'delete-route-table', '--route-table-id'),
+            ('describe-network-acls', 'NetworkAcls[?!IsDefault].NetworkAclId', 'delete-network-acl', '--network-acl-id'),
+        ]
+        for describe, query, command, option in dependencies:
+            try:
+                for resource_id in self.aws(region, 'ec2', describe, '--filters', vpcs, '--query', query) or []:
+                    self.aws(region, 'ec2', command, option, resource_id)
+            except Exception as e:
+                logger.warning(f'Could not delete vpc dependencies with {command} in {region} - ({error_message(e)})')
+
+class MemoryCleanupBackend(CleanupBackend):
+    '''
+    Local stand-in of a cloud provider which keeps resources in memory, used to try out a cleanup or within tests:
+      {<region>: {<kind>: {<id>: {'tags': {<key>: <value>}, 'depends_on': [<id>, ...]}}}}
+    A resource cannot be deleted while another resource depends on it, the same as a cloud provider refusing it.
+    Every call is saved within calls as (region, method, kind, ids).
+    '''
+    def __init__(self, resources: Dict):
+        self.resources = resources
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def find(self, region, kind, tag_key, tag_value):
+        with self.lock:
+            self.calls.append((region, 'find', kind, []))
+            return sorted(
+                resource_id for resource_id, resource in self.resources.get(region, {}).get(kind, {}).items()
+                if resource.get('tags', {}).get(tag_key) == tag_value
+            )
+
+    def delete(self, region, kind, resource_ids):
+        failed = {}
+        with self.lock:
+            self.calls.append((region, 'delete', kind, list(resource_ids)))
+            resources = self.resources.get(region, {})
+            for resource_id in resource_ids:
+                dependents = sorted(
+                    other for kinds in resources.values() for other, resource in kinds.items()
+                    if resource_id in resource.get('depends_on', [])
+                )
+                if resource_id not in resources.get(kind, {}):
+                    failed[resource_id] = f'{resource_id} not found'
+                elif dependents:
+                    failed[resource_id] = f'DependencyViolation: {resource_id} is used by {", ".join(dependents)}'
+                else:
+                    del resources[kind][resource_id]
+        return failed
+
+def error_message(error: Exception) -> str:
+    # Failed aws cli commands keep their output, which holds the reason
+    output = getattr(error, 'output', None)
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', errors='replace')
+    return (output or str(error)).strip()
+
+CLEANUP_BACKENDS = {
+    'aws': AwsCleanupBackend,
+}
+
+def cleanup_backend(csp: str, bin_path=None) -> CleanupBackend:
+    if csp not in CLEANUP_BACKENDS:
+        raise ValueError("ERROR: tag based cleanup is not supported for %s, supported: %s" % (csp, ', '.join(CLEANUP_BACKENDS)))
+    return CLEANUP_BACKENDS[csp](bin_path)
+
+def cleanup_region(
+        backend: CleanupBackend,
+        region: str,
+        tag_key: str,
+        tag_value: str,
+        dry_run: bool = False,
+    ) -> Dict:
+    '''
+    Find the tagged resources of a region and delete them kind by kind in CLEANUP_ORDER.
+    Each kind is looked up right before it is deleted, so resources removed along with another one are skipped.
+    Failures are kept and the cleanup goes on so a single stuck resource leaves the rest deleted.
+
+    Returns {<kind>: {'found': [], 'deleted': [], 'failed': {<id>: <error>}}} of the kinds found
+    '''
+    report = {}
+    for kind in CLEANUP_ORDER:
+        try:
+            found = backend.find(region, kind, tag_key, tag_value)
+        except Exception as e:
+            report[kind] = {'found': [], 'deleted': [], 'failed': {'*': error_message(e)}}
+            logger.warning(f'Could not find {kind} in {region} - ({error_message(e)})')
+            continue
+        if not found:
+            continue
+        report[kind] = {'found': found, 'deleted': [], 'failed': {}}
+        logger.info(f'{"Would delete" if dry_run else "Deleting"} {len(found)} {kind} tagged {tag_key}={tag_value} in {region}')
+        if dry_run:
+            continue
+        try:
+            failed = backend.delete(region, kind, found)
+        except Exception as e:
+            failed = {resource_id: error_message(e) for resource_id in found}
+        for resource_id, error in failed.items():
+            logger.warning(f'Could not delete {kind} {resource_id} in {region} - ({error})')
+        report[kind]['failed'] = failed
+        report[kind]['deleted'] = [resource_id for resource_id in found if resource_id not in failed]
+    return report
+
+def cleanup_tagged_resources(
+        csp: str,
+        regions: List[str],
+        tag_key: str,
+        tag_value: str,
+        bin_path=None,
+        dry_run: bool = False,
+        backend: Optional[CleanupBackend] = None,
+        max_workers: int = CLEANUP_MAX_WORKERS,
+    ) -> Dict:
+    '''
+    Delete the resources tagged with tag_key=tag_value, with at most max_workers regions cleaned at the same time.
+    With dry_run, the resources are only found and the report is the plan of what would be deleted.
+
+    Returns {<region>: {<kind>: {'found': [], 'deleted': [], 'failed': {<id>: <error>}}}}
+    '''
+    if not tag_key or not tag_value:
+        raise ValueError("ERROR: tag based cleanup needs a tag key and value")
+    backend = backend or cleanup_backend(csp, bin_path)
+    regions = list(dict.fromkeys(regions))
+    report = {}
+    with ContextThreadPoolExecutor(max_workers=max(1, min(len(regions), max_workers)), thread_name_prefix='cleanup') as executor:
+        for region, result in zip(regions, executor.map(lambda region: cleanup_region(backend, region, tag_key, tag_value, dry_run), regions)):
+            report[region] = result
+    return report
+
+def cleanup_failures(report: Dict) -> int:
+    # Number of resources left behind by cleanup_tagged_resources
+    return sum(len(result['failed']) for kinds in report.values() for result in kinds.values())
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from edbterraform import __dot_project__
+from edbterraform.CLI import AwsCLI
+from edbterraform.utils.files import write_json_file
+from edbterraform.utils.logs import ContextThreadPoolExecutor, logger
+from edbterraform.utils.script import execute_command
+
+CACHE_DIRECTORY = Path(__dot_project__) / 'cache' / 'cloud'
+# Seconds each kind of lookup is reused before the cloud provider is asked again
+CACHE_TTLS = {
+    'zones': 24 * 60 * 60,
+    'images': 6 * 60 * 60,
+    'instance_types': 24 * 60 * 60,
+}
+FILE_PERMISSIONS = 0o600
+
+class CloudLookupBackend(ABC):
+    '''
+    Cloud provider calls used to resolve values during generation.
+    Any object with the same methods can be used, such as a local stand-in during tests,
+      subclasses have to implement every method.
+    '''
+    # Separates cached values between accounts or profiles
+    account = 'default'
+
+    @abstractmethod
+    def zones(self, region: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    def image_id(self, region: str, image: Dict) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def instance_types(self, region: str) -> List[str]:
+        ...
+
+class AwsLookupBackend(CloudLookupBackend):
+    '''
+    Lookups done with the aws cli, the same as the data sources used by the terraform modules
+    '''
+    def __init__(self, bin_path=None):
+        self.binary = AwsCLI(bin_path).get_binary()
+        if not self.binary:
+            raise FileNotFoundError("ERROR: aws cli not found, install it with `edb-terraform setup`")
+        self.account = os.environ.get('AWS_PROFILE', os.environ.get('AWS_ACCESS_KEY_ID', 'default'))
+
+    def aws(self, region, *arguments):
+        output = execute_command(
+            args=[self.binary, *arguments, '--region', region, '--output', 'json'],
+            environment=os.environ.copy(),
+        )
+        return json.loads(output.decode('utf-8'))
+
+    def zones(self, region):
+        # data.aws_availability_zones with all_availability_zones and state=available
+        result = self.aws(region, 'ec2', 'describe-availability-zones', '--all-availability-zones',
+                          '--filters', 'Name=state,Values=available')
+        return sorted(zone['ZoneName'] for zone in result['AvailabilityZones'])
+
+    def image_id(self, region, image):
+        # data.aws_ami with most_recent, a name prefix and hvm virtualization
+        result = self.aws(region, 'ec2', 'describe-images',
+                          '--owners', str(image['owner']),
+                          '--filters', f"Name=name,Values={image['name']}*", 'Name=virtualization-type,Values=hvm')
+        images = sorted(result['Images'], key=lambda item: item.get('CreationDate', ''))
+        return images[-1]['ImageId'] if images else None
+
+    def instance_types(self, region):
+        result = self.aws(region, 'ec2', 'describe-instance-type-offerings', '--location-type', 'region')
+        return sorted(offering['InstanceType'] for offering in result['InstanceTypeOfferings'])
+
+LOOKUP_BACKENDS = {
+    'aws': AwsLookupBackend,
+}
+
+class CloudLookupCache:
+    '''
+    File cache of cloud lookups under ~/.edb-terraform/cache/cloud/<csp>/<account>/<kind>/<region>-<key>.json
+    Entries older than their kind's TTL, or every entry when refresh is set, are looked up again.
+    '''
+    def __init__(self, csp: str, backend: CloudLookupBackend, directory: Path = CACHE_DIRECTORY, refresh=False, ttls: Dict = CACHE_TTLS):
+        self.directory = Path(directory) / csp / hashlib.sha256(str(backend.account).encode('utf-8')).hexdigest()[:16]
+        self.backend = backend
+        self.refresh = refresh
+        self.ttls = ttls
+
+    def entry_path(self, kind, region, key=None):
+        name = region if key is None else f'{region}-{hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]}'
+        return self.directory / kind / f'{name}.json'
+
+    def get(self, kind, region, lookup, key=None):
+        path = self.entry_path(kind, region, key)
+        if not self.refresh and path.exists():
+            try:
+                entry = json.loads(path.read_text())
+                if time.time() - entry['created'] < self.ttls[kind]:
+                    return entry['value']
+            except (ValueError, KeyError) as e:
+                logger.warning(f'Ignoring invalid cloud cache entry {path} - ({e})')
+
+        value = lookup()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_file(path, {'created': time.time(), 'key': key, 'value': value}, compact=True, permissions=FILE_PERMISSIONS)
+        return value
+
+    def zones(self, region):
+        return self.get('zones', region, lambda: self.backend.zones(region))
+
+    def image_id(self, region, image):
+        return self.get('images', region, lambda: self.backend.image_id(region, image), key=image)
+
+    def instance_types(self, region):
+        return self.get('instance_types', region, lambda: self.backend.instance_types(region))
+
+def resolve_cloud_lookups(
+        csp: str,
+        spec: Dict,
+        bin_path=None,
+        refresh=False,
+        backend: Optional[CloudLookupBackend] = None,
+        directory: Path = CACHE_DIRECTORY,
+    ) -> Dict:
+    '''
+    Resolve the zones, machine images and instance types of each region through the cloud cache,
+    for use as the terraform variable cloud_lookups so plans can skip the matching data sources.
+
+    Lookups which fail are left out and terraform falls back to its data sources.
+
+    Returns {'regions': {<region>: {'zones': [], 'images': {<name>: {'id': <id>}}, 'instance_types': []}}}
+    '''
+    lookups = {'regions': {}}
+    if backend is None:
+        if csp not in LOOKUP_BACKENDS:
+            return lookups
+        try:
+            backend = LOOKUP_BACKENDS[csp](bin_path)
+        except Exception as e:
+            logger.info(f'Skipping cloud lookups - ({e})')
+            return lookups
+
+    cache = CloudLookupCache(csp, backend, directory, refresh)
+    images = spec.get('images') or {}
+    region_images = {}
+    for machine in (spec.get('machines') or {}).values():
+        if machine.get('image_name') in images and machine.get('region'):
+            region_images.setdefault(machine['region'], set()).add(machine['image_name'])
+
+    def resolve(region):
+        resolved = {}
+        try:
+            resolved['zones'] = cache.zones(region)
+            resolved['instance_types'] = cache.instance_types(region)
+            resolved['images'] = {}
+            for name in sorted(region_images.get(region, [])):
+                image_id = cache.image_id(region, images[name])
+                if image_id:
+                    resolved['images'][name] = {'id': image_id}
+        except Exception as e:
+            logger.warning(f'Cloud lookups for {region} failed, terraform data sources will be used instead - ({e})')
+        return region, resolved
+
+    regions = list((spec.get('regions') or {}).keys())
+    with ContextThreadPoolExecutor(max_workers=max(1, min(len(regions), 8)), thread_name_prefix='cloud-lookups') as executor:
+        for region, resolved in executor.map(resolve, regions):
+            if resolved:
+                lookups['regions'][region] = resolved
+    return lookups
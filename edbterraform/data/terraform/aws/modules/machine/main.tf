@@ -116,7 +116,7 @@ resource "toolbox_external" "initial_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${aws_instance.machine.public_ip} -p ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${aws_instance.machine.public_ip} -p ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
@@ -161,7 +161,7 @@ resource "toolbox_external" "all_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${aws_instance.machine.public_ip} -p ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${aws_instance.machine.public_ip} -p ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
@@ -171,6 +171,12 @@ locals {
 
 locals {
   ssh_timeout = 240
+  # Reuse a single ssh connection per machine across the volume setup steps,
+  # the connection is closed once it has been idle for ssh_control_persist seconds.
+  ssh_control_options = var.ssh_control_persist > 0 ? "-o ControlMaster=auto -o ControlPath=~/.ssh/edb-terraform-%C -o ControlPersist=${var.ssh_control_persist}" : ""
+  # parallel: find all volumes first, create filesystems concurrently and mount them at the end
+  # serial: find, create and mount one volume at a time
+  volume_setup_mode = var.parallel_volume_setup ? "parallel" : "serial"
 
   preattached_volumes_script = "setup_preattached_volumes.sh"
   preattached_volumes_variables = {
@@ -227,7 +233,8 @@ resource "toolbox_external" "setup_preattached_volumes" {
     }
 
     CONNECTION="${var.operating_system.ssh_user}@${aws_instance.machine.public_ip}"
-    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout}"
+    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout} ${local.ssh_control_options}"
+    if [[ -n "${local.ssh_control_options}" ]]; then mkdir -p -m 700 ~/.ssh; fi
     SFTP_OPTIONS="-P ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file} $SSH_OPTIONS"
 
     # Copy script to /tmp directory
@@ -264,7 +271,8 @@ resource "toolbox_external" "setup_volumes" {
     "-c",
     <<-EOT
     CONNECTION="${var.operating_system.ssh_user}@${aws_instance.machine.public_ip}"
-    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout}"
+    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout} ${local.ssh_control_options}"
+    if [[ -n "${local.ssh_control_options}" ]]; then mkdir -p -m 700 ~/.ssh; fi
     SFTP_OPTIONS="-P ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file} $SSH_OPTIONS"
 
     # Copy script to /tmp directory
@@ -290,8 +298,8 @@ resource "toolbox_external" "setup_volumes" {
       exit $RC
     fi
 
-    # Execute Script
-    CMD="$SSH_CMD /tmp/setup_volume.sh ${base64encode(jsonencode(local.volume_variables))} ${base64encode(jsonencode(local.lvm_variables))} >> /tmp/mount.log"
+    # Execute Script, the script logs into /tmp/mount.log and only prints the per-volume timings
+    CMD="$SSH_CMD /tmp/setup_volume.sh ${base64encode(jsonencode(local.volume_variables))} ${base64encode(jsonencode(local.lvm_variables))} ${local.volume_setup_mode}"
     RESULT=$($CMD)
     RC=$?
     if [[ $RC -ne 0 ]];
@@ -314,10 +322,12 @@ resource "toolbox_external" "final_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${aws_instance.machine.public_ip} -p ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${aws_instance.machine.public_ip} -p ${var.machine.spec.ssh_port} -i ${var.machine.spec.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
 locals {
   final_block_devices = can(toolbox_external.final_block_devices.0.result) ? jsondecode(base64decode(toolbox_external.final_block_devices.0.result.base64json)) : {}
+  # Setup mode and per-volume timings in milliseconds reported by setup_volume.sh
+  volume_setup = can(toolbox_external.setup_volumes.0.result) ? jsondecode(base64decode(toolbox_external.setup_volumes.0.result.base64json)) : {}
 }
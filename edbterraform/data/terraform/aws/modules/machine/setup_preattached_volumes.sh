@@ -23,13 +23,20 @@ _jq_key() {
     printf %s "$1" | jq -rc "$2"
 }
 
-# Install nvme-cli, jq, and xfsprogs
-if [ -f /etc/redhat-release ]
+_has_commands() {
+    for COMMAND in "$@"
+    do
+        command -v "${COMMAND}" >/dev/null 2>&1 || return 1
+    done
+}
+
+# Install jq unless it is already available
+if ! _has_commands jq && [ -f /etc/redhat-release ]
 then
     sudo yum clean all
     sudo yum install jq -y
 fi
-if [ -f /etc/debian_version ]
+if ! _has_commands jq && [ -f /etc/debian_version ]
 then
     export DEBIAN_FRONTEND="noninteractive"
     sudo apt-get update -y
@@ -57,13 +64,16 @@ then
     exit 1
 fi
 
-# Install nvme-cli, jq, and xfsprogs
-if [ -f /etc/redhat-release ]
+# Install nvme-cli, xfsprogs and lvm2 unless they are already available
+if ! _has_commands nvme mkfs.xfs lvm && [ -f /etc/redhat-release ]
 then
     sudo yum install nvme-cli xfsprogs lvm2 -y
 fi
-if [ -f /etc/debian_version ]
+if ! _has_commands nvme mkfs.xfs lvm && [ -f /etc/debian_version ]
 then
+    export DEBIAN_FRONTEND="noninteractive"
+    # Package lists are only refreshed by the jq install when jq was missing
+    sudo apt-get update -y
     sudo apt-get install nvme-cli perl-modules xfsprogs lvm2 -y
 fi
 
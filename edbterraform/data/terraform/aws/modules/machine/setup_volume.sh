@@ -1,26 +1,209 @@
 #!/bin/bash
 set -euo pipefail
 
-# Install nvme-cli, jq, and xfsprogs
-if [ -f /etc/redhat-release ]; then
-	sudo yum clean all
-	sudo yum install nvme-cli jq xfsprogs -y
-fi
-if [ -f /etc/debian_version ]; then
-	export DEBIAN_FRONTEND="noninteractive"
-	sudo apt-get update -y
-	sudo apt-get install nvme-cli jq perl-modules xfsprogs -y
+# Keep stdout for the json result and log everything else
+exec 3>&1 1>>/tmp/mount.log
+
+_has_commands() {
+	for COMMAND in "$@"
+	do
+		command -v "${COMMAND}" >/dev/null 2>&1 || return 1
+	done
+}
+
+# Install nvme-cli, jq, and xfsprogs unless they are already available
+if ! _has_commands nvme jq mkfs.xfs
+then
+	if [ -f /etc/redhat-release ]; then
+		sudo yum clean all
+		sudo yum install nvme-cli jq xfsprogs -y
+	fi
+	if [ -f /etc/debian_version ]; then
+		export DEBIAN_FRONTEND="noninteractive"
+		sudo apt-get update -y
+		sudo apt-get install nvme-cli jq perl-modules xfsprogs -y
+	fi
 fi
 
 # Expects a base64encoded json object
 SCRIPT_INPUTS=$(printf %s "$1" | base64 -d | jq -rc '.[]')
 VOLUME_GROUPS=$(printf %s "$2" | base64 -d | jq -rc '.')
+# serial: find, create and mount one volume at a time
+# parallel: find all volumes first, create filesystems concurrently and mount them at the end
+SETUP_MODE="${3:-serial}"
+# Per-volume timings, one json file per volume
+TIMINGS_DIR=$(mktemp -d)
+trap 'rm -rf "${TIMINGS_DIR}"' EXIT
 
 _jq_key() {
 	printf %s "$1" | jq -rc "$2"
 }
 
+_now_ms() {
+	date +%s%3N
+}
+
+# $1: timing file name, $2: json object
+_save_timing() {
+	printf "%s\n" "$2" > "${TIMINGS_DIR}/$1.json"
+}
+
+# Options which defer inode table and journal initialization to the kernel after mounting
+_mkfs_options() {
+	if [ "${SETUP_MODE}" != "parallel" ]; then
+		return
+	fi
+	case "$1" in
+		ext4|ext3)
+			printf %s "-E lazy_itable_init=1,lazy_journal_init=1,nodiscard"
+			;;
+		xfs)
+			# xfs allocates inodes dynamically, skip discarding blocks instead
+			printf %s "-K"
+			;;
+	esac
+}
+
+_install_lvm() {
+	if ! command -v lvm >/dev/null 2>&1 && [ -f /etc/redhat-release ]
+	then
+		sudo yum install lvm2 -y
+	fi
+	if ! command -v lvm >/dev/null 2>&1 && [ -f /etc/debian_version ]
+	then
+		export DEBIAN_FRONTEND="noninteractive"
+		# Package lists are only refreshed by the first install when a tool was missing
+		sudo apt-get update -y
+		sudo apt-get install lvm2 -y
+	fi
+}
+
+# $1: volume group, remaining: physical volumes
+_setup_volume_group() {
+	local VOLUME_GROUP="$1"
+	shift
+	# Check if volume exists to either create or extend volume group
+	if sudo vgs ${VOLUME_GROUP} >/dev/null 2>&1
+	then
+		VG_CMD=vgextend
+	else
+		VG_CMD=vgcreate
+	fi
+	sudo pvcreate "$@"
+	sudo "${VG_CMD}" "${VOLUME_GROUP}" "$@"
+}
+
+# $1: device, $2: filesystem
+_create_filesystem() {
+	# Options are intentionally split into separate arguments
+	sudo "mkfs.$2" $(_mkfs_options "$2") "$1"
+}
+
+# $1: device, $2: mount point, $3: filesystem, $4: mount options
+_add_fstab_entry() {
+	sudo mkdir -p "$2"
+	# Get device UUID with blkid as exported format:
+	# UUID=xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx
+	printf "%s\n" "Warning: Will be mounted by UUID in /etc/fstab"
+	UUID=$(sudo blkid "$1" -o export | grep -E "^UUID=")
+	printf "%s\n" "${UUID} $2 $3 $4 0 0" | sudo tee -a /etc/fstab
+}
+
+# Overall number of seconds to wait for the expected nvme devices
+DEVICE_TIMEOUT="${DEVICE_TIMEOUT:-20}"
+# EBS device name (sdX or /dev/sdX) => nvme device, built once per run
+declare -A EBS_DEVICES=()
+EBS_DEVICES_COUNT=-1
+
+# Wait until udev has processed the attached volumes and $1 nvme devices are present
+_wait_for_devices() {
+	local DEADLINE=$((SECONDS + DEVICE_TIMEOUT))
+	local NVME_DEVICES
+	while true; do
+		sudo udevadm settle --timeout="$(( DEADLINE > SECONDS ? DEADLINE - SECONDS : 0 ))" || true
+		NVME_DEVICES=$(compgen -G "/sys/block/nvme*n*" | wc -l || true)
+		if [ "${NVME_DEVICES}" -ge "$1" ]; then
+			return
+		fi
+		if [ "${SECONDS}" -ge "${DEADLINE}" ]; then
+			printf "%s\n" "ERROR: unable to get the full list of NVME devices after ${DEVICE_TIMEOUT}s"
+			return
+		fi
+		# udevadm settle returns right away while no events are queued for newly attached volumes
+		sleep 0.5
+	done
+}
+
+# Map the EBS device names stored in the vendor specific controller data to nvme devices,
+# reading each nvme controller once instead of once per volume.
+_map_ebs_devices() {
+	local NAMESPACE CONTROLLER NVME_DEVICE FOUND_DEVICE
+	EBS_DEVICES=()
+	EBS_DEVICES_COUNT=0
+	for NAMESPACE in $(compgen -G "/sys/block/nvme*n*" | sort -V || true); do
+		NVME_DEVICE="/dev/$(basename "${NAMESPACE}")"
+		CONTROLLER=$(basename "$(readlink -f "${NAMESPACE}/device")")
+		EBS_DEVICES_COUNT=$((EBS_DEVICES_COUNT + 1))
+		# Only EBS volumes report a device name, skip instance store volumes
+		if ! grep -q "Elastic Block Store" "/sys/class/nvme/${CONTROLLER}/model" 2>/dev/null; then
+			continue
+		fi
+		FOUND_DEVICE=$(sudo nvme id-ctrl --vendor-specific "${NVME_DEVICE}" | grep "0000:" | awk '{ print $18 }' | sed 's/["\.]//g')
+		if [ -n "${FOUND_DEVICE}" ]; then
+			# /dev/ might be dropped at times so we need to store both cases
+			EBS_DEVICES["${FOUND_DEVICE#/dev/}"]=${NVME_DEVICE}
+		fi
+	done
+}
+
+# Sets TARGET_NVME_DEVICE for the device names in $1 with $2 nvme devices expected on the system
+_find_device() {
+	local TARGET_DEVICES="$1"
+	local N_NVME_DEVICE="$2"
+
+	# Wait and map the devices once, unless more devices are expected since the last mapping
+	if [ "${EBS_DEVICES_COUNT}" -lt "${N_NVME_DEVICE}" ]; then
+		_wait_for_devices "${N_NVME_DEVICE}"
+		_map_ebs_devices
+	fi
+
+	# Based on the target EBS device (/dev/sdX) we have to find the corresponding
+	# NVME device.
+	TARGET_NVME_DEVICE=""
+	for DEVNAME in ${TARGET_DEVICES[*]}; do
+		if [ -n "${EBS_DEVICES[${DEVNAME#/dev/}]:-}" ]; then
+			TARGET_NVME_DEVICE=${EBS_DEVICES[${DEVNAME#/dev/}]}
+			break
+		fi
+	done
+
+	# Fallback to device names
+	if [ "${TARGET_NVME_DEVICE}" = "" ]; then
+		for DEVICE_NAME in ${TARGET_DEVICES[*]}
+		do
+			if [ -b "${DEVICE_NAME}" ] || [ -e "${DEVICE_NAME}" ]
+			then
+				TARGET_NVME_DEVICE=${DEVICE_NAME}
+				printf "%s\n" "Warning: Falling back to device name"
+				printf "%s\n" "Warning: Device names might change if instance is stopped or volumes are detached/added"
+				break
+			fi
+		done
+	fi
+
+	if [ "${#TARGET_NVME_DEVICE}" -eq 0 ]; then
+		printf "%s\n" "ERROR: unable to find the NVME device for ${TARGET_DEVICES}" 1>&2
+		exit 2
+	fi
+}
+
 # Find volumes and create a filesystem or lvm volume groups
+DEVICES=()
+MOUNT_POINTS=()
+FSTYPES=()
+FSMOUNTOPTS=()
+VOLUME_GROUP_NAMES=()
+INDEX=0
 for item in ${SCRIPT_INPUTS}
 do
 	# Expected device paths: ["/dev/sdX","/dev/sdY"]
@@ -33,124 +216,173 @@ do
 	FSTYPE=$(_jq_key "$item" '.filesystem')
 	FSMOUNTOPT=$(_jq_key "$item" '.mount_options')
 	VOLUME_GROUP=$(_jq_key "$item" '.volume_group')
+	if [ "${VOLUME_GROUP}" = "null" ]; then
+		VOLUME_GROUP=""
+	fi
 
-	# Wait for the availability of all the NVME devices that should be
-	# present on the system.
-	COUNTER=0
-	while [ "$(sudo nvme list | tail -n +3 | wc -l)" -ne "${N_NVME_DEVICE}" ]; do
-		sleep 2
-		COUNTER=$((COUNTER + 1))
-		if [ $COUNTER -ge 10 ]; then
-			printf "%s\n" "ERROR: unable to get the full list of NVME devices after 20s"
-			break
+	START=$(_now_ms)
+	_find_device "${TARGET_DEVICES}" "${N_NVME_DEVICE}"
+	FIND_MS=$(( $(_now_ms) - START ))
+
+	DEVICES+=("${TARGET_NVME_DEVICE}")
+	MOUNT_POINTS+=("${MOUNT_POINT}")
+	FSTYPES+=("${FSTYPE}")
+	FSMOUNTOPTS+=("${FSMOUNTOPT}")
+	VOLUME_GROUP_NAMES+=("${VOLUME_GROUP}")
+
+	if [ "${SETUP_MODE}" = "parallel" ]; then
+		_save_timing "volume-${INDEX}-find" "$(jq -nc --arg device "${TARGET_NVME_DEVICE}" --argjson find_ms "${FIND_MS}" '{device: $device, find_ms: $find_ms}')"
+		INDEX=$((INDEX + 1))
+		continue
+	fi
+
+	START=$(_now_ms)
+	if [ -n "${VOLUME_GROUP}" ]
+	then
+		_install_lvm
+		_setup_volume_group "${VOLUME_GROUP}" "${TARGET_NVME_DEVICE}"
+	else
+		# Mount point and volume creation
+		_create_filesystem "${TARGET_NVME_DEVICE}" "${FSTYPE}"
+		_add_fstab_entry "${TARGET_NVME_DEVICE}" "${MOUNT_POINT}" "${FSTYPE}" "${FSMOUNTOPT}"
+		sudo mount --all
+	fi
+	SETUP_MS=$(( $(_now_ms) - START ))
+	_save_timing "volume-${INDEX}" "$(jq -nc \
+		--arg device "${TARGET_NVME_DEVICE}" --arg mount_point "${MOUNT_POINT}" --arg volume_group "${VOLUME_GROUP}" \
+		--argjson find_ms "${FIND_MS}" --argjson setup_ms "${SETUP_MS}" \
+		'{device: $device, mount_point: $mount_point, volume_group: $volume_group, find_ms: $find_ms, setup_ms: $setup_ms}')"
+	INDEX=$((INDEX + 1))
+done
+
+if [ "${SETUP_MODE}" = "parallel" ] && [ "${#DEVICES[@]}" -gt 0 ]
+then
+	# Create all filesystems concurrently
+	PIDS=()
+	for INDEX in "${!DEVICES[@]}"
+	do
+		if [ -n "${VOLUME_GROUP_NAMES[$INDEX]}" ]; then
+			continue
 		fi
+		(
+			START=$(_now_ms)
+			_create_filesystem "${DEVICES[$INDEX]}" "${FSTYPES[$INDEX]}"
+			_save_timing "volume-${INDEX}-mkfs" "$(jq -nc --argjson mkfs_ms "$(( $(_now_ms) - START ))" '{mkfs_ms: $mkfs_ms}')"
+		) &
+		PIDS+=($!)
+	done
+	for PID in ${PIDS[@]+"${PIDS[@]}"}; do
+		wait "${PID}"
 	done
 
-	# Based on the target EBS device (/dev/sdX) we have to find the corresponding
-	# NVME device.
-	TARGET_NVME_DEVICE=""
-	for NVME_DEVICE in $(sudo ls -1v /dev/nvme*n*); do
-		FOUND_DEVICE=$(sudo nvme id-ctrl --vendor-specific "${NVME_DEVICE}" | grep "0000:" | awk '{ print $18 }' | sed 's/["\.]//g')
-
-		# /dev/ might be dropped at times so we need to check both cases
-		for DEVNAME in ${TARGET_DEVICES[*]}; do
-			if [ "${DEVNAME}" = "${FOUND_DEVICE}" ] || [ "${DEVNAME}" = "/dev/${FOUND_DEVICE}" ]; then
-				TARGET_NVME_DEVICE=${NVME_DEVICE}
-				break
+	# Create each volume group once with all of its physical volumes
+	for VOLUME_GROUP in $(printf "%s\n" ${VOLUME_GROUP_NAMES[@]+"${VOLUME_GROUP_NAMES[@]}"} | sort -u)
+	do
+		_install_lvm
+		PHYSICAL_VOLUMES=()
+		for INDEX in "${!DEVICES[@]}"; do
+			if [ "${VOLUME_GROUP_NAMES[$INDEX]}" = "${VOLUME_GROUP}" ]; then
+				PHYSICAL_VOLUMES+=("${DEVICES[$INDEX]}")
 			fi
 		done
-		if [ ! "${TARGET_NVME_DEVICE}" = "" ]; then
-			break
+		START=$(_now_ms)
+		_setup_volume_group "${VOLUME_GROUP}" "${PHYSICAL_VOLUMES[@]}"
+		_save_timing "volume-group-${VOLUME_GROUP}" "$(jq -nc --arg volume_group "${VOLUME_GROUP}" --argjson setup_ms "$(( $(_now_ms) - START ))" '{volume_group: $volume_group, setup_ms: $setup_ms}')"
+	done
+
+	# Mount all filesystems at the end
+	for INDEX in "${!DEVICES[@]}"
+	do
+		if [ -z "${VOLUME_GROUP_NAMES[$INDEX]}" ]; then
+			_add_fstab_entry "${DEVICES[$INDEX]}" "${MOUNT_POINTS[$INDEX]}" "${FSTYPES[$INDEX]}" "${FSMOUNTOPTS[$INDEX]}"
 		fi
-	done;
+	done
+	sudo mount --all
 
-	# Fallback to device names
-	for DEVICE_NAME in ${TARGET_DEVICES[*]}
+	for INDEX in "${!DEVICES[@]}"
 	do
-		if [ -b "${DEVICE_NAME}" ] || [ -e "${DEVICE_NAME}" ]
-		then
-			TARGET_NVME_DEVICE=${DEVICE_NAME}
-			printf "%s\n" "Warning: Falling back to device name"
-			printf "%s\n" "Warning: Device names might change if instance is stopped or volumes are detached/added"
-			break
+		MKFS_TIMING="${TIMINGS_DIR}/volume-${INDEX}-mkfs.json"
+		if [ ! -f "${MKFS_TIMING}" ]; then
+			MKFS_TIMING=/dev/null
 		fi
+		jq -sc --arg mount_point "${MOUNT_POINTS[$INDEX]}" --arg volume_group "${VOLUME_GROUP_NAMES[$INDEX]}" \
+			'add + {mount_point: $mount_point, volume_group: $volume_group}' \
+			"${TIMINGS_DIR}/volume-${INDEX}-find.json" "${MKFS_TIMING}" > "${TIMINGS_DIR}/volume-${INDEX}.json"
+		rm -f "${TIMINGS_DIR}/volume-${INDEX}-find.json" "${TIMINGS_DIR}/volume-${INDEX}-mkfs.json"
 	done
+fi
 
-	if [ "${#TARGET_NVME_DEVICE}" -eq 0 ]; then
-		printf "%s\n" "ERROR: unable to find the NVME device for ${TARGET_DEVICES}" 1>&2
-		exit 2
-	fi
+# Create logical volumes
+LOGICAL_VOLUMES=()
+while read -r LOGICAL_VOLUME
+do
+	VOLUME_GROUP=$(_jq_key "${LOGICAL_VOLUME}" '.volume_group')
+	MOUNT_POINT=$(_jq_key "${LOGICAL_VOLUME}" '.mount_point')
+	SIZE=$(_jq_key "${LOGICAL_VOLUME}" '.size')
+	FILESYSTEM=$(_jq_key "${LOGICAL_VOLUME}" '.filesystem')
+	MOUNT_OPTIONS=$(_jq_key "${LOGICAL_VOLUME}" '.mount_options')
+	VOLUME_COUNT=$(sudo vgs -o pv_count --noheadings $VOLUME_GROUP | tr -d ' ')
+	LV_NAME=$(printf "%s" "${MOUNT_POINT}" | tr '/' '_')
+	LV_PATH="/dev/${VOLUME_GROUP}/${LV_NAME}"
+	# Create the logical volume
+	case "${SIZE}" in
+		*%*)
+			SIZE_CMD="--extents"
+			;;
+		*)
+			SIZE_CMD="--size"
+			;;
+	esac
+	sudo lvcreate "${SIZE_CMD}" "${SIZE}" --name "${LV_NAME}" --type striped --stripes "${VOLUME_COUNT}" "${VOLUME_GROUP}"
 
-	if [ -n "${VOLUME_GROUP}" ] && [ "${VOLUME_GROUP}" != "null" ]
-	then
-		if ! command -v lvm >/dev/null 2>&1 && [ -f /etc/redhat-release ]
-		then
-			sudo yum install lvm2 -y
-		fi
-		if ! command -v lvm >/dev/null 2>&1 && [ -f /etc/debian_version ]
-		then
-			export DEBIAN_FRONTEND="noninteractive"
-			sudo apt-get install lvm2 -y
-		fi
-		# Check if volume exists to either create or extend volume group
-		if sudo vgs ${VOLUME_GROUP} >/dev/null 2>&1
-		then
-			VG_CMD=vgextend
-		else
-			VG_CMD=vgcreate
-		fi
-		sudo pvcreate "${TARGET_NVME_DEVICE}"
-		sudo "${VG_CMD}" "${VOLUME_GROUP}" "${TARGET_NVME_DEVICE}"
-	else
-		# Mount point and volume creation
-		sudo "mkfs.${FSTYPE}" "${TARGET_NVME_DEVICE}"
-		sudo mkdir -p "${MOUNT_POINT}"
-		# Get device UUID with blkid as exported format:
-		# UUID=xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx
-		printf "%s\n" "Warning: Will be mounted by UUID in /etc/fstab"
-		UUID=$(sudo blkid ${TARGET_NVME_DEVICE} -o export | grep -E "^UUID=")
-		printf "%s\n" "${UUID} ${MOUNT_POINT} ${FSTYPE} ${FSMOUNTOPT} 0 0" | sudo tee -a /etc/fstab
-		sudo mount --all
+	if [ "${SETUP_MODE}" = "parallel" ]; then
+		LOGICAL_VOLUMES+=("${LOGICAL_VOLUME}")
+		continue
 	fi
 
-done
+	# Create the filesystem
+	START=$(_now_ms)
+	_create_filesystem "${LV_PATH}" "${FILESYSTEM}"
+	_add_fstab_entry "${LV_PATH}" "${MOUNT_POINT}" "${FILESYSTEM}" "${MOUNT_OPTIONS}"
+	sudo mount --all
+	_save_timing "logical-volume-${LV_NAME}" "$(jq -nc \
+		--arg device "${LV_PATH}" --arg mount_point "${MOUNT_POINT}" --arg volume_group "${VOLUME_GROUP}" --argjson setup_ms "$(( $(_now_ms) - START ))" \
+		'{device: $device, mount_point: $mount_point, volume_group: $volume_group, setup_ms: $setup_ms}')"
+done < <(_jq_key "${VOLUME_GROUPS}" 'to_entries | sort_by(.key)[] | .key as $volume_group | .value | to_entries | sort_by(.key)[] | {volume_group: $volume_group, mount_point: .key} + .value')
 
-# Create logical volumes
-_jq_key "${VOLUME_GROUPS}" "keys[]" | \
-while read -r VOLUME_GROUP
-do
-	# Get the value of the key
-	VOLUME_DATA=$(_jq_key "${VOLUME_GROUPS}" ".\"${VOLUME_GROUP}\"")
-	_jq_key "${VOLUME_DATA}" "keys[]" | \
-	while read -r MOUNT_POINT
+if [ "${#LOGICAL_VOLUMES[@]}" -gt 0 ]
+then
+	# Create the filesystems of all logical volumes concurrently
+	PIDS=()
+	for LOGICAL_VOLUME in "${LOGICAL_VOLUMES[@]}"
+	do
+		(
+			VOLUME_GROUP=$(_jq_key "${LOGICAL_VOLUME}" '.volume_group')
+			MOUNT_POINT=$(_jq_key "${LOGICAL_VOLUME}" '.mount_point')
+			LV_NAME=$(printf "%s" "${MOUNT_POINT}" | tr '/' '_')
+			LV_PATH="/dev/${VOLUME_GROUP}/${LV_NAME}"
+			START=$(_now_ms)
+			_create_filesystem "${LV_PATH}" "$(_jq_key "${LOGICAL_VOLUME}" '.filesystem')"
+			_save_timing "logical-volume-${LV_NAME}" "$(jq -nc \
+				--arg device "${LV_PATH}" --arg mount_point "${MOUNT_POINT}" --arg volume_group "${VOLUME_GROUP}" --argjson mkfs_ms "$(( $(_now_ms) - START ))" \
+				'{device: $device, mount_point: $mount_point, volume_group: $volume_group, mkfs_ms: $mkfs_ms}')"
+		) &
+		PIDS+=($!)
+	done
+	for PID in "${PIDS[@]}"; do
+		wait "${PID}"
+	done
+
+	# Mount all logical volumes at the end
+	for LOGICAL_VOLUME in "${LOGICAL_VOLUMES[@]}"
 	do
-		MOUNT_DATA=$(_jq_key "${VOLUME_DATA}" ".\"${MOUNT_POINT}\"")
-		SIZE=$(_jq_key "${MOUNT_DATA}" '.size')
-		FILESYSTEM=$(_jq_key "${MOUNT_DATA}" '.filesystem')
-		MOUNT_OPTIONS=$(_jq_key "${MOUNT_DATA}" '.mount_options')
-		VOLUME_COUNT=$(sudo vgs -o pv_count --noheadings $VOLUME_GROUP | tr -d ' ')
+		VOLUME_GROUP=$(_jq_key "${LOGICAL_VOLUME}" '.volume_group')
+		MOUNT_POINT=$(_jq_key "${LOGICAL_VOLUME}" '.mount_point')
 		LV_NAME=$(printf "%s" "${MOUNT_POINT}" | tr '/' '_')
-		LV_PATH="/dev/${VOLUME_GROUP}/${LV_NAME}"
-		# Create the logical volume
-		case "${SIZE}" in
-			*%*)
-				SIZE_CMD="--extents"
-				;;
-			*)
-				SIZE_CMD="--size"
-				;;
-		esac
-		sudo lvcreate "${SIZE_CMD}" "${SIZE}" --name "${LV_NAME}" --type striped --stripes "${VOLUME_COUNT}" "${VOLUME_GROUP}"
-
-		# Create the filesystem
-		sudo "mkfs.${FILESYSTEM}" "${LV_PATH}"
-		# Create the mount point
-		sudo mkdir -p "${MOUNT_POINT}"
-		# Get device UUID with blkid as exported format:
-		# UUID=xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx
-		printf "%s\n" "Warning: Will be mounted by UUID in /etc/fstab"
-		UUID=$(sudo blkid "${LV_PATH}" -o export | grep -E "^UUID=")
-		printf "%s\n" "${UUID} ${MOUNT_POINT} ${FILESYSTEM} ${MOUNT_OPTIONS} 0 0" | sudo tee -a /etc/fstab
-		sudo mount --all
+		_add_fstab_entry "/dev/${VOLUME_GROUP}/${LV_NAME}" "${MOUNT_POINT}" "$(_jq_key "${LOGICAL_VOLUME}" '.filesystem')" "$(_jq_key "${LOGICAL_VOLUME}" '.mount_options')"
 	done
-done
+	sudo mount --all
+fi
+
+# Report the timings of each volume in milliseconds
+jq -sc --arg mode "${SETUP_MODE}" '{mode: $mode, volumes: .}' $(find "${TIMINGS_DIR}" -name '*.json' | sort -V) < /dev/null >&3
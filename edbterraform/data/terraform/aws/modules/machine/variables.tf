@@ -18,6 +18,12 @@ variable "ssh_priv_key" {}
 variable "use_agent" {
   default = false
 }
+variable "ssh_control_persist" {
+  default = 0
+}
+variable "parallel_volume_setup" {
+  default = false
+}
 variable "custom_security_group_ids" {}
 variable "key_name" {}
 variable "operating_system" {}
@@ -37,6 +37,12 @@ variable "spec" {
         zone = optional(string)
         cidr = optional(string)
       })), {})
+      # Existing network of the region, its vpc, subnets and routes are not managed by the project
+      network = optional(object({
+        vpc_id         = string
+        route_table_id = optional(string)
+        subnets        = map(string)
+      }))
       ports = optional(list(object({
         defaults     = optional(string, "")
         port        = optional(number)
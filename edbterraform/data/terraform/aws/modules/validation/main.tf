@@ -6,35 +6,69 @@
 # 3. Inside of validation module and executes during apply
 variable "region" {}
 variable "zones" {}
+variable "available_zones" {
+  description = "Zones resolved by edb-terraform's cloud cache, the data source is skipped when set"
+  default = null
+}
+variable "instance_types" {
+  description = "Instance types used within the region"
+  default = []
+}
+variable "available_instance_types" {
+  description = "Instance types offered within the region, resolved by edb-terraform's cloud cache. Instance types are not checked when unset"
+  default = null
+}
 
 # availability data depends on providers region
 data "aws_availability_zones" "zone_check" {
+  count = var.available_zones == null ? 1 : 0
   all_availability_zones = true
   filter {
     name   = "state"
     values = ["available"]
   }
+}
+
+locals {
+  available_zones = var.available_zones != null ? var.available_zones : one(data.aws_availability_zones.zone_check[*].names)
+}
 
-  lifecycle {
-    postcondition {
-      condition = alltrue([
-        for name, values in var.zones :
-        contains(self.names, values.zone)
-      ])
-      error_message = (
-        <<-EOT
+output "available_zones" {
+  value = local.available_zones
+
+  precondition {
+    condition = alltrue([
+      for name, values in var.zones :
+      contains(local.available_zones, values.zone)
+    ])
+    error_message = (
+      <<-EOT
 Region:
   ${var.region}
 Invalid Zones:
 %{for name, values in var.zones~}
-%{if !contains(self.names, values.zone)~}
+%{if !contains(local.available_zones, values.zone)~}
   ${values.zone}
 %{endif~}
 %{endfor~}
 Valid Zone options:
-  ${jsonencode(self.names)}
+  ${jsonencode(local.available_zones)}
+EOT
+    )
+  }
+
+  precondition {
+    condition = var.available_instance_types == null || alltrue([
+      for instance_type in var.instance_types :
+      contains(coalesce(var.available_instance_types, []), instance_type)
+    ])
+    error_message = (
+      <<-EOT
+Region:
+  ${var.region}
+Instance types not offered within the region:
+  ${jsonencode(setsubtract(var.instance_types, coalesce(var.available_instance_types, [])))}
 EOT
-      )
-    }
+    )
   }
 }
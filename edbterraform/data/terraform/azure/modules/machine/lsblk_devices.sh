@@ -2,7 +2,12 @@
 set -euo pipefail
 
 SSH_CONNECTION="$1"
-SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=240"
+# Optional ssh multiplexing options to reuse a connection across calls
+SSH_CONTROL_OPTIONS="${2:-}"
+SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=240 $SSH_CONTROL_OPTIONS"
+if [[ -n "$SSH_CONTROL_OPTIONS" ]]; then
+  mkdir -p -m 700 ~/.ssh
+fi
 CMD="sudo lsblk -o NAME,KNAME,SIZE,TYPE,MOUNTPOINT,FSTYPE,SERIAL,MODEL,VENDOR,REV,LABEL,UUID,PARTTYPE,PARTLABEL,PARTUUID,SCHED --json 2>&1"
 
 RESULT=$(ssh $SSH_OPTIONS $SSH_CONNECTION $CMD)
@@ -138,7 +138,7 @@ resource "toolbox_external" "initial_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address} -p ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address} -p ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
@@ -193,7 +193,7 @@ resource "toolbox_external" "all_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address} -p ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address} -p ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
@@ -215,6 +215,12 @@ locals {
 
 locals {
   ssh_timeout = 240
+  # Reuse a single ssh connection per machine across the volume setup steps,
+  # the connection is closed once it has been idle for ssh_control_persist seconds.
+  ssh_control_options = var.ssh_control_persist > 0 ? "-o ControlMaster=auto -o ControlPath=~/.ssh/edb-terraform-%C -o ControlPersist=${var.ssh_control_persist}" : ""
+  # parallel: find all volumes first, create filesystems concurrently and mount them at the end
+  # serial: find, create and mount one volume at a time
+  volume_setup_mode = var.parallel_volume_setup ? "parallel" : "serial"
 }
 
 resource "toolbox_external" "setup_volumes" {
@@ -228,7 +234,8 @@ resource "toolbox_external" "setup_volumes" {
     "-c",
     <<-EOT
     CONNECTION="${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address}"
-    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout}"
+    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout} ${local.ssh_control_options}"
+    if [[ -n "${local.ssh_control_options}" ]]; then mkdir -p -m 700 ~/.ssh; fi
     SFTP_OPTIONS="-P ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file} $SSH_OPTIONS"
 
     # Copy script to /tmp directory
@@ -254,8 +261,8 @@ resource "toolbox_external" "setup_volumes" {
       exit $RC
     fi
 
-    # Execute Script
-    CMD="$SSH_CMD /tmp/setup_volume.sh ${base64encode(jsonencode(local.script_variables))} >> /tmp/mount.log 2>&1"
+    # Execute Script, the script logs into /tmp/mount.log and only prints the per-volume timings
+    CMD="$SSH_CMD /tmp/setup_volume.sh ${base64encode(jsonencode(local.script_variables))} ${local.volume_setup_mode}"
     RESULT=$($CMD)
     RC=$?
     if [[ $RC -ne 0 ]];
@@ -264,7 +271,7 @@ resource "toolbox_external" "setup_volumes" {
       exit $RC
     fi
 
-    jq -n --arg base64json "$(printf %s $result | base64 | tr -d \\n)" '{"base64json": $base64json}'
+    jq -n --arg base64json "$(printf %s $RESULT | base64 | tr -d \\n)" '{"base64json": $base64json}'
     EOT
   ]
 }
@@ -278,10 +285,12 @@ resource "toolbox_external" "final_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address} -p ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${azurerm_linux_virtual_machine.main.public_ip_address} -p ${var.machine.ssh_port} -i ${var.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
 locals {
   final_block_devices = can(toolbox_external.final_block_devices.0.result) ? jsondecode(base64decode(toolbox_external.final_block_devices.0.result.base64json)) : {}
+  # Setup mode and per-volume timings in milliseconds reported by setup_volume.sh
+  volume_setup = can(toolbox_external.setup_volumes.0.result) ? jsondecode(base64decode(toolbox_external.setup_volumes.0.result.base64json)) : {}
 }
@@ -32,6 +32,10 @@ output "block_devices" {
   }
 }
 
+output "volume_setup" {
+  value = local.volume_setup
+}
+
 output "operating_system" {
   value = var.operating_system
 }
@@ -76,6 +76,12 @@ variable "public_key" {}
 variable "use_agent" {
   default = false
 }
+variable "ssh_control_persist" {
+  default = 0
+}
+variable "parallel_volume_setup" {
+  default = false
+}
 variable "additional_volumes" {
   type = list(object({
     mount_point = string
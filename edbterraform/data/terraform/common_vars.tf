@@ -4,6 +4,32 @@ variable "create_servers_yml" {
   nullable = false
 }
 
+variable "ssh_control_persist" {
+  description = "Seconds an idle ssh connection is kept open and reused across the volume setup steps of each machine. Set to 0 to open a new connection per step."
+  type = number
+  default = 300
+  nullable = false
+}
+
+variable "parallel_volume_setup" {
+  description = "Find all additional volumes of a machine first, then create their filesystems concurrently and mount them at the end. Set to false to setup one volume at a time."
+  type = bool
+  default = true
+  nullable = false
+}
+
+variable "render_user_templates" {
+  description = "Render templates/*.tftpl with terraform instead of using `edb-terraform render-templates`"
+  default = true
+  nullable = false
+}
+
+variable "cloud_lookups" {
+  description = "Zones, image ids and instance types resolved through edb-terraform's cloud cache, data sources are used for anything missing"
+  default = {}
+  nullable = false
+}
+
 variable "spec" {
   description = "Variable is meant to represent the yaml input file handled through python and is meant to be passed through to module/specification var.spec"
   nullable    = false
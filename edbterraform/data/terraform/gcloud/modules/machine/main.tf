@@ -7,7 +7,9 @@ data "google_compute_subnetwork" "selected" {
   name   = var.subnet_name
 }
 
+# Fallback when the images are not looked up by the caller
 data "google_compute_image" "image" {
+  count = var.image_info == null ? 1 : 0
   name = var.operating_system.name
   family = var.operating_system.family
   project = var.operating_system.project
@@ -29,7 +31,7 @@ resource "google_compute_instance" "machine" {
 
   boot_disk {
     initialize_params {
-      image = data.google_compute_image.image.self_link
+      image = var.image_info != null ? var.image_info[var.machine.spec.image_name].self_link : data.google_compute_image.image.0.self_link
       type  = var.machine.spec.volume.type
       size  = var.machine.spec.volume.size_gb
     }
@@ -101,7 +103,7 @@ resource "toolbox_external" "initial_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip} -p ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip} -p ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
@@ -140,7 +142,7 @@ resource "toolbox_external" "all_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip} -p ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip} -p ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
@@ -162,6 +164,12 @@ locals {
 
 locals {
   ssh_timeout = 240
+  # Reuse a single ssh connection per machine across the volume setup steps,
+  # the connection is closed once it has been idle for ssh_control_persist seconds.
+  ssh_control_options = var.ssh_control_persist > 0 ? "-o ControlMaster=auto -o ControlPath=~/.ssh/edb-terraform-%C -o ControlPersist=${var.ssh_control_persist}" : ""
+  # parallel: find all volumes first, create filesystems concurrently and mount them at the end
+  # serial: find, create and mount one volume at a time
+  volume_setup_mode = var.parallel_volume_setup ? "parallel" : "serial"
 }
 
 resource "toolbox_external" "setup_volumes" {
@@ -175,7 +183,8 @@ resource "toolbox_external" "setup_volumes" {
     "-c",
     <<-EOT
     CONNECTION="${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip}"
-    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout}"
+    SSH_OPTIONS="-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=${local.ssh_timeout} ${local.ssh_control_options}"
+    if [[ -n "${local.ssh_control_options}" ]]; then mkdir -p -m 700 ~/.ssh; fi
     SFTP_OPTIONS="-P ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file} $SSH_OPTIONS"
 
     # Copy script to /tmp directory
@@ -201,8 +210,8 @@ resource "toolbox_external" "setup_volumes" {
       exit $RC
     fi
 
-    # Execute Script
-    CMD="$SSH_CMD /tmp/setup_volume.sh ${base64encode(jsonencode(local.script_variables))} >> /tmp/mount.log 2>&1"
+    # Execute Script, the script logs into /tmp/mount.log and only prints the per-volume timings
+    CMD="$SSH_CMD /tmp/setup_volume.sh ${base64encode(jsonencode(local.script_variables))} ${local.volume_setup_mode}"
     RESULT=$($CMD)
     RC=$?
     if [[ $RC -ne 0 ]];
@@ -211,7 +220,7 @@ resource "toolbox_external" "setup_volumes" {
       exit $RC
     fi
 
-    jq -n --arg base64json "$(printf %s $result | base64 | tr -d \\n)" '{"base64json": $base64json}'
+    jq -n --arg base64json "$(printf %s $RESULT | base64 | tr -d \\n)" '{"base64json": $base64json}'
     EOT
   ]
 }
@@ -225,10 +234,12 @@ resource "toolbox_external" "final_block_devices" {
   program = [
     "bash",
     "-c",
-    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip} -p ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file}'",
+    "${abspath(path.module)}/lsblk_devices.sh '${var.operating_system.ssh_user}@${google_compute_instance.machine.network_interface.0.access_config.0.nat_ip} -p ${var.machine.spec.ssh_port} -i ${var.operating_system.ssh_private_key_file}' '${local.ssh_control_options}'",
   ]
 }
 
 locals {
   final_block_devices = can(toolbox_external.final_block_devices.0.result) ? jsondecode(base64decode(toolbox_external.final_block_devices.0.result.base64json)) : {}
+  # Setup mode and per-volume timings in milliseconds reported by setup_volume.sh
+  volume_setup = can(toolbox_external.setup_volumes.0.result) ? jsondecode(base64decode(toolbox_external.setup_volumes.0.result.base64json)) : {}
 }
@@ -1,6 +1,9 @@
 #!/bin/bash
 set -euo pipefail
 
+# Keep stdout for the json result and log everything else
+exec 3>&1 1>>/tmp/mount.log
+
 # Install nvme-cli and jq
 if [ -f /etc/redhat-release ]; then
 	sudo yum clean all
@@ -13,28 +16,68 @@ fi
 
 # Expects a base64encoded json object
 SCRIPT_INPUTS=$(printf %s "$1" | base64 -d | jq -rc '.[]')
+# serial: find, create and mount one volume at a time
+# parallel: find all volumes first, create filesystems concurrently and mount them at the end
+SETUP_MODE="${2:-serial}"
+# Per-volume timings, one json file per volume
+TIMINGS_DIR=$(mktemp -d)
+trap 'rm -rf "${TIMINGS_DIR}"' EXIT
 
-for item in ${SCRIPT_INPUTS}
-do
-	_jq_key() {
-		printf %s "$1" | jq -rc "$2"
-	}
-	# Expected device paths: ["/dev/sdX","/dev/sdY"]
-	TARGET_DEVICES=$(_jq_key "$item" '.device_names[]')
+_jq_key() {
+	printf %s "$1" | jq -rc "$2"
+}
 
-	# Mount point
-	MOUNT_POINT=$(_jq_key "$item" '.mount_point')
-	# Total number of nvme devices that should be present on the system
-	N_NVME_DEVICE=$(_jq_key "$item" '.number_of_volumes')
-	FSTYPE=$(_jq_key "$item" '.filesystem')
-	FSMOUNTOPT=$(_jq_key "$item" '.mount_options')
+_now_ms() {
+	date +%s%3N
+}
 
-	TARGET_NVME_DEVICE=""
-	FSMOUNTOPT_ARG=""
+# $1: timing file name, $2: json object
+_save_timing() {
+	printf "%s\n" "$2" > "${TIMINGS_DIR}/$1.json"
+}
 
-	if [ ! "${FSMOUNTOPT}" = "" ]; then
-		FSMOUNTOPT_ARG="-o ${FSMOUNTOPT}"
+# Options which defer inode table and journal initialization to the kernel after mounting
+_mkfs_options() {
+	if [ "${SETUP_MODE}" != "parallel" ]; then
+		return
 	fi
+	case "$1" in
+		ext4|ext3)
+			printf %s "-E lazy_itable_init=1,lazy_journal_init=1,nodiscard"
+			;;
+		xfs)
+			# xfs allocates inodes dynamically, skip discarding blocks instead
+			printf %s "-K"
+			;;
+	esac
+}
+
+# $1: device, $2: filesystem
+_create_filesystem() {
+	# Options are intentionally split into separate arguments
+	sudo "mkfs.$2" $(_mkfs_options "$2") "$1"
+}
+
+# $1: device, $2: mount point, $3: filesystem, $4: mount options
+_mount_volume() {
+	FSMOUNTOPT_ARG=""
+	if [ ! "$4" = "" ]; then
+		FSMOUNTOPT_ARG="-o $4"
+	fi
+	sudo mkdir -p "$2"
+	# Get device UUID with blkid as exported format:
+	# UUID=xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx
+	printf "%s\n" "Warning: Will be mounted by UUID in /etc/fstab"
+	UUID=$(sudo blkid $1 -o export | grep -E "^UUID=")
+	printf "%s\n" "${UUID} $2 $3 $4 0 0" | sudo tee -a /etc/fstab
+	eval "sudo mount -t $3 ${FSMOUNTOPT_ARG} $1 $2"
+}
+
+# Sets TARGET_NVME_DEVICE for the device names in $1 with $2 nvme devices expected on the system
+_find_device() {
+	local TARGET_DEVICES="$1"
+	local N_NVME_DEVICE="$2"
+	TARGET_NVME_DEVICE=""
 
 	# Wait for the availability of all the NVME devices that should be
 	# present on the system.
@@ -61,7 +104,7 @@ do
 	done;
 
 	# Fallback to device names
-	for DEVICE_NAME in "${TARGET_DEVICES[@]}"; do
+	for DEVICE_NAME in ${TARGET_DEVICES[*]}; do
 		if [[ -e ${DEVICE_NAME} ]]; then
 			TARGET_NVME_DEVICE=${DEVICE_NAME}
 			printf "%s\n" "Warning: Falling back to device name"
@@ -74,15 +117,76 @@ do
 		printf "%s\n" "ERROR: unable to find the NVME device for ${TARGET_DEVICES}" 1>&2
 		exit 2
 	fi
+}
 
-	# Mount point and volume creation
-	sudo "mkfs.${FSTYPE}" "${TARGET_NVME_DEVICE}"
-	sudo mkdir -p "${MOUNT_POINT}"
-	# Get device UUID with blkid as exported format:
-	# UUID=xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx
-	printf "%s\n" "Warning: Will be mounted by UUID in /etc/fstab"
-	UUID=$(sudo blkid ${TARGET_NVME_DEVICE} -o export | grep -E "^UUID=")
-	printf "%s\n" "${UUID} ${MOUNT_POINT} ${FSTYPE} ${FSMOUNTOPT} 0 0" | sudo tee -a /etc/fstab
-	eval "sudo mount -t ${FSTYPE} ${FSMOUNTOPT_ARG} ${TARGET_NVME_DEVICE} ${MOUNT_POINT}"
+DEVICES=()
+MOUNT_POINTS=()
+FSTYPES=()
+FSMOUNTOPTS=()
+INDEX=0
+for item in ${SCRIPT_INPUTS}
+do
+	# Expected device paths: ["/dev/sdX","/dev/sdY"]
+	TARGET_DEVICES=$(_jq_key "$item" '.device_names[]')
+
+	# Mount point
+	MOUNT_POINT=$(_jq_key "$item" '.mount_point')
+	# Total number of nvme devices that should be present on the system
+	N_NVME_DEVICE=$(_jq_key "$item" '.number_of_volumes')
+	FSTYPE=$(_jq_key "$item" '.filesystem')
+	FSMOUNTOPT=$(_jq_key "$item" '.mount_options')
 
+	START=$(_now_ms)
+	_find_device "${TARGET_DEVICES}" "${N_NVME_DEVICE}"
+	FIND_MS=$(( $(_now_ms) - START ))
+
+	DEVICES+=("${TARGET_NVME_DEVICE}")
+	MOUNT_POINTS+=("${MOUNT_POINT}")
+	FSTYPES+=("${FSTYPE}")
+	FSMOUNTOPTS+=("${FSMOUNTOPT}")
+
+	if [ "${SETUP_MODE}" = "parallel" ]; then
+		_save_timing "volume-${INDEX}-find" "$(jq -nc --arg device "${TARGET_NVME_DEVICE}" --arg mount_point "${MOUNT_POINT}" --argjson find_ms "${FIND_MS}" '{device: $device, mount_point: $mount_point, find_ms: $find_ms}')"
+		INDEX=$((INDEX + 1))
+		continue
+	fi
+
+	# Mount point and volume creation
+	START=$(_now_ms)
+	_create_filesystem "${TARGET_NVME_DEVICE}" "${FSTYPE}"
+	_mount_volume "${TARGET_NVME_DEVICE}" "${MOUNT_POINT}" "${FSTYPE}" "${FSMOUNTOPT}"
+	_save_timing "volume-${INDEX}" "$(jq -nc \
+		--arg device "${TARGET_NVME_DEVICE}" --arg mount_point "${MOUNT_POINT}" \
+		--argjson find_ms "${FIND_MS}" --argjson setup_ms "$(( $(_now_ms) - START ))" \
+		'{device: $device, mount_point: $mount_point, find_ms: $find_ms, setup_ms: $setup_ms}')"
+	INDEX=$((INDEX + 1))
 done
+
+if [ "${SETUP_MODE}" = "parallel" ] && [ "${#DEVICES[@]}" -gt 0 ]
+then
+	# Create all filesystems concurrently
+	PIDS=()
+	for INDEX in "${!DEVICES[@]}"
+	do
+		(
+			START=$(_now_ms)
+			_create_filesystem "${DEVICES[$INDEX]}" "${FSTYPES[$INDEX]}"
+			jq -c --argjson mkfs_ms "$(( $(_now_ms) - START ))" '. + {mkfs_ms: $mkfs_ms}' \
+				"${TIMINGS_DIR}/volume-${INDEX}-find.json" > "${TIMINGS_DIR}/volume-${INDEX}.json"
+			rm -f "${TIMINGS_DIR}/volume-${INDEX}-find.json"
+		) &
+		PIDS+=($!)
+	done
+	for PID in "${PIDS[@]}"; do
+		wait "${PID}"
+	done
+
+	# Mount all filesystems at the end
+	for INDEX in "${!DEVICES[@]}"
+	do
+		_mount_volume "${DEVICES[$INDEX]}" "${MOUNT_POINTS[$INDEX]}" "${FSTYPES[$INDEX]}" "${FSMOUNTOPTS[$INDEX]}"
+	done
+fi
+
+# Report the timings of each volume in milliseconds
+jq -sc --arg mode "${SETUP_MODE}" '{mode: $mode, volumes: .}' $(find "${TIMINGS_DIR}" -name '*.json' | sort -V) < /dev/null >&3
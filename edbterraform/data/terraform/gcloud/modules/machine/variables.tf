@@ -20,6 +20,10 @@ variable "zone" {}
 variable "ssh_priv_key" {}
 variable "ssh_pub_key" {}
 variable "cluster_name" {}
+variable "image_info" {
+  description = "Images looked up once per region, indexed by image name"
+  default = null
+}
 variable "operating_system" {
   type = object({
     name = optional(string)
@@ -44,6 +48,12 @@ variable "name_id" { default = "0" }
 variable "use_agent" {
   default = false
 }
+variable "ssh_control_persist" {
+  default = 0
+}
+variable "parallel_volume_setup" {
+  default = false
+}
 variable "ip_forward" {
   type     = bool
   default  = false
@@ -0,0 +1,154 @@
+import json
+import subprocess
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Dict, List, Optional
+
+from edbterraform.CLI import TerraformCLI
+from edbterraform.state_server import project_backend
+from edbterraform.utils.files import write_json_file
+from edbterraform.utils.jsonstream import iter_values
+from edbterraform.utils.logs import ContextThreadPoolExecutor, logger
+
+DRIFT_MAX_WORKERS = 4
+# Seconds before a project's refresh is stopped
+DRIFT_TIMEOUT = 30 * 60
+# Seconds terraform has to stop gracefully before it is killed
+TERMINATE_TIMEOUT = 30
+# Exit codes of `terraform plan -detailed-exitcode`
+NO_CHANGES = 0
+CHANGES_PRESENT = 2
+FILE_PERMISSIONS = 0o600
+
+def state_is_empty(project_path: Path) -> bool:
+    '''
+    A local state without resources, such as the empty state created during generation.
+    Projects with a backend, such as the state server, keep their state elsewhere and are never considered empty.
+    '''
+    if project_backend(project_path):
+        return False
+    state_file = Path(project_path) / 'terraform.tfstate'
+    if not state_file.exists() or state_file.stat().st_size == 0:
+        return True
+    # Stop at the first resource instead of reading the whole state
+    with state_file.open('rb') as stream:
+        for _ in iter_values(stream, depth=2, match=lambda path: path[0] == 'resources'):
+            return False
+    return True
+
+def parse_drift(stream) -> Dict:
+    '''
+    Read the machine readable output of a refresh-only plan line by line
+
+    Returns the drifted resources and any error diagnostics
+    '''
+    drift = {'drifted': [], 'errors': []}
+    for line in stream:
+        line = line.decode('utf-8', errors='replace').strip() if isinstance(line, bytes) else line.strip()
+        if not line.startswith('{'):
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if message.get('type') == 'resource_drift':
+            change = message.get('change', {})
+            drift['drifted'].append({
+                'address': change.get('resource', {}).get('addr'),
+                'action': change.get('action'),
+            })
+        elif message.get('type') == 'diagnostic' and message.get('@level') == 'error':
+            drift['errors'].append(message.get('@message'))
+    return drift
+
+def detect_drift(
+        project_path: Path,
+        terraform: TerraformCLI,
+        timeout: int = DRIFT_TIMEOUT,
+        init_lock: Optional[threading.Lock] = None,
+    ) -> Dict:
+    '''
+    Run a refresh-only plan of a project within timeout seconds.
+    Projects are only initialized when they have no .terraform directory,
+      providers are then installed one project at a time through the shared plugin cache.
+
+    Returns the status of the project: clean, drifted, skipped, timeout or error
+    '''
+    project_path = Path(project_path)
+    result = {'status': 'clean', 'drifted': [], 'seconds': 0}
+    start = time.monotonic()
+    try:
+        if not (project_path / 'terraform.tfvars.json').exists():
+            raise FileNotFoundError("ERROR: %s is not a project generated by edb-terraform" % project_path)
+        if state_is_empty(project_path):
+            result['status'] = 'skipped'
+            result['reason'] = 'empty state'
+            return result
+
+        if not (project_path / '.terraform').exists():
+            with init_lock or threading.Lock():
+                terraform.init_command(project_path, plugin_cache=True)
+
+        with TemporaryFile() as output:
+            process = terraform.refresh_plan_command(project_path, output)
+            try:
+                returncode = process.wait(timeout=max(1, timeout - (time.monotonic() - start)))
+            except subprocess.TimeoutExpired:
+                process.terminate()
+                try:
+                    process.wait(timeout=TERMINATE_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                result['status'] = 'timeout'
+                return result
+            output.seek(0)
+            drift = parse_drift(output)
+
+        result['drifted'] = drift['drifted']
+        if returncode == CHANGES_PRESENT:
+            result['status'] = 'drifted'
+        elif returncode != NO_CHANGES:
+            result['status'] = 'error'
+            result['error'] = '\n'.join(drift['errors']) or f'terraform exited with {returncode}'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(getattr(e, 'output', None) or e)
+    finally:
+        result['seconds'] = round(time.monotonic() - start, 3)
+    return result
+
+def detect_projects_drift(
+        project_paths: List[Path],
+        bin_path,
+        terraform_version=TerraformCLI.max_version.to_string(),
+        max_workers: int = DRIFT_MAX_WORKERS,
+        timeout: int = DRIFT_TIMEOUT,
+        report_file: Optional[Path] = None,
+    ) -> Dict:
+    '''
+    Detect drift of many projects concurrently with at most max_workers refresh-only plans at a time.
+
+    Returns a report with the status and drifted resources of each project, which is also saved into report_file when it is set
+    '''
+    terraform = TerraformCLI(bin_path, terraform_version)
+    init_lock = threading.Lock()
+    project_paths = list(dict.fromkeys(str(Path(path).resolve()) for path in project_paths))
+    report = {'projects': {}, 'counts': {}}
+
+    def detect(project_path):
+        result = detect_drift(project_path, terraform, timeout, init_lock)
+        logger.info(f'Drift of {project_path}: {result["status"]} with {len(result["drifted"])} drifted resources in {result["seconds"]}s')
+        return project_path, result
+
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='drift') as executor:
+        for project_path, result in executor.map(detect, project_paths):
+            report['projects'][project_path] = result
+            report['counts'][result['status']] = report['counts'].get(result['status'], 0) + 1
+
+    if report_file:
+        write_json_file(report_file, report, permissions=FILE_PERMISSIONS)
+        logger.info(f'Saved drift report into {report_file}')
+    return report
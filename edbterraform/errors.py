@@ -0,0 +1,60 @@
+from typing import Dict, Optional
+
+class EdbTerraformError(Exception):
+    '''
+    Base error of edb-terraform, exit_code is used as the exit status of the command line
+    '''
+    exit_code = 1
+
+    def __init__(self, message: str, exit_code: Optional[int] = None, project_path=None):
+        super().__init__(message)
+        self.message = message
+        if exit_code is not None:
+            self.exit_code = exit_code
+        self.project_path = str(project_path) if project_path else None
+
+    def to_dict(self) -> Dict:
+        return {
+            'error': type(self).__name__,
+            'message': self.message,
+            'exit_code': self.exit_code,
+            'project_path': self.project_path,
+        }
+
+class ProjectExistsError(EdbTerraformError):
+    '''
+    The project directory already exists
+    '''
+
+class GenerationError(EdbTerraformError):
+    '''
+    Project files could not be rendered, copied or saved
+    '''
+
+class TerraformCommandError(EdbTerraformError):
+    '''
+    A terraform command failed, holds its return code and output
+    '''
+    def __init__(self, message: str, returncode: int = 1, output=None, project_path=None, report: Optional[Dict] = None):
+        super().__init__(message, returncode or 1, project_path)
+        self.returncode = returncode
+        self.output = output.decode('utf-8', errors='replace') if isinstance(output, bytes) else output
+        self.report = report
+
+    def to_dict(self) -> Dict:
+        return dict(super().to_dict(), returncode=self.returncode, output=self.output, report=self.report)
+
+class ValidationError(TerraformCommandError):
+    '''
+    Validation of a generated project failed, the project directory was removed
+    '''
+
+class ApplyError(TerraformCommandError):
+    '''
+    Apply failed, report holds the outcome decided by the apply failure policy
+    '''
+
+class DestroyError(TerraformCommandError):
+    '''
+    Destroy failed, the project directory is kept
+    '''
@@ -1,18 +1,22 @@
 # coding: utf-8
 
 import json
-import yaml
+import copy
 from pathlib import Path, PurePath
 import os
-import sys
 import shutil
 import subprocess
 import secrets
 import base64
 import datetime
+import re
+import time
 from jinja2 import Environment, FileSystemLoader
 import textwrap
-from typing import List, Dict, Optional
+from tempfile import TemporaryDirectory
+from functools import lru_cache
+from contextlib import nullcontext
+from typing import Callable, List, Dict, Optional, Tuple
 
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
@@ -20,24 +24,34 @@ from cryptography.hazmat.backends import default_backend
 
 from edbterraform import __version__, __python_version__, __virtual_env__, __dot_project__
 from edbterraform.utils.dict import change_keys
-from edbterraform.utils.files import load_yaml_file, render_template
-from edbterraform.utils.logs import logger
+from edbterraform.utils.files import load_yaml_file, render_template, dump_yaml, write_json_file
+from edbterraform.utils.logs import ContextThreadPoolExecutor, logger
+from edbterraform.errors import ProjectExistsError, GenerationError, ValidationError, ApplyError, DestroyError
 from edbterraform.CLI import TerraformCLI
+from edbterraform.cloud_lookups import resolve_cloud_lookups
+from edbterraform.targets import resolve_targets, load_project_targets
+from edbterraform.registry import record_project
+from edbterraform.scheduler import project_slot
+from edbterraform.state_server import REMOTE_STATE_TYPE, STATE_SERVER_PORT, backend_configuration, ensure_state_server, project_state_server_port
+
+@lru_cache(maxsize=None)
+def template_environment(csp):
+    # One environment per cloud service provider keeps compiled templates between generations
+    # Templates are located in __file__/data/templates/<cloud-service-provider>
+    current_dir = Path(__file__).parent.resolve()
+    templates_dir = PurePath.joinpath(
+        current_dir, 'data', 'templates', csp
+    )
+    file_loader = FileSystemLoader(str(templates_dir))
+    return Environment(loader=file_loader, trim_blocks=True)
 
 def tpl(template_name, dest, csp, vars={}):
     # Renders and saves a jinja2 template based on a given template name and
     # variables.
 
     try:
-        # Templates are located in __file__/data/templates/<cloud-service-provider>
-        current_dir = Path(__file__).parent.resolve()
-        templates_dir = PurePath.joinpath(
-            current_dir, 'data', 'templates', csp
-        )
-
         # Jinja2 rendering
-        file_loader = FileSystemLoader(str(templates_dir))
-        env = Environment(loader=file_loader, trim_blocks=True)
+        env = template_environment(csp)
         template = env.get_template(template_name)
 
         # Render and save
@@ -47,13 +61,14 @@ def tpl(template_name, dest, csp, vars={}):
 
     except Exception as e:
         logger.error("ERROR: could not render template %s (%s)" % (template_name, e))
-        sys.exit(1)
+        raise GenerationError("ERROR: could not render template %s (%s)" % (template_name, e)) from e
 
-def update_terraform_blocks(file, template_vars, infra_vars, cloud_service_provider, remote_state_type='local', blocks=['provider', 'terraform',]):
+def update_terraform_blocks(file, template_vars, infra_vars, cloud_service_provider, remote_state_type='local', blocks=['provider', 'terraform',], state_server_port=STATE_SERVER_PORT, compact=False):
     '''
     Update terraform blocks from a terraform json configuration file:
     - provider
     - terraform
+    The file is only replaced once the blocks are updated and when its content changes
     '''
     csp_terraform_provider = {
         'aws': 'aws',
@@ -70,63 +85,65 @@ def update_terraform_blocks(file, template_vars, infra_vars, cloud_service_provi
     }
     try:
         data = load_yaml_file(file)
-        with open(file, 'w') as f:
-            for block in blocks:
-
-                # Due to limitations of terraform 1.x,
-                # we need to update the provider block for each region that will be used.
-                # We must set the region and an alias to avoid conflicts for each provider block.
-                if block == 'provider':
-                    if block not in data:
-                        data[block] = dict()
-
-                    provider_name = csp_terraform_provider.get(cloud_service_provider, cloud_service_provider)
-                    for region in infra_vars['spec']['regions']:
-                        if provider_name not in data[block]:
-                            data[block][provider_name] = list()
-                            # Azure requires a generic features block otherwise it fails with '"features" block is required'
-                            if cloud_service_provider == 'azure':
-                                data[block][provider_name].append({'features': {'resource_group': {'prevent_deletion_if_contains_resources': False}}})
-
-                        items = {'alias': region.replace('-','_')}
-
-                        # Allow force destruction of resources in the resource group
+        for block in blocks:
+
+            # Due to limitations of terraform 1.x,
+            # we need to update the provider block for each region that will be used.
+            # We must set the region and an alias to avoid conflicts for each provider block.
+            if block == 'provider':
+                if block not in data:
+                    data[block] = dict()
+
+                provider_name = csp_terraform_provider.get(cloud_service_provider, cloud_service_provider)
+                for region in infra_vars['spec']['regions']:
+                    if provider_name not in data[block]:
+                        data[block][provider_name] = list()
+                        # Azure requires a generic features block otherwise it fails with '"features" block is required'
                         if cloud_service_provider == 'azure':
-                                items['features'] = {'resource_group': {'prevent_deletion_if_contains_resources': False}}
-
-                        # Azure and Gcloud don't require a region to be set in the provider block,
-                        #   but assume region restrictions due to AWS
-                        if cloud_service_provider != 'azure':
-                            items['region'] = region
-                        data[block][provider_name].append(items)
-
-
-                # https://developer.hashicorp.com/terraform/language/v1.3.x/settings/backends/configuration
-                # Update the terraform backend block with the remote state type.
-                # Expected as { terraform: { backend: { <remote_state_type>: {} }}
-                # Set as an empty configuration to force the user to configure the resources with:
-                # - CLI options: `terraform init -backend-config="KEY=VALUE"`
-                # - Filepath with recommend filename scheme - `*.<backendname>.tfbackend`: `terraform init -backend-config="PATH"`
-                # - Interactive when `--input=false` is not set.
-                # Credentials can still be exposed in 2 ways:
-                # - terraform.tfstate files
-                # - .terraform/ directory files
-                if block == 'terraform':
-                    if block not in data:
-                        data[block] = dict()
-                    # Setup/Overwrite the backend block
-                    if 'backend' not in data[block] or data[block]['backend']:
-                        data[block]['backend'] = dict()
-                    # Handle the remote state type with the cloud providers storage service
-                    if remote_state_type == 'cloud':
-                        remote_state_type = cloud_service_provider
-
-                    data[block]['backend'][csp_terraform_backend.get(remote_state_type, remote_state_type)] = {}
-
-                    # Set the required terraform version
-                    data[block]['required_version'] = '>= %s, <= %s' % (TerraformCLI.min_version.to_string(), TerraformCLI.max_version.to_string())
-
-            f.write(json.dumps(data, indent=2, sort_keys=True))
+                            data[block][provider_name].append({'features': {'resource_group': {'prevent_deletion_if_contains_resources': False}}})
+
+                    items = {'alias': region.replace('-','_')}
+
+                    # Allow force destruction of resources in the resource group
+                    if cloud_service_provider == 'azure':
+                            items['features'] = {'resource_group': {'prevent_deletion_if_contains_resources': False}}
+
+                    # Azure and Gcloud don't require a region to be set in the provider block,
+                    #   but assume region restrictions due to AWS
+                    if cloud_service_provider != 'azure':
+                        items['region'] = region
+                    data[block][provider_name].append(items)
+
+
+            # https://developer.hashicorp.com/terraform/language/v1.3.x/settings/backends/configuration
+            # Update the terraform backend block with the remote state type.
+            # Expected as { terraform: { backend: { <remote_state_type>: {} }}
+            # Set as an empty configuration to force the user to configure the resources with:
+            # - CLI options: `terraform init -backend-config="KEY=VALUE"`
+            # - Filepath with recommend filename scheme - `*.<backendname>.tfbackend`: `terraform init -backend-config="PATH"`
+            # - Interactive when `--input=false` is not set.
+            # Credentials can still be exposed in 2 ways:
+            # - terraform.tfstate files
+            # - .terraform/ directory files
+            if block == 'terraform':
+                if block not in data:
+                    data[block] = dict()
+                # Setup/Overwrite the backend block
+                if 'backend' not in data[block] or data[block]['backend']:
+                    data[block]['backend'] = dict()
+                # Handle the remote state type with the cloud providers storage service
+                if remote_state_type == 'cloud':
+                    remote_state_type = cloud_service_provider
+
+                data[block]['backend'][csp_terraform_backend.get(remote_state_type, remote_state_type)] = {}
+                # The embedded state server is configured with the http backend of the project
+                if remote_state_type == REMOTE_STATE_TYPE:
+                    data[block]['backend'] = {'http': backend_configuration(Path(file).parent, state_server_port)}
+
+                # Set the required terraform version
+                data[block]['required_version'] = '>= %s, <= %s' % (TerraformCLI.min_version.to_string(), TerraformCLI.max_version.to_string())
+
+        write_json_file(file, data, compact)
     except Exception as e:
         raise Exception('ERROR: could not update terraform blocks in %s - (%s)' % (file, repr(e)))
 
@@ -136,10 +153,13 @@ def create_project_dir(
         infrastructure_file,
         template_variables,
         infrastructure_variables,
-        user_hcl_lock_file
+        user_hcl_lock_file,
+        on_providers_ready: Optional[Callable[[Path], None]] = None,
     ):
     '''
     Create new terraform project directory and copy needed files
+    - provider and version files along with the hcl lock file,
+      after which on_providers_ready is called with the project directory
     - cloud service provider modules
     - edb-terraform backup files
       - infrastructure.yml.j2 template file
@@ -170,18 +190,14 @@ def create_project_dir(
     BACKUP_TEMPLATE_FINAL = EDB_TERRAFORM_DIRECTORY / 'terraform.tfvars.yml'
     BACKUP_SYSTEM = EDB_TERRAFORM_DIRECTORY / 'system.yml'
     if project_directory.exists():
-        sys.exit("ERROR: directory %s already exists" % project_directory)
+        raise ProjectExistsError("ERROR: directory %s already exists" % project_directory, project_path=project_directory)
 
     if not TERRAFORM_CLOUD_MODULES_DIRECTORY.exists():
-        sys.exit("ERROR: directory %s does not exist" % TERRAFORM_CLOUD_MODULES_DIRECTORY)
+        raise GenerationError("ERROR: directory %s does not exist" % TERRAFORM_CLOUD_MODULES_DIRECTORY)
 
     try:
-        logger.info(f'Making directory and copying terraform modules {TERRAFORM_CLOUD_MODULES_DIRECTORY} into {project_directory}')
-        shutil.copytree(TERRAFORM_CLOUD_MODULES_DIRECTORY, TERRAFORM_PROJECT_MODULES_DIRECTORY)
-        shutil.copytree(TERRAFORM_BIGANIMAL_MODULES_DIRECTORY, TERRAFORM_PROJECT_MODULES_DIRECTORY, dirs_exist_ok=True)
-        shutil.copyfile(TERRAFORM_PROVIDERS_FILE, project_directory / TERRAFORM_PROVIDERS_FILE.name)
-        shutil.copyfile(TERRAFORM_VERSIONS_FILE, project_directory / TERRAFORM_VERSIONS_FILE.name)
-        shutil.copyfile(TERRAFORM_COMMON_VARS_FILE, project_directory / TERRAFORM_COMMON_VARS_FILE.name)
+        logger.info(f'Making directory {project_directory}')
+        project_directory.mkdir(parents=True)
         os.chmod(project_directory, PROJECT_PATH_PERMISSIONS)
 
         # Create the statefile and change file/folder permissions 
@@ -189,6 +205,10 @@ def create_project_dir(
         TERRAFORM_STATE_FILE.touch()
         os.chmod(TERRAFORM_STATE_FILE, TERRAFORM_STATE_PERMISSIONS)
 
+        # Provider requirements are known before anything else is generated
+        shutil.copyfile(TERRAFORM_PROVIDERS_FILE, project_directory / TERRAFORM_PROVIDERS_FILE.name)
+        shutil.copyfile(TERRAFORM_VERSIONS_FILE, project_directory / TERRAFORM_VERSIONS_FILE.name)
+
         if user_hcl_lock_file:
             logger.info(f'Copying HCL lock file: {user_hcl_lock_file}')
             shutil.copyfile(user_hcl_lock_file, HCL_LOCK_FILE)
@@ -196,16 +216,30 @@ def create_project_dir(
             logger.info(f'HCL lock file was not provided. Terraform will create one under {HCL_LOCK_FILE} during terraform init')
             HCL_LOCK_FILE.touch()
 
-        logger.info(f'Copying edb-terraform files into {EDB_TERRAFORM_DIRECTORY}')
+        # Backup the lock file before a provider prefetch is able to update it
         EDB_TERRAFORM_DIRECTORY.mkdir(parents=True, exist_ok=True)
         shutil.copyfile(HCL_LOCK_FILE, EDB_TERRAFORM_DIRECTORY / 'terraform.lock.hcl')
+
+        if on_providers_ready:
+            on_providers_ready(project_directory)
+
+        logger.info(f'Copying terraform modules {TERRAFORM_CLOUD_MODULES_DIRECTORY} into {project_directory}')
+        shutil.copytree(TERRAFORM_CLOUD_MODULES_DIRECTORY, TERRAFORM_PROJECT_MODULES_DIRECTORY)
+        shutil.copytree(TERRAFORM_BIGANIMAL_MODULES_DIRECTORY, TERRAFORM_PROJECT_MODULES_DIRECTORY, dirs_exist_ok=True)
+        shutil.copyfile(TERRAFORM_COMMON_VARS_FILE, project_directory / TERRAFORM_COMMON_VARS_FILE.name)
+
+        logger.info(f'Copying edb-terraform files into {EDB_TERRAFORM_DIRECTORY}')
         shutil.copyfile(TERRAFORM_PROVIDERS_FILE, EDB_TERRAFORM_DIRECTORY / TERRAFORM_PROVIDERS_FILE.name)
         shutil.copyfile(TERRAFORM_VERSIONS_FILE, EDB_TERRAFORM_DIRECTORY / TERRAFORM_VERSIONS_FILE.name)
-        shutil.copyfile(infrastructure_file, BACKUP_TEMPLATE)
+        if infrastructure_file:
+            shutil.copyfile(infrastructure_file, BACKUP_TEMPLATE)
+        else:
+            # In-memory specs have no template, keep the spec itself
+            BACKUP_TEMPLATE.write_text(dump_yaml(infrastructure_variables))
         with open(BACKUP_TEMPLATE_INPUTS, 'a') as f:
-            f.write(yaml.dump(template_variables))
+            f.write(dump_yaml(template_variables))
         with open(BACKUP_TEMPLATE_FINAL, 'a') as f:
-            f.write(yaml.dump(infrastructure_variables))
+            f.write(dump_yaml(infrastructure_variables))
         with open(BACKUP_SYSTEM, 'a') as f:
             system_data = {
                 'edb-terraform': {'version': __version__},
@@ -214,7 +248,7 @@ def create_project_dir(
                     'venv': __virtual_env__,
                 },
             }
-            f.write(yaml.dump(system_data))
+            f.write(dump_yaml(system_data))
 
     except Exception as e:
         logger.error("ERROR: cannot create project directory %s (%s)" % (project_directory, e))
@@ -224,7 +258,35 @@ def create_project_dir(
             TERRAFORM_STATE_FILE.touch()
             os.chmod(TERRAFORM_STATE_FILE, TERRAFORM_STATE_PERMISSIONS)
 
-        sys.exit(1)
+        raise GenerationError("ERROR: cannot create project directory %s (%s)" % (project_directory, e), project_path=project_directory) from e
+
+def prefetch_providers(project_directory: Path, bin_path, version) -> bool:
+    '''
+    Download the providers of a project into its .terraform directory ahead of `terraform init`.
+    Only versions.tf and the HCL lock file are needed to resolve providers,
+      so a scratch directory is used to avoid terraform reading files which are still being generated.
+    When the user did not provide a lock file, the resolved lock file is copied into the project
+      so `terraform init` reuses the installed providers instead of downloading them again.
+
+    Returns True if the providers were installed.
+    '''
+    HCL_LOCK_FILE = project_directory / '.terraform.lock.hcl'
+    TERRAFORM_VERSIONS_FILE = project_directory / 'versions.tf'
+    TERRAFORM_DATA_DIRECTORY = project_directory / '.terraform'
+    try:
+        terraform = TerraformCLI(bin_path, version)
+        with TemporaryDirectory(prefix='edb-terraform-prefetch-') as scratch:
+            scratch = Path(scratch)
+            shutil.copyfile(TERRAFORM_VERSIONS_FILE, scratch / TERRAFORM_VERSIONS_FILE.name)
+            shutil.copyfile(HCL_LOCK_FILE, scratch / HCL_LOCK_FILE.name)
+            logger.info(f'Prefetching providers into {TERRAFORM_DATA_DIRECTORY}')
+            terraform.prefetch_command(scratch, TERRAFORM_DATA_DIRECTORY)
+            if HCL_LOCK_FILE.stat().st_size == 0:
+                shutil.copyfile(scratch / HCL_LOCK_FILE.name, HCL_LOCK_FILE)
+        return True
+    except Exception as e:
+        logger.warning(f'Provider prefetch skipped, providers will be downloaded during terraform init - ({e})')
+        return False
 
 def destroy_project_dir(dir):
     if not os.path.exists(dir):
@@ -234,19 +296,17 @@ def destroy_project_dir(dir):
         logger.info(f'Destroying directory: {dir}')
         shutil.rmtree(dir)
     except Exception as e:
-        raise("Error: unable to delete project directory %s (%s)" % (dir, e))
+        raise GenerationError("ERROR: unable to delete project directory %s (%s)" % (dir, e), project_path=dir) from e
 
-def save_terraform_vars(dir, filename, vars):
-    # Saves terraform variables as a JSON file.
+def save_terraform_vars(dir, filename, vars, compact=False):
+    # Saves terraform variables as a JSON file, unchanged files are not rewritten.
 
     dest = dir / filename
     try:
-        with open(dest, 'w') as f:
-            content = json.dumps(vars, indent=2, sort_keys=True)
-            f.write(content)
+        write_json_file(dest, vars, compact)
     except Exception as e:
         logger.error("ERROR: could not write %s (%s)" % (dest, e))
-        sys.exit(1)
+        raise GenerationError("ERROR: could not write %s (%s)" % (dest, e), project_path=dir) from e
 
 def save_user_templates(project_path: Path, templates: List[str]):
     '''
@@ -281,7 +341,7 @@ def save_user_templates(project_path: Path, templates: List[str]):
         logger.error("Cannot create template (%s)" % (e))
         logger.error("Current working directory: %s" % (Path.cwd()))
         logger.error("List of templates: %s" % (templates))
-        sys.exit(1)
+        raise GenerationError("ERROR: cannot save templates %s (%s)" % (templates, e), project_path=project_path) from e
 
 def regions_to_peers(regions):
     # Build a list of peer regions, based on a given list of regions.
@@ -303,6 +363,60 @@ def regions_to_peers(regions):
     return peer_list
 
 
+# Cloud service providers whose templates can use an existing network per region
+EXISTING_NETWORK_PROVIDERS = ['aws']
+
+def region_networks(csp: str, spec: Dict) -> Dict[str, Dict]:
+    '''
+    Existing networks set per region with regions.<region>.network, ex: from a network pool
+      network:
+        vpc_id: vpc-0123
+        route_table_id: rtb-0123
+        subnets:
+          <zone name>: subnet-0123
+
+    Returns the network of each region which has one
+    '''
+    networks = {region: values['network'] for region, values in (spec.get('regions') or {}).items() if values.get('network')}
+    if networks and csp not in EXISTING_NETWORK_PROVIDERS:
+        raise GenerationError("ERROR: existing networks are only supported with %s, found in regions: %s" % (', '.join(EXISTING_NETWORK_PROVIDERS), ', '.join(networks)))
+    for region, network in networks.items():
+        missing = [zone for zone in spec['regions'][region].get('zones') or {} if zone not in network.get('subnets', {})]
+        if not network.get('vpc_id') or missing:
+            raise GenerationError("ERROR: network of region %s needs a vpc_id and a subnet for each zone, missing subnets: %s" % (region, ', '.join(missing)))
+    return networks
+
+def zone_names(zones: Dict) -> List[str]:
+    '''
+    Names of the zones of a region once handled by spec_compatability,
+      zones defined with only a cidr block are renamed depreciated-<zone>
+    '''
+    if isinstance(zones, dict) and all(isinstance(cidr, str) for cidr in zones.values()):
+        return [f'depreciated-{zone}' for zone in zones]
+    return list(zones or {})
+
+def attach_network_pool(spec: Dict, pool: Dict) -> Dict:
+    '''
+    Use the networks of a network pool for every region of a spec.
+    The cidr block and zones of each region are replaced by the ones of the pool
+      and zones which are not part of the pool are rejected.
+    '''
+    regions = spec.get('regions') or {}
+    missing = [region for region in regions if region not in pool['regions']]
+    if missing:
+        raise GenerationError("ERROR: regions %s are not part of network pool %s, available regions: %s" % (', '.join(missing), pool['name'], ', '.join(pool['regions'])))
+    for region, values in regions.items():
+        pooled = pool['regions'][region]
+        zones = values.pop('azs', None) or values.get('zones') or {}
+        # Pool zones went through spec_compatability, compare the zones of the spec the same way
+        unknown = [zone for zone, name in zip(zones, zone_names(zones)) if name not in pooled['zones']]
+        if unknown:
+            raise GenerationError("ERROR: zones %s of region %s are not part of network pool %s, available zones: %s" % (', '.join(unknown), region, pool['name'], ', '.join(pooled['zones'])))
+        values['cidr_block'] = pooled['cidr_block']
+        values['zones'] = copy.deepcopy(pooled['zones'])
+        values['network'] = copy.deepcopy(pooled['network'])
+    return spec
+
 def object_regions(object_type, vars):
     # Returns the region list used by an object type. Object types are:
     # machines or databased
@@ -323,6 +437,28 @@ def object_regions(object_type, vars):
 
     return regions
 
+def object_region_images(object_type, vars):
+    # Returns the image names used by an object type within each region,
+    # so image lookups are only done where they are needed
+
+    images = {}
+
+    if object_type not in vars:
+        return images
+
+    for _, value in vars[object_type].items():
+        region = value.get('region')
+        image_name = value.get('image_name')
+
+        if not region or not image_name:
+            continue
+
+        images.setdefault(region, [])
+        if image_name not in images[region]:
+            images[region].append(image_name)
+
+    return images
+
 def build_vars(csp: str, infra_vars: Path, server_output_name: str):
 
     # Based on the infra variables, returns a tuple composed of (terraform
@@ -331,20 +467,28 @@ def build_vars(csp: str, infra_vars: Path, server_output_name: str):
     # Get a spec compatable object
     infra_vars = spec_compatability(infra_vars, csp)
 
+    # Regions with an existing network are already peered by whoever manages the network, such as a network pool
+    networks = region_networks(csp, infra_vars)
+    peers = regions_to_peers({region: values for region, values in infra_vars.get('regions', {}).items() if region not in networks})
+    if networks and len(networks) < len(infra_vars.get('regions', {})):
+        logger.warning(f'Regions with an existing network ({", ".join(networks)}) are not peered with the other regions of the project')
+
     # Variables used in the template files
     # Build jinja template variable
     template_vars = dict(
         output_name = server_output_name,
-        has_region_peering=(infra_vars.get('regions') and len(infra_vars['regions'].keys()) > 1),
+        has_region_peering=len(peers) > 0,
         has_regions=('regions' in infra_vars),
         has_machines=('machines' in infra_vars),
         has_databases=('databases' in infra_vars),
         has_biganimal=('biganimal' in infra_vars),
         has_kubernetes=('kubernetes' in infra_vars),
         regions=infra_vars.get('regions',{}).copy(),
-        peers=regions_to_peers(infra_vars.get('regions',{})),
+        peers=peers,
+        networks=networks,
         # biganimal regions are not needed since the BigAnimal Provider is not region specific.
         machine_regions=object_regions('machines', infra_vars),
+        machine_images=object_region_images('machines', infra_vars),
         database_regions=object_regions('databases', infra_vars),
         kubernetes_regions=object_regions('kubernetes', infra_vars),
 
@@ -381,16 +525,33 @@ def generate_terraform(
         apply: bool = False,
         destroy: bool = False,
         remote_state_type: str = 'local',
+        state_server_port: int = STATE_SERVER_PORT,
+        cloud_lookups: bool = True,
+        refresh_cloud_cache: bool = False,
+        on_apply_failure: str = 'destroy',
+        only: Optional[List[str]] = None,
+        compact_json: bool = False,
+        infra_spec: Optional[Dict] = None,
+        schedule: bool = False,
+        network_pool: Optional[Dict] = None,
     ) -> dict:
     """
     Generates the terraform files from jinja templates and terraform modules and
     saves the files into a project_directory for use with 'terraform' commands
+    Zones, images and instance types are resolved through the cloud cache when cloud_lookups is set
+    When only is set with apply, only the selected spec objects are applied, ex: ['machines:pg1,pg2', 'biganimal:*']
+    When compact_json is set, terraform.tfvars.json and providers.tf.json are saved without indentation
+    When infra_spec is set, it is used as the infrastructure variables instead of rendering infra_file
+    When schedule is set, apply and destroy wait for a slot of the host-wide scheduler
+    When network_pool is set, every region uses the existing network of the pool instead of creating one
 
     Returns a dictionary with the following keys:
     - terraform_output: usable with terraform outputs command after terraform apply 
     - ssh_filename
+    - apply: the apply report, when apply is set
     """
     SERVERS_OUTPUT_NAME = 'servers'
+    start = time.monotonic()
     OUTPUT = {
         'project_path': '',
         'terraform_output': '',
@@ -398,61 +559,91 @@ def generate_terraform(
     }
 
     # Destroy existing project before creating a new one
-    run_terraform(project_path, bin_path, terraform_version, validate=False, apply=False, destroy=destroy)
+    run_terraform(project_path, bin_path, terraform_version, validate=False, apply=False, destroy=destroy, schedule=schedule)
 
     # Get final instrastructure variables after rendering it if it is a jinja2 template
-    infra_vars = load_yaml_file(render_template(template_file=infra_file, values=infra_template_variables))
-
-    # Duplicate terraform code into target project directory
-    create_project_dir(project_path, csp, infra_file, infra_template_variables, infra_vars, hcl_lock_file)
-
-    # Allow for user supplied templates
-    # Terraform does not allow us to copy a template and then reference it within the same run when using templatefile()
-    # To get past this, we will need to copy over all the user passed templates into the project directory
+    if infra_spec is not None:
+        infra_vars = copy.deepcopy(infra_spec)
+    else:
+        infra_vars = load_yaml_file(render_template(template_file=infra_file, values=infra_template_variables))
+    if network_pool:
+        attach_network_pool(infra_vars.get(csp, {}), network_pool)
+
+    # User supplied templates are saved into project_name/templates/ and removed from the terraform variables
     infra_file_templates = infra_vars.get(csp, {}).get('templates', [])
     if not isinstance(infra_file_templates, list):
         raise TypeError("Template variables should pass in a list of strings that represent a path or rely on the CLI passthrough")
-    # Remove templates from final terraform variables since save_user_templates will save them into project_name/templates/
-    if infra_file_templates:
-        del infra_vars[csp]['templates']
-    user_templates.extend(infra_file_templates)
-    save_user_templates(project_path, user_templates)
 
     # Transform variables extracted from the infrastructure file into
     # terraform and templates variables.
+    # Done before the project directory is created so invalid networks fail early,
+    # build_vars leaves infra_vars as is for the backup of the project directory
     (terraform_vars, template_vars) = \
         build_vars(csp, infra_vars, SERVERS_OUTPUT_NAME)
+    terraform_vars['spec'].pop('templates', None)
+
+    # Download providers in the background while the rest of the project is generated,
+    # it only happens when terraform init will be run by edb-terraform.
+    # Leaving the block waits for the prefetch, also when generation fails, so terraform init reuses the prefetched providers
+    with ContextThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch') as executor:
+        def start_prefetch(directory):
+            if run_validation or apply:
+                executor.submit(prefetch_providers, directory, bin_path, terraform_version)
+
+        # Duplicate terraform code into target project directory
+        create_project_dir(project_path, csp, infra_file, infra_template_variables, infra_vars, hcl_lock_file, start_prefetch)
+
+        # Allow for user supplied templates
+        # Terraform does not allow us to copy a template and then reference it within the same run when using templatefile()
+        # To get past this, we will need to copy over all the user passed templates into the project directory
+        # A new list so the caller's list is left as is between generations
+        user_templates = list(user_templates or []) + infra_file_templates
+        save_user_templates(project_path, user_templates)
+
+        # Fail on unknown selectors before anything is applied
+        targets = resolve_targets(terraform_vars['spec'], csp, only) if apply and only else None
+
+        # Resolve rarely changing cloud data ahead of time so plans can skip the data sources
+        if cloud_lookups:
+            lookups = resolve_cloud_lookups(csp, terraform_vars['spec'], bin_path, refresh_cloud_cache)
+            if lookups['regions']:
+                terraform_vars['cloud_lookups'] = lookups
+
+        # Save terraform vars file
+        save_terraform_vars(
+            project_path, 'terraform.tfvars.json', terraform_vars, compact_json
+        )
 
-    # Save terraform vars file
-    save_terraform_vars(
-        project_path, 'terraform.tfvars.json', terraform_vars
-    )
-
-    # Generate the main.tf files.
-    tpl(
-        'main.tf.j2',
-        project_path / 'main.tf',
-        csp,
-        template_vars
-    )
+        # Generate the main.tf files.
+        tpl(
+            'main.tf.j2',
+            project_path / 'main.tf',
+            csp,
+            template_vars
+        )
 
-    # Generate provider.tf.json
-    update_terraform_blocks(
-        project_path / 'providers.tf.json',
-        template_vars,
-        terraform_vars,
-        csp,
-        remote_state_type,
-        ['provider', 'terraform'],
-    )
+        # Generate provider.tf.json
+        update_terraform_blocks(
+            project_path / 'providers.tf.json',
+            template_vars,
+            terraform_vars,
+            csp,
+            remote_state_type,
+            ['provider', 'terraform'],
+            state_server_port,
+            compact_json,
+        )
 
-    # terraform_vars holds the spec object for use in terraform
-    OUTPUT['terraform_output'] = SERVERS_OUTPUT_NAME
-    if 'ssh_key' in terraform_vars['spec'] and 'output_name' in terraform_vars['spec']['ssh_key']:
-        OUTPUT['ssh_filename'] = terraform_vars['spec']['ssh_key']['output_name']
-    OUTPUT['project_path'] = str(project_path.resolve())
+        # terraform_vars holds the spec object for use in terraform
+        OUTPUT['terraform_output'] = SERVERS_OUTPUT_NAME
+        if 'ssh_key' in terraform_vars['spec'] and 'output_name' in terraform_vars['spec']['ssh_key']:
+            OUTPUT['ssh_filename'] = terraform_vars['spec']['ssh_key']['output_name']
+        OUTPUT['project_path'] = str(project_path.resolve())
 
-    run_terraform(project_path, bin_path, terraform_version, run_validation, apply)
+    record_project(project_path, 'generated', 'generate', time.monotonic() - start, terraform_version)
+    report = run_terraform(project_path, bin_path, terraform_version, run_validation, apply, on_apply_failure=on_apply_failure, targets=targets, schedule=schedule)
+    if apply:
+        OUTPUT['apply'] = report
 
     logger.info(textwrap.dedent('''
     Success!
@@ -471,12 +662,54 @@ def generate_terraform(
 
     return OUTPUT
 
-def run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=False):
+def apply_project(
+        project_path: Path,
+        bin_path: Path,
+        terraform_version: str = TerraformCLI.max_version.to_string(),
+        only: Optional[List[str]] = None,
+        on_apply_failure: str = 'keep',
+        schedule: bool = False,
+    ) -> dict:
+    '''
+    Apply an existing project, or only the selected spec objects and their network when only is set,
+      ex: ['machines:pg1,pg2', 'biganimal:*']
+    When schedule is set, the apply waits for a slot of the host-wide scheduler
+
+    Returns the apply report
+    '''
+    project_path = Path(project_path)
+    if not (project_path / 'terraform.tfvars.json').exists():
+        raise FileNotFoundError("ERROR: %s is not a project generated by edb-terraform" % project_path)
+    targets = load_project_targets(project_path, only) if only else None
+    return run_terraform(project_path, bin_path, terraform_version, apply=True, on_apply_failure=on_apply_failure, targets=targets, schedule=schedule)
+
+def run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=False, on_apply_failure='destroy', targets=None, schedule=False):
+        '''
+        Run terraform within a project directory.
+        When targets are set, apply only plans the target addresses and their dependencies.
+        When apply fails, on_apply_failure decides what happens to the partially applied project:
+        - destroy: destroy the created resources and the project directory
+        - keep: keep the partial state so the project can be applied again
+        - retry[:N]: plan and apply again up to N times with an increasing delay,
+            each plan only contains what is missing from the partial state which is kept if all attempts fail
+        When schedule is set, each apply and destroy first waits for a slot of the host-wide scheduler,
+          weighted by the planned changes or the state, and runs with the parallelism it was given.
+
+        Returns the apply report when apply is set: outcome, attempts and failed_resources
+        '''
         terraform = TerraformCLI(bin_path, version)
+        start = time.monotonic()
+        # Projects with the local-http remote state need the state server running for any terraform command
+        port = project_state_server_port(cwd) if (destroy or validate or apply) else None
+        if port:
+            ensure_state_server(port)
         if destroy:
             try:
-                if terraform.destroy_command(cwd):
+                with project_slot(cwd, 'destroy', terraform) if schedule and (Path(cwd) / 'terraform.tfvars.json').exists() else nullcontext() as parallelism:
+                    destroyed = terraform.destroy_command(cwd, parallelism)
+                if destroyed:
                     destroy_project_dir(cwd)
+                    record_project(cwd, 'destroyed', 'destroy', time.monotonic() - start, version)
                 return
             except subprocess.CalledProcessError as e:
                 logger.warning(textwrap.dedent('''
@@ -491,10 +724,12 @@ def run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=F
                     min_version=terraform.min_version,
                 ))
                 logger.error(f'Error: ({e.output})')
-                sys.exit(e.returncode)
+                record_project(cwd, 'destroy-failed', 'destroy', time.monotonic() - start, version)
+                raise DestroyError("ERROR: terraform destroy failed for %s" % cwd, e.returncode, e.output, cwd) from e
             except Exception as e:
                 logger.error(f'Error: ({e})')
-                sys.exit(1)
+                record_project(cwd, 'destroy-failed', 'destroy', time.monotonic() - start, version)
+                raise DestroyError("ERROR: terraform destroy failed for %s (%s)" % (cwd, e), project_path=cwd) from e
 
         if validate:
             try:
@@ -517,14 +752,40 @@ def run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=F
                 ))
                 logger.error(f'Error: ({e.output})')
                 destroy_project_dir(cwd)
-                sys.exit(e.returncode)
+                raise ValidationError("ERROR: validation failed for %s" % cwd, e.returncode, e.output, cwd) from e
 
         if apply:
+            policy, retries = parse_apply_failure_policy(on_apply_failure)
+            report = {
+                'outcome': 'applied',
+                'policy': on_apply_failure,
+                'attempts': 0,
+                'failed_resources': [],
+            }
+            if targets:
+                report['targets'] = targets
             try:
                 terraform.init_command(cwd)
-                terraform.plan_command(cwd)
-                terraform.apply_command(cwd)
-                return
+                while True:
+                    report['attempts'] += 1
+                    try:
+                        # After a failure, the plan only contains what is missing from the partial state
+                        terraform.plan_command(cwd, targets)
+                        with project_slot(cwd, 'apply', terraform) if schedule else nullcontext() as parallelism:
+                            terraform.apply_command(cwd, parallelism=parallelism)
+                        break
+                    except subprocess.CalledProcessError as e:
+                        report['failed_resources'] = failed_resources(e.output)
+                        if policy != 'retry' or report['attempts'] > retries:
+                            raise e
+                        delay = APPLY_RETRY_BACKOFF * 2 ** (report['attempts'] - 1)
+                        logger.warning(f'Apply attempt {report["attempts"]} of {retries + 1} failed for {report["failed_resources"]}, retrying in {delay} seconds')
+                        time.sleep(delay)
+                report['failed_resources'] = []
+                logger.info(f'Apply report: {json.dumps(report)}')
+                save_apply_report(cwd, report)
+                record_project(cwd, 'applied', 'apply', time.monotonic() - start, version, count_resources=True)
+                return report
             except subprocess.CalledProcessError as e:
                 logger.warning(textwrap.dedent('''
                 Apply skipped or failed, check {bin_path}.
@@ -539,8 +800,57 @@ def run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=F
                     min_version=terraform.min_version,
                 ))
                 logger.error(f'Error: ({e.output})')
-                run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=True)
-                sys.exit(e.returncode)
+                if policy == 'destroy':
+                    report['outcome'] = 'destroyed'
+                    logger.error(f'Apply report: {json.dumps(report)}')
+                    try:
+                        run_terraform(cwd, bin_path, version, validate=False, apply=False, destroy=True, schedule=schedule)
+                    except DestroyError as destroy_error:
+                        # The apply failure is still raised with its report, the project directory is kept for a manual destroy
+                        report['outcome'] = 'destroy-failed'
+                        report['destroy_error'] = destroy_error.message
+                        logger.error(f'Apply report: {json.dumps(report)}')
+                        logger.error(f'Partially applied resources could not be destroyed, destroy them with `terraform destroy` within {cwd}')
+                        save_apply_report(cwd, report)
+                else:
+                    report['outcome'] = 'kept'
+                    logger.error(f'Apply report: {json.dumps(report)}')
+                    logger.error(f'Partial state kept, resume with `terraform plan` and `terraform apply` within {cwd} or destroy it with `terraform destroy`')
+                    save_apply_report(cwd, report)
+                    record_project(cwd, 'apply-failed', 'apply', time.monotonic() - start, version, count_resources=True)
+                raise ApplyError("ERROR: terraform apply failed for %s, project %s" % (cwd, report['outcome']), e.returncode, e.output, cwd, report) from e
+
+APPLY_FAILURE_POLICIES = ['destroy', 'keep', 'retry']
+APPLY_RETRIES = 3
+# Seconds before the first retry, doubled after each failed attempt
+APPLY_RETRY_BACKOFF = 30
+# Resource addresses within terraform error diagnostics, ex: "│   with module.machine_us_east_1["pg1"].aws_instance.machine,"
+TERRAFORM_ERROR_RESOURCE = re.compile(r'^[\s│╷╵]*with (.+?),\s*$', re.MULTILINE)
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+def parse_apply_failure_policy(policy: str) -> Tuple[str, int]:
+    '''
+    Parse an apply failure policy: destroy, keep, retry or retry:<N>
+
+    Returns (policy, number of retries)
+    '''
+    name, _, count = str(policy).partition(':')
+    if name not in APPLY_FAILURE_POLICIES \
+        or (count and (name != 'retry' or not count.isdigit())):
+        raise ValueError("ERROR: invalid apply failure policy %s, expected one of destroy, keep, retry or retry:<N>" % policy)
+    retries = int(count) if count else APPLY_RETRIES if name == 'retry' else 0
+    return (name, retries)
+
+def failed_resources(output) -> List[str]:
+    # Resources reported within the errors of a terraform command output
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', errors='replace')
+    return sorted(set(TERRAFORM_ERROR_RESOURCE.findall(ANSI_ESCAPE.sub('', output or ''))))
+
+def save_apply_report(project_path: Path, report: Dict):
+    report_file = Path(project_path) / 'edb-terraform' / 'apply-report.json'
+    if report_file.parent.exists():
+        report_file.write_text(json.dumps(report, indent=2))
 
 """
 Support backwards compatability to older specs 
@@ -628,11 +938,15 @@ def spec_compatability(infrastructure_variables, cloud_service_provider):
                 isinstance(spec_variables['regions'][region]['zones'], dict) and \
                 all([isinstance(item, str) for _, item in spec_variables['regions'][region]['zones'].items()]):
                 temp = {}
+                # Subnets of an existing network follow the zone names
+                subnets = (spec_variables['regions'][region].get('network') or {}).get('subnets') or {}
                 for zone, cidr in spec_variables['regions'][region]['zones'].items():
                     temp[f'depreciated-{zone}'] = {
                         'zone': zone,
                         'cidr': cidr,
                     }
+                    if zone in subnets and f'depreciated-{zone}' not in subnets:
+                        subnets[f'depreciated-{zone}'] = subnets.pop(zone)
                 spec_variables['regions'][region]['zones'] = temp
             # Handle ports as a single list of ports
             ports = []
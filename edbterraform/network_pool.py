@@ -0,0 +1,194 @@
+import fcntl
+import json
+import re
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from edbterraform import __dot_project__
+from edbterraform.CLI import TerraformCLI
+from edbterraform.errors import DestroyError, GenerationError
+from edbterraform.lib import EXISTING_NETWORK_PROVIDERS, generate_terraform, run_terraform
+from edbterraform.utils.files import load_yaml_file, render_template, write_json_file
+from edbterraform.utils.logs import logger
+
+NETWORK_POOL_DIRECTORY = Path(__dot_project__) / 'network-pools'
+POOL_FILE = 'pool.json'
+POOL_PROJECT = 'project'
+POOL_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+# Spec keys kept for a network pool, objects such as machines belong to the projects attached to it
+POOL_SPEC_KEYS = ['regions', 'tags']
+
+def pool_directory(name: str, directory: Path = NETWORK_POOL_DIRECTORY) -> Path:
+    if not POOL_NAME.match(str(name)):
+        raise ValueError("ERROR: invalid network pool name %s, expected letters, digits, '.', '_' or '-'" % name)
+    return Path(directory) / name
+
+@contextmanager
+def pool_lock(name: str, directory: Path = NETWORK_POOL_DIRECTORY):
+    '''
+    Serialize changes to a network pool between processes, ex: <directory>/.<name>.lock
+    '''
+    lock_file = Path(directory) / f'.{name}.lock'
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(f'Waiting for another change of network pool {name} to finish')
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def load_network_pool(name: str, directory: Path = NETWORK_POOL_DIRECTORY) -> Dict:
+    pool_file = pool_directory(name, directory) / POOL_FILE
+    if not pool_file.exists():
+        raise FileNotFoundError("ERROR: network pool %s not found, create it with `edb-terraform network-pool`" % name)
+    return json.loads(pool_file.read_bytes())
+
+def live_attachments(pool: Dict) -> List[str]:
+    # Attached projects which were not destroyed yet, destroyed projects have their directory removed
+    return [path for path in pool.get('attachments', []) if (Path(path) / 'terraform.tfvars.json').exists()]
+
+def list_network_pools(directory: Path = NETWORK_POOL_DIRECTORY) -> List[Dict]:
+    '''
+    Network pools with their regions and the projects still attached to them
+    '''
+    pools = []
+    for pool_file in sorted(Path(directory).glob(f'*/{POOL_FILE}')):
+        pool = json.loads(pool_file.read_bytes())
+        pool['attachments'] = live_attachments(pool)
+        pools.append(pool)
+    return pools
+
+def attach_project(name: str, project_path: Path, directory: Path = NETWORK_POOL_DIRECTORY) -> Dict:
+    '''
+    Record a project using a network pool, before it is generated so a partially applied project is still tracked.
+
+    Returns the network pool
+    '''
+    with pool_lock(name, directory):
+        pool = load_network_pool(name, directory)
+        attachments = live_attachments(pool)
+        project_path = str(Path(project_path).resolve())
+        if project_path not in attachments:
+            attachments.append(project_path)
+        pool['attachments'] = attachments
+        write_json_file(pool_directory(name, directory) / POOL_FILE, pool)
+    return pool
+
+def network_output(project_path: Path, bin_path, terraform_version) -> Dict:
+    terraform = TerraformCLI(bin_path, terraform_version)
+    # communicate reads both pipes together
+    process = terraform.output_command(project_path, 'networks', subprocess.PIPE)
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise Exception("ERROR: terraform output failed for networks - (%s)" % errors.decode('utf-8').strip())
+    return json.loads(output)
+
+def create_network_pool(
+        name: str,
+        csp: str,
+        spec: Union[Dict, str, Path],
+        bin_path: Path,
+        terraform_version: str = TerraformCLI.max_version.to_string(),
+        template_variables: Optional[Dict] = None,
+        on_apply_failure: str = 'destroy',
+        cloud_lookups: bool = True,
+        schedule: bool = False,
+        directory: Path = NETWORK_POOL_DIRECTORY,
+    ) -> Dict:
+    '''
+    Create a long-lived network pool: a project with only the regions of a spec, their networks and the peering between them.
+    Short-lived projects use it with `generate --network-pool <name>` and skip the creation of their own networks.
+    An existing pool is returned as is and a pool left partially applied is applied again.
+
+    Returns the network pool: its regions with their cidr block, zones and network along with the attached projects
+    '''
+    if csp not in EXISTING_NETWORK_PROVIDERS:
+        # Only these templates output their networks and accept them back as existing networks
+        raise GenerationError("ERROR: network pools are only supported with %s, got %s" % (', '.join(EXISTING_NETWORK_PROVIDERS), csp))
+    pool_path = pool_directory(name, directory)
+    project_path = pool_path / POOL_PROJECT
+    with pool_lock(name, directory):
+        if (pool_path / POOL_FILE).exists():
+            logger.info(f'Network pool {name} already exists')
+            return load_network_pool(name, directory)
+
+        if (project_path / 'terraform.tfvars.json').exists():
+            logger.info(f'Applying the partially applied network pool {name} again')
+            run_terraform(project_path, bin_path, terraform_version, apply=True, on_apply_failure='keep', schedule=schedule)
+        else:
+            if not isinstance(spec, dict):
+                spec = load_yaml_file(render_template(template_file=Path(spec).resolve(), values=template_variables or {}))
+            document = spec.get(csp, spec)
+            ignored = [key for key in document if key not in POOL_SPEC_KEYS]
+            if ignored:
+                logger.warning(f'Network pool {name} only creates networks, ignoring: {", ".join(ignored)}')
+            if not document.get('regions'):
+                raise GenerationError("ERROR: network pool %s needs at least one region" % name)
+            pool_spec = {csp: {key: document[key] for key in POOL_SPEC_KEYS if key in document}}
+            generate_terraform(
+                infra_file=None,
+                infra_spec=pool_spec,
+                project_path=project_path,
+                csp=csp,
+                bin_path=bin_path,
+                terraform_version=terraform_version,
+                apply=True,
+                on_apply_failure=on_apply_failure,
+                cloud_lookups=cloud_lookups,
+                schedule=schedule,
+            )
+
+        variables = json.loads((project_path / 'terraform.tfvars.json').read_bytes())
+        networks = network_output(project_path, bin_path, terraform_version)
+        pool = {
+            'name': name,
+            'csp': csp,
+            'project_path': str(project_path.resolve()),
+            'created_at': time.time(),
+            'regions': {
+                region: {
+                    'cidr_block': values['cidr_block'],
+                    'zones': values.get('zones') or {},
+                    'network': {
+                        'vpc_id': networks[region]['vpc_id'],
+                        'route_table_id': networks[region]['route_table_id'],
+                        'subnets': networks[region]['subnets'],
+                    },
+                }
+                for region, values in variables['spec']['regions'].items()
+            },
+            'attachments': [],
+        }
+        write_json_file(pool_path / POOL_FILE, pool)
+    logger.info(f'Network pool {name} created with regions: {", ".join(pool["regions"])}')
+    return pool
+
+def destroy_network_pool(
+        name: str,
+        bin_path: Path,
+        terraform_version: str = TerraformCLI.max_version.to_string(),
+        force: bool = False,
+        schedule: bool = False,
+        directory: Path = NETWORK_POOL_DIRECTORY,
+    ) -> Dict:
+    '''
+    Destroy a network pool, refused while projects are still attached to it unless force is set
+    '''
+    pool_path = pool_directory(name, directory)
+    with pool_lock(name, directory):
+        pool = load_network_pool(name, directory)
+        attachments = live_attachments(pool)
+        if attachments and not force:
+            raise DestroyError("ERROR: network pool %s is still used by: %s, destroy them first" % (name, ', '.join(attachments)), project_path=pool_path)
+        run_terraform(pool_path / POOL_PROJECT, bin_path, terraform_version, destroy=True, schedule=schedule)
+        shutil.rmtree(pool_path)
+    logger.info(f'Network pool {name} destroyed')
+    return {'name': name, 'destroyed': True, 'attachments': attachments}
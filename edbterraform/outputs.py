@@ -0,0 +1,138 @@
+import json
+import os
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Dict, Iterator, Tuple
+
+from edbterraform.CLI import TerraformCLI
+from edbterraform.utils.jsonstream import iter_values
+from edbterraform.utils.logs import logger
+
+SERVERS_FILE = 'servers.yml'
+SHARDS_DIRECTORY = 'servers'
+# Attributes skipped when writing yaml files, same as the servers_yml resource within main.tf
+IGNORED_ATTRIBUTES = ['resources']
+FILE_PERMISSIONS = 0o600
+
+def iter_servers(
+        project_path: Path,
+        bin_path,
+        terraform_version,
+        output_name='servers',
+        from_state=False,
+    ) -> Iterator[Tuple[str, str, dict]]:
+    '''
+    Stream the servers output of a project without loading the whole output into memory.
+    - from_state=False reads `terraform output -json <output_name>`
+    - from_state=True reads the local terraform.tfstate file directly, avoiding terraform entirely
+
+    Yields (type, name, attributes), an empty type is yielded as (type, None, {})
+    '''
+    if from_state:
+        state_file = Path(project_path) / 'terraform.tfstate'
+        prefix = ('outputs', output_name, 'value')
+        logger.info(f'Reading output {output_name} from {state_file}')
+        with state_file.open('rb') as stream:
+            for path, value in iter_values(stream, depth=5, match=lambda path: path[:3] == prefix, include_empty=True):
+                if path[:3] != prefix:
+                    continue
+                if len(path) == 4:
+                    yield (path[3], None, {})
+                else:
+                    yield (path[3], path[4], value)
+        return
+
+    terraform = TerraformCLI(bin_path, terraform_version)
+    with TemporaryFile() as stderr:
+        process = terraform.output_command(project_path, output_name, stderr)
+        try:
+            for path, value in iter_values(process.stdout, depth=2, include_empty=True):
+                if len(path) == 1:
+                    yield (path[0], None, {})
+                else:
+                    yield (path[0], path[1], value)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            stderr.seek(0)
+            errors = stderr.read().decode('utf-8', errors='replace')
+    if returncode != 0:
+        raise Exception("ERROR: terraform output failed for %s - (%s)" % (output_name, errors.strip()))
+
+def save_servers_output(
+        project_path: Path,
+        bin_path,
+        terraform_version=TerraformCLI.max_version.to_string(),
+        output_name='servers',
+        from_state=False,
+    ) -> Dict:
+    '''
+    Write servers.yml and a file per server type under servers/<type>.yml
+    while the servers output is being read.
+    servers.yml has the same shape as the file created by terraform when create_servers_yml is set,
+      allowing `TF_VAR_create_servers_yml=false` for large projects.
+    Files are written to temporary files and renamed into place once the output is complete.
+
+    Returns the written files and the number of servers per type.
+    '''
+    project_path = Path(project_path)
+    servers_file = project_path / SERVERS_FILE
+    shards_directory = project_path / SHARDS_DIRECTORY
+    OUTPUT = {
+        'servers_file': str(servers_file.resolve()),
+        'shards': {},
+        'counts': {},
+    }
+    pending = []
+
+    def open_temporary(path):
+        temporary = path.with_name(f'.{path.name}.tmp')
+        pending.append((temporary, path))
+        handle = temporary.open('w')
+        os.chmod(temporary, FILE_PERMISSIONS)
+        return handle
+
+    def attributes_yaml(attributes, indent):
+        for key in sorted(attributes):
+            if key in IGNORED_ATTRIBUTES:
+                continue
+            value = json.dumps(attributes[key], separators=(',', ':'), ensure_ascii=False)
+            yield f'{" " * indent}{key}: {value}\n'
+
+    try:
+        shards_directory.mkdir(parents=True, exist_ok=True)
+        shard = None
+        current_type = None
+        with open_temporary(servers_file) as servers:
+            servers.write('---\nservers:\n')
+            for server_type, name, attributes in iter_servers(project_path, bin_path, terraform_version, output_name, from_state):
+                if server_type != current_type:
+                    if shard:
+                        shard.close()
+                    current_type = server_type
+                    OUTPUT['counts'][server_type] = 0
+                    shard_file = shards_directory / f'{server_type}.yml'
+                    OUTPUT['shards'][server_type] = str(shard_file.resolve())
+                    shard = open_temporary(shard_file)
+                    servers.write(f'    {server_type}:\n')
+                    shard.write(f'---\n{server_type}:{" {}" if name is None else ""}\n')
+                if name is None:
+                    continue
+
+                OUTPUT['counts'][server_type] += 1
+                servers.write(f'      {name}:\n')
+                servers.writelines(attributes_yaml(attributes, 8))
+                shard.write(f'  {name}:\n')
+                shard.writelines(attributes_yaml(attributes, 4))
+            if shard:
+                shard.close()
+
+        for temporary, path in pending:
+            os.replace(temporary, path)
+        logger.info(f'Saved {output_name} output into {servers_file} and {shards_directory}')
+        return OUTPUT
+
+    except Exception as e:
+        for temporary, _ in pending:
+            temporary.unlink(missing_ok=True)
+        raise Exception("ERROR: could not save %s output into %s - (%s)" % (output_name, project_path, repr(e))) from e
@@ -0,0 +1,154 @@
+import json
+import re
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+from edbterraform.CLI import TerraformCLI
+from edbterraform.utils.files import write_json_file
+from edbterraform.utils.jsonstream import iter_values
+from edbterraform.utils.logs import logger
+
+PLAN_ACTIONS = ['create', 'update', 'replace', 'delete']
+# Resources which hold data that is lost when they are replaced
+STATEFUL_TYPES = [
+    'aws_ebs_volume',
+    'aws_db_instance',
+    'aws_rds_cluster',
+    'aws_rds_cluster_instance',
+    'google_compute_disk',
+    'google_sql_database_instance',
+    'google_sql_database',
+    'google_alloydb_cluster',
+    'google_alloydb_instance',
+    'azurerm_managed_disk',
+    'azurerm_postgresql_flexible_server',
+    'azurerm_postgresql_flexible_server_database',
+    'biganimal_cluster',
+    'biganimal_pgd',
+]
+ROOT_MODULE = 'root'
+GLOBAL_REGION = 'global'
+# First module call of an address, ex: module.machine_us_east_1["pg1"].module.volume -> module.machine_us_east_1
+MODULE_CALL = re.compile(r'^module\.([^.\[]+)')
+FILE_PERMISSIONS = 0o600
+
+def plan_action(actions: List[str]) -> Optional[str]:
+    # Terraform plans replacements as delete and create in either order
+    if 'delete' in actions and 'create' in actions:
+        return 'replace'
+    for action in PLAN_ACTIONS:
+        if action in actions:
+            return action
+    return None
+
+def iter_resource_changes(stream: IO) -> Iterator[Dict]:
+    # Only the resource changes are parsed, prior_state and planned_values are skipped while streaming
+    for path, value in iter_values(stream, depth=2, match=lambda path: path[0] == 'resource_changes'):
+        if path[0] == 'resource_changes':
+            yield value
+
+def module_suffixes(regions: List[str]) -> Dict[str, str]:
+    # Longest suffixes first so a region is not mistaken for another region ending with the same name
+    return {'_' + region.replace('-', '_'): region for region in sorted(regions, key=len, reverse=True)}
+
+def module_location(module_address: Optional[str], region_suffixes: Dict[str, str]) -> Tuple[str, str]:
+    '''
+    Module call and region of a module address with the module names created by the templates,
+      ex: module.machine_us_east_1["pg1"].module.volume -> (module.machine_us_east_1, us-east-1)
+
+    Returns the root module and the global region for resources outside of a module
+    '''
+    found = MODULE_CALL.match(module_address or '')
+    if not found:
+        return (ROOT_MODULE, GLOBAL_REGION)
+    region = next((region for suffix, region in region_suffixes.items() if found.group(1).endswith(suffix)), GLOBAL_REGION)
+    return (f'module.{found.group(1)}', region)
+
+def summarize_resource_changes(changes: Iterator[Dict], regions: List[str] = []) -> Dict:
+    '''
+    Aggregate the planned actions of resource changes per module, region and resource type.
+    Regions are found with the module names created by the templates, ex: module.machine_us_east_1 -> us-east-1
+
+    Returns the counts of each action along with the replacements of stateful resources
+    '''
+    region_suffixes = module_suffixes(regions)
+    summary = {
+        'totals': {action: 0 for action in PLAN_ACTIONS},
+        'modules': {},
+        'regions': {},
+        'types': {},
+        'stateful_replacements': [],
+    }
+
+    def count(group, key, action):
+        summary[group].setdefault(key, {name: 0 for name in PLAN_ACTIONS})
+        summary[group][key][action] += 1
+
+    for change in changes:
+        action = plan_action(change.get('change', {}).get('actions', []))
+        if action is None:
+            continue
+        module, region = module_location(change.get('module_address'), region_suffixes)
+
+        summary['totals'][action] += 1
+        count('modules', module, action)
+        count('regions', region, action)
+        count('types', change.get('type', ''), action)
+        if action == 'replace' and change.get('type') in STATEFUL_TYPES:
+            summary['stateful_replacements'].append({
+                'address': change.get('address'),
+                'type': change.get('type'),
+                'reason': change.get('action_reason'),
+            })
+    return summary
+
+def summarize_plan(
+        project_path: Path,
+        bin_path,
+        terraform_version=TerraformCLI.max_version.to_string(),
+        plan_file: Optional[str] = None,
+        create_plan: bool = False,
+        summary_file: Optional[Path] = None,
+    ) -> Dict:
+    '''
+    Summarize a saved plan while `terraform show -json` is streamed,
+      so plans of any size are summarized with memory bounded by the number of modules and resource types.
+    The plan is created first with create_plan, otherwise PROJECT_PATH/terraform.plan is expected to exist.
+
+    Returns the summary, which is also saved into summary_file when it is set
+    '''
+    project_path = Path(project_path)
+    terraform = TerraformCLI(bin_path, terraform_version)
+    plan_file = plan_file or terraform.plan_file
+    if create_plan:
+        terraform.init_command(project_path)
+        terraform.plan_command(project_path)
+    if not (project_path / plan_file).exists():
+        raise FileNotFoundError("ERROR: plan %s not found, create it with `terraform plan -out=%s` or --create-plan" % (project_path / plan_file, plan_file))
+
+    regions = []
+    variables_file = project_path / 'terraform.tfvars.json'
+    if variables_file.exists():
+        regions = list((json.loads(variables_file.read_text())['spec'].get('regions') or {}).keys())
+
+    with TemporaryFile() as stderr:
+        process = terraform.show_command(project_path, plan_file, stderr)
+        try:
+            summary = summarize_resource_changes(iter_resource_changes(process.stdout), regions)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            stderr.seek(0)
+            errors = stderr.read().decode('utf-8', errors='replace')
+    if returncode != 0:
+        raise Exception("ERROR: terraform show failed for %s - (%s)" % (plan_file, errors.strip()))
+
+    logger.info(f'Plan {plan_file}: ' + ', '.join(f'{count} to {action}' for action, count in summary['totals'].items()))
+    for replacement in summary['stateful_replacements']:
+        logger.warning(f'Stateful resource will be replaced: {replacement["address"]} ({replacement["reason"]})')
+
+    if summary_file:
+        write_json_file(summary_file, summary, permissions=FILE_PERMISSIONS)
+        logger.info(f'Saved plan summary into {summary_file}')
+    return summary
@@ -0,0 +1,165 @@
+import datetime
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from edbterraform.CLI import TerraformCLI
+from edbterraform.cleanup import cleanup_failures, cleanup_tagged_resources
+from edbterraform.drift import state_is_empty
+from edbterraform.errors import EdbTerraformError
+from edbterraform.lib import destroy_project_dir, run_terraform
+from edbterraform.network_pool import NETWORK_POOL_DIRECTORY
+from edbterraform.registry import list_projects, record_project
+from edbterraform.utils.logs import ContextThreadPoolExecutor, logger
+
+REAP_MAX_WORKERS = 4
+# Spec tag holding the time to live of a project, counted from its terraform_time tag
+TTL_TAG = 'ttl'
+# Tag identifying the resources of a project when its state is lost
+ORPHAN_TAG = 'terraform_hex'
+TTL_FORMAT = re.compile(r'^\s*(\d+)\s*([smhdw]?)\s*$')
+TTL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def parse_ttl(ttl: Union[int, str]) -> int:
+    '''
+    Seconds of a time to live given as seconds or a number with a unit, ex: 3600, 90m, 8h, 2d or 1w
+    '''
+    found = TTL_FORMAT.match(str(ttl).lower())
+    if not found:
+        raise ValueError("ERROR: invalid ttl %s, expected seconds or a number followed by s, m, h, d or w" % ttl)
+    return int(found.group(1)) * TTL_UNITS[found.group(2)]
+
+def project_expiry(project_path: Path, default_ttl: Optional[Union[int, str]] = None) -> Optional[Dict]:
+    '''
+    Creation time, time to live and expiry of a generated project from the tags of its terraform.tfvars.json
+
+    Returns None when neither the spec nor default_ttl set a time to live
+    '''
+    variables = json.loads((Path(project_path) / 'terraform.tfvars.json').read_bytes())
+    tags = variables.get('spec', {}).get('tags') or {}
+    ttl = tags.get(TTL_TAG, default_ttl)
+    if ttl is None or ttl == '':
+        return None
+    if not tags.get('terraform_time'):
+        raise ValueError("ERROR: project %s has no terraform_time tag" % project_path)
+    created = datetime.datetime.strptime(tags['terraform_time'], TIME_FORMAT).replace(tzinfo=datetime.timezone.utc).timestamp()
+    seconds = parse_ttl(ttl)
+    return {
+        'terraform_time': tags['terraform_time'],
+        'ttl': seconds,
+        'expires_at': datetime.datetime.fromtimestamp(created + seconds, datetime.timezone.utc).strftime(TIME_FORMAT),
+        'expires_in': round(created + seconds - time.time()),
+    }
+
+def is_orphan(project_path: Path) -> bool:
+    # Terraform cannot destroy anything once the local state is lost or emptied, projects with a backend keep their state elsewhere
+    return state_is_empty(project_path)
+
+def reap_project(
+        project_path: Path,
+        bin_path: Path,
+        terraform_version: str,
+        default_ttl: Optional[Union[int, str]] = None,
+        dry_run: bool = False,
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Destroy a project once its time to live expired.
+    Projects are destroyed through terraform, only orphans without resources in their local state have their resources deleted by their terraform_hex tag.
+
+    Returns the status of the project: alive, no-ttl, missing, network-pool, expired (dry_run), destroyed, cleaned or failed
+    '''
+    project_path = Path(project_path)
+    result = {'status': 'alive'}
+    try:
+        if not (project_path / 'terraform.tfvars.json').exists():
+            result['status'] = 'missing'
+            return result
+        if NETWORK_POOL_DIRECTORY.resolve() in project_path.parents:
+            # Network pools outlive the projects attached to them and are destroyed with `network-pool-destroy`
+            result['status'] = 'network-pool'
+            return result
+        expiry = project_expiry(project_path, default_ttl)
+        if expiry is None:
+            result['status'] = 'no-ttl'
+            return result
+        result.update(expiry)
+        if expiry['expires_in'] > 0:
+            return result
+
+        result['action'] = 'tag-cleanup' if is_orphan(project_path) else 'destroy'
+        if dry_run:
+            result['status'] = 'expired'
+            return result
+
+        start = time.monotonic()
+        if result['action'] == 'destroy':
+            run_terraform(project_path, bin_path, terraform_version, destroy=True, schedule=schedule)
+            result['status'] = 'destroyed'
+        else:
+            variables = json.loads((project_path / 'terraform.tfvars.json').read_bytes())
+            csp = variables.get('cloud_service_provider')
+            spec = variables.get('spec', {})
+            logger.warning(f'Project {project_path} has no state, deleting resources tagged {ORPHAN_TAG}={spec["tags"][ORPHAN_TAG]}')
+            report = cleanup_tagged_resources(
+                'gcloud' if csp == 'gcp' else csp,
+                sorted(spec.get('regions') or {}),
+                ORPHAN_TAG,
+                spec['tags'][ORPHAN_TAG],
+                bin_path,
+            )
+            result['cleanup'] = report
+            if cleanup_failures(report):
+                result['status'] = 'failed'
+                result['error'] = f'{cleanup_failures(report)} tagged resources could not be deleted'
+                record_project(project_path, 'destroy-failed', 'reap', time.monotonic() - start, terraform_version)
+            else:
+                destroy_project_dir(project_path)
+                record_project(project_path, 'destroyed', 'reap', time.monotonic() - start, terraform_version)
+                result['status'] = 'cleaned'
+    except EdbTerraformError as e:
+        result['status'] = 'failed'
+        result['error'] = e.message
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    return result
+
+def reap_projects(
+        project_paths: Optional[List[Path]],
+        bin_path: Path,
+        terraform_version: str = TerraformCLI.max_version.to_string(),
+        path_prefix: Optional[str] = None,
+        default_ttl: Optional[Union[int, str]] = None,
+        max_workers: int = REAP_MAX_WORKERS,
+        dry_run: bool = False,
+        schedule: bool = False,
+    ) -> Dict:
+    '''
+    Destroy the expired projects out of project_paths, or out of the registered projects not destroyed yet when it is empty,
+      with at most max_workers projects destroyed at a time.
+    A project expires once its terraform_time tag plus its ttl tag has passed, default_ttl is used for projects without a ttl tag.
+
+    Returns the status of each project and the number of projects per status
+    '''
+    if default_ttl is not None:
+        parse_ttl(default_ttl)
+    if not project_paths:
+        project_paths = [project['path'] for project in list_projects(path_prefix=path_prefix) if project['status'] != 'destroyed']
+    project_paths = list(dict.fromkeys(str(Path(path).resolve()) for path in project_paths))
+    report = {'projects': {}, 'counts': {}}
+
+    def reap(project_path):
+        result = reap_project(Path(project_path), bin_path, terraform_version, default_ttl, dry_run, schedule)
+        if result['status'] not in ('alive', 'no-ttl', 'missing', 'network-pool'):
+            logger.info(f'Reaping {project_path}: {result["status"]}')
+        return project_path, result
+
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='reap') as executor:
+        for project_path, result in executor.map(reap, project_paths):
+            report['projects'][project_path] = result
+            report['counts'][result['status']] = report['counts'].get(result['status'], 0) + 1
+    return report
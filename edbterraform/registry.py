@@ -0,0 +1,191 @@
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from edbterraform import __dot_project__, __version__
+from edbterraform.utils.jsonstream import iter_values
+from edbterraform.utils.logs import logger
+
+REGISTRY_FILE = Path(__dot_project__) / 'registry.db'
+# Seconds to wait on another process writing to the registry
+REGISTRY_TIMEOUT = 30
+SPEC_OBJECTS = ['machines', 'databases', 'aurora', 'alloy', 'kubernetes', 'biganimal']
+COLUMNS = [
+    'path',
+    'name',
+    'csp',
+    'regions',
+    'objects',
+    'resources',
+    'status',
+    'edb_terraform_version',
+    'terraform_version',
+    'spec_hash',
+    'last_command',
+    'last_seconds',
+    'created_at',
+    'updated_at',
+]
+# regions and objects are saved as json
+JSON_COLUMNS = ['regions', 'objects']
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects (
+    path TEXT PRIMARY KEY,
+    name TEXT,
+    csp TEXT,
+    regions TEXT,
+    objects TEXT,
+    resources INTEGER,
+    status TEXT,
+    edb_terraform_version TEXT,
+    terraform_version TEXT,
+    spec_hash TEXT,
+    last_command TEXT,
+    last_seconds REAL,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS projects_status ON projects (status);
+CREATE INDEX IF NOT EXISTS projects_csp ON projects (csp);
+CREATE INDEX IF NOT EXISTS projects_updated_at ON projects (updated_at);
+'''
+
+def connect(registry_file: Path = REGISTRY_FILE) -> sqlite3.Connection:
+    # A connection per call keeps the registry usable from threads and concurrent edb-terraform processes
+    registry_file = Path(registry_file)
+    registry_file.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(registry_file), timeout=REGISTRY_TIMEOUT)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+def count_state_resources(project_path: Path) -> Optional[int]:
+    '''
+    Count the resource instances of a local state while it is streamed
+
+    Returns None when the project has no local state, such as with a remote backend
+    '''
+    state_file = Path(project_path) / 'terraform.tfstate'
+    if not state_file.exists():
+        return None
+    if state_file.stat().st_size == 0:
+        return 0
+    count = 0
+    with state_file.open('rb') as stream:
+        for _, resource in iter_values(stream, depth=2, match=lambda path: path[0] == 'resources'):
+            count += len(resource.get('instances', []))
+    return count
+
+def project_metadata(project_path: Path) -> Dict:
+    # Metadata of a generated project from its terraform.tfvars.json
+    variables_file = Path(project_path) / 'terraform.tfvars.json'
+    if not variables_file.exists():
+        return {}
+    content = variables_file.read_bytes()
+    variables = json.loads(content)
+    spec = variables.get('spec', {})
+    csp = variables.get('cloud_service_provider')
+    return {
+        'csp': 'gcloud' if csp == 'gcp' else csp,
+        'regions': sorted(spec.get('regions') or {}),
+        'objects': {name: len(spec[name]) for name in SPEC_OBJECTS if spec.get(name)},
+        'spec_hash': hashlib.sha256(content).hexdigest(),
+    }
+
+def record_project(
+        project_path: Path,
+        status: str,
+        command: str,
+        seconds: Optional[float] = None,
+        terraform_version: Optional[str] = None,
+        count_resources: bool = False,
+        registry_file: Path = REGISTRY_FILE,
+    ):
+    '''
+    Insert or update a project within the registry.
+    The registry only keeps track of projects, failures are logged and never stop a command.
+    '''
+    try:
+        project_path = Path(project_path).resolve()
+        now = time.time()
+        values = dict(
+            project_metadata(project_path),
+            path=str(project_path),
+            name=project_path.name,
+            status=status,
+            edb_terraform_version=__version__,
+            last_command=command,
+            last_seconds=seconds,
+            updated_at=now,
+        )
+        if terraform_version:
+            values['terraform_version'] = str(terraform_version)
+        if count_resources:
+            values['resources'] = count_state_resources(project_path)
+        for column in JSON_COLUMNS:
+            if column in values:
+                values[column] = json.dumps(values[column])
+
+        columns = list(values)
+        updates = ', '.join(f'{column}=excluded.{column}' for column in columns if column != 'path')
+        with closing(connect(registry_file)) as connection, connection:
+            connection.execute(
+                f'INSERT INTO projects ({", ".join(columns)}, created_at) VALUES ({", ".join("?" for _ in columns)}, ?) '
+                f'ON CONFLICT(path) DO UPDATE SET {updates}',
+                [values[column] for column in columns] + [now],
+            )
+    except Exception as e:
+        logger.warning(f'Could not update the project registry {registry_file} - ({e})')
+
+def row_to_project(row: sqlite3.Row) -> Dict:
+    project = dict(row)
+    for column in JSON_COLUMNS:
+        if project.get(column) is not None:
+            project[column] = json.loads(project[column])
+    return project
+
+def list_projects(
+        status: Optional[str] = None,
+        csp: Optional[str] = None,
+        path_prefix: Optional[str] = None,
+        registry_file: Path = REGISTRY_FILE,
+    ) -> List[Dict]:
+    '''
+    List registered projects, most recently updated first, optionally filtered by status, csp or a path prefix
+    '''
+    conditions = []
+    parameters = []
+    if status:
+        conditions.append('status = ?')
+        parameters.append(status)
+    if csp:
+        conditions.append('csp = ?')
+        parameters.append(csp)
+    if path_prefix:
+        # Range over the primary key instead of LIKE so the index is used,
+        # '0' follows '/' so sibling directories sharing the prefix, ex: /work/ci-prod for /work/ci, are left out
+        prefix = str(Path(path_prefix).resolve()).rstrip('/')
+        conditions.append('(path = ? OR (path >= ? AND path < ?))')
+        parameters.extend([prefix, prefix + '/', prefix + '0'])
+    query = f'SELECT {", ".join(COLUMNS)} FROM projects'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY updated_at DESC'
+    with closing(connect(registry_file)) as connection:
+        return [row_to_project(row) for row in connection.execute(query, parameters)]
+
+def project_status(project_path: Path, registry_file: Path = REGISTRY_FILE) -> Dict:
+    '''
+    Registry entry of a single project
+    '''
+    path = str(Path(project_path).resolve())
+    with closing(connect(registry_file)) as connection:
+        row = connection.execute(f'SELECT {", ".join(COLUMNS)} FROM projects WHERE path = ?', [path]).fetchone()
+    if row is None:
+        raise KeyError("ERROR: project %s is not registered, projects are registered by generate, apply and destroy" % path)
+    return row_to_project(row)
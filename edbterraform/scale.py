@@ -0,0 +1,153 @@
+import copy
+import json
+import re
+from pathlib import Path
+from typing import Dict, List
+
+from edbterraform.lib import run_terraform, save_terraform_vars
+from edbterraform.targets import object_address
+from edbterraform.utils.files import dump_yaml, load_yaml_file
+from edbterraform.utils.logs import logger
+from edbterraform.CLI import TerraformCLI
+
+TERRAFORM_VARS_FILE = 'terraform.tfvars.json'
+# Infrastructure variables saved by create_project_dir before the spec compatability changes
+BACKUP_VARS_FILE = Path('edb-terraform') / 'terraform.tfvars.yml'
+
+def machine_group(machines: Dict, template: str) -> Dict[int, str]:
+    '''
+    Machines cloned from a template are named with the template name without its trailing number
+      and an incremented number within the same region, ex: pg1 -> pg2, pg3 or pg -> pg2, pg3
+
+    Returns {<number>: <machine name>} of the template and its clones, the template is number 1 when it has no number
+    '''
+    base = template.rstrip('0123456789')
+    pattern = re.compile(r'^%s(\d+)$' % re.escape(base))
+    group = {int(template[len(base):]) if template != base else 1: template}
+    for name in machines:
+        found = pattern.match(name)
+        if found and name != template and int(found.group(1)) not in group \
+            and machines[name].get('region') == machines[template].get('region'):
+            group[int(found.group(1))] = name
+    return group
+
+def clone_machine(machine: Dict, zone_name: str, zone: Dict) -> Dict:
+    # Keep the zone keys used by the template entry
+    clone = copy.deepcopy(machine)
+    if 'zone_name' in clone or 'zone' not in clone:
+        clone['zone_name'] = zone_name
+    if 'zone' in clone:
+        clone['zone'] = zone.get('zone', zone_name) if isinstance(zone, dict) else zone_name
+    return clone
+
+def scale_spec(spec: Dict, template: str, count: int) -> Dict[str, List[str]]:
+    '''
+    Add or remove clones of a machine in the spec until the template and its clones are count machines.
+    New machines spread over the zones of the region round-robin, starting after the zone of the template.
+    The template is never removed and clones with the highest numbers are removed first.
+
+    Returns {'added': [<name>, ...], 'removed': [<name>, ...]}
+    '''
+    machines = spec.get('machines') or {}
+    if template not in machines:
+        raise ValueError("ERROR: machine %s not found in the spec, expected one of: %s" % (template, ', '.join(sorted(machines)) or 'none'))
+    if count < 1:
+        raise ValueError("ERROR: count must be at least 1 to keep the machine template %s" % template)
+
+    machine = machines[template]
+    zones = (spec.get('regions') or {}).get(machine['region'], {}).get('zones') or {}
+    zone_names = list(zones)
+    if not zone_names:
+        raise ValueError("ERROR: region %s of machine %s has no zones to place new machines" % (machine['region'], template))
+    start = zone_names.index(machine['zone_name']) if machine.get('zone_name') in zone_names else 0
+
+    group = machine_group(machines, template)
+    changes = {'added': [], 'removed': []}
+    base = template.rstrip('0123456789')
+    number = max(group)
+    while len(group) < count:
+        number += 1
+        name = f'{base}{number}'
+        if name in machines:
+            continue
+        zone_name = zone_names[(start + len(group)) % len(zone_names)]
+        machines[name] = clone_machine(machine, zone_name, zones[zone_name])
+        group[number] = name
+        changes['added'].append(name)
+
+    for number in sorted(group, reverse=True):
+        if len(group) <= count:
+            break
+        if group[number] == template:
+            continue
+        name = group.pop(number)
+        del machines[name]
+        changes['removed'].append(name)
+
+    spec['machines'] = machines
+    return changes
+
+def scale_backup(backup: Dict, cloud_service_provider: str, spec: Dict, machine_template: str, changes: Dict[str, List[str]]):
+    # Mirror the changes in the infrastructure backup, which might use the older zone keys
+    csp = 'gcloud' if cloud_service_provider == 'gcp' else cloud_service_provider
+    machines = (backup.get(csp) or {}).get('machines')
+    if machines is None:
+        return
+    template = machines.get(machine_template)
+    for name in changes['added']:
+        if template is None:
+            machines[name] = spec['machines'][name]
+            continue
+        zone_name = spec['machines'][name]['zone_name']
+        zone = spec['regions'][spec['machines'][name]['region']]['zones'][zone_name]
+        machines[name] = clone_machine(template, zone_name, zone)
+        if 'zone_name' not in template and 'zone' in template:
+            machines[name].pop('zone_name', None)
+    for name in changes['removed']:
+        machines.pop(name, None)
+
+def scale_machines(
+        project_path: Path,
+        bin_path: Path,
+        machine_template: str,
+        count: int,
+        terraform_version: str = TerraformCLI.max_version.to_string(),
+        on_apply_failure: str = 'keep',
+        schedule: bool = False,
+    ) -> dict:
+    '''
+    Scale the clones of a machine within an existing project without generating it again.
+    Only terraform.tfvars.json and the infrastructure backup are rewritten
+      and only the added or removed machines are applied, shared network modules are left untouched.
+
+    Returns the added and removed machines along with the apply report
+    '''
+    project_path = Path(project_path)
+    variables_file = project_path / TERRAFORM_VARS_FILE
+    if not variables_file.exists():
+        raise FileNotFoundError("ERROR: %s is not a project generated by edb-terraform" % project_path)
+    content = variables_file.read_text()
+    variables = json.loads(content)
+    # Keep the format used when the project was generated
+    compact = not content.startswith('{\n')
+    spec = variables['spec']
+    regions = {name: machine['region'] for name, machine in (spec.get('machines') or {}).items()}
+
+    changes = scale_spec(spec, machine_template, count)
+    outputs = dict(changes, apply=None)
+    if not changes['added'] and not changes['removed']:
+        logger.info(f'Machine {machine_template} already has {count} machines')
+        return outputs
+
+    logger.info(f'Scaling machine {machine_template} to {count} machines - added: {changes["added"]} removed: {changes["removed"]}')
+    save_terraform_vars(project_path, TERRAFORM_VARS_FILE, variables, compact)
+    backup_file = project_path / BACKUP_VARS_FILE
+    if backup_file.exists():
+        backup = load_yaml_file(backup_file) or {}
+        scale_backup(backup, variables['cloud_service_provider'], spec, machine_template, changes)
+        backup_file.write_text(dump_yaml(backup))
+
+    targets = [object_address('machines', name, spec['machines'][name]['region']) for name in changes['added']]
+    targets += [object_address('machines', name, regions[name]) for name in changes['removed']]
+    outputs['apply'] = run_terraform(project_path, bin_path, terraform_version, apply=True, on_apply_failure=on_apply_failure, targets=targets, schedule=schedule)
+    return outputs
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import math
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Dict, Iterator, List, Optional
+
+from edbterraform import __dot_project__
+from edbterraform.CLI import TerraformCLI
+from edbterraform.plan_summary import iter_resource_changes, module_location, module_suffixes, plan_action, ROOT_MODULE
+from edbterraform.registry import SPEC_OBJECTS
+from edbterraform.state_server import project_backend
+from edbterraform.utils.files import load_yaml_file
+from edbterraform.utils.jsonstream import iter_values
+from edbterraform.utils.logs import logger
+
+SCHEDULER_FILE = Path(__dot_project__) / 'scheduler.db'
+# Optional overrides of SCHEDULER_LIMITS keyed by csp or csp/region, ex: {'aws/us-east-1': {'rate': 2}}
+SCHEDULER_LIMITS_FILE = Path(__dot_project__) / 'scheduler.yml'
+# Seconds to wait on another process using the scheduler database
+SCHEDULER_DATABASE_TIMEOUT = 30
+# Seconds a command waits for its slot before failing
+SCHEDULER_TIMEOUT = 6 * 60 * 60
+# Seconds between attempts to get a slot
+SCHEDULER_POLL = 2
+# Leases and waiters of processes on other hosts which never released them are dropped after this many seconds
+SCHEDULER_EXPIRY = 24 * 60 * 60
+# Terraform default -parallelism, a single command never gets more
+TERRAFORM_PARALLELISM = 10
+# Limits per (csp, account, region), shared by every edb-terraform process of the host:
+# capacity - tokens of a full bucket, a command takes one token per planned resource change
+# rate - tokens added back per second
+# slots - applies and destroys running at the same time
+# parallelism - terraform operations shared by the running applies and destroys
+SCHEDULER_LIMITS = {
+    'aws': {'capacity': 100, 'rate': 1.0, 'slots': 8, 'parallelism': 40},
+    'gcloud': {'capacity': 100, 'rate': 1.0, 'slots': 8, 'parallelism': 40},
+    'azure': {'capacity': 60, 'rate': 0.5, 'slots': 6, 'parallelism': 24},
+}
+# Environment variables which select the account used by the providers, see docs/CREDENTIALS.md
+ACCOUNT_VARIABLES = {
+    'aws': ['AWS_PROFILE', 'AWS_ACCESS_KEY_ID'],
+    'gcloud': ['GOOGLE_PROJECT', 'CLOUDSDK_CORE_PROJECT'],
+    'azure': ['ARM_SUBSCRIPTION_ID', 'AZURE_SUBSCRIPTION_ID'],
+}
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id TEXT,
+    key TEXT,
+    host TEXT,
+    pid INTEGER,
+    project TEXT,
+    command TEXT,
+    weight INTEGER,
+    parallelism INTEGER,
+    acquired_at REAL,
+    PRIMARY KEY (id, key)
+);
+CREATE TABLE IF NOT EXISTS waiters (
+    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+    weights TEXT,
+    host TEXT,
+    pid INTEGER,
+    project TEXT,
+    command TEXT,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS leases_key ON leases (key);
+'''
+
+def connect(scheduler_file: Path = SCHEDULER_FILE) -> sqlite3.Connection:
+    # Transactions are started with BEGIN IMMEDIATE so only one process decides at a time
+    scheduler_file = Path(scheduler_file)
+    scheduler_file.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(scheduler_file), timeout=SCHEDULER_DATABASE_TIMEOUT, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+@contextmanager
+def transaction(connection: sqlite3.Connection):
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+def account_id(csp: str) -> str:
+    # Accounts are hashed so credentials such as access key ids are never saved
+    account = next((os.environ[name] for name in ACCOUNT_VARIABLES.get(csp, []) if os.environ.get(name)), 'default')
+    return hashlib.sha256(account.encode('utf-8')).hexdigest()[:16]
+
+def bucket_key(csp: str, account: str, region: str) -> str:
+    return f'{csp}/{account}/{region}'
+
+def bucket_limits(key: str, limits_file: Path = SCHEDULER_LIMITS_FILE) -> Dict:
+    '''
+    Limits of a bucket, SCHEDULER_LIMITS of its csp updated by the csp and csp/region entries of the limits file
+    '''
+    csp, _, region = key.split('/')
+    limits = dict(SCHEDULER_LIMITS.get(csp, SCHEDULER_LIMITS['aws']))
+    overrides = load_yaml_file(limits_file) if Path(limits_file).exists() else {}
+    for name in [csp, f'{csp}/{region}']:
+        limits.update((overrides or {}).get(name) or {})
+    return limits
+
+def project_variables(project_path: Path) -> Dict:
+    variables_file = Path(project_path) / 'terraform.tfvars.json'
+    if not variables_file.exists():
+        raise FileNotFoundError("ERROR: %s is not a project generated by edb-terraform" % project_path)
+    return json.loads(variables_file.read_bytes())
+
+def project_csp(variables: Dict) -> str:
+    csp = variables.get('cloud_service_provider')
+    return 'gcloud' if csp == 'gcp' else csp
+
+def plan_weights(project_path: Path, terraform: TerraformCLI, regions: List[str]) -> Dict[str, int]:
+    '''
+    Planned resource changes of the saved plan per region, replacements count twice.
+    Resources of the root module, such as keys and local files, do not call a cloud provider and are skipped.
+    '''
+    suffixes = module_suffixes(regions)
+    weights = {}
+    with TemporaryFile() as stderr:
+        process = terraform.show_command(project_path, stderr=stderr)
+        try:
+            for change in iter_resource_changes(process.stdout):
+                action = plan_action(change.get('change', {}).get('actions', []))
+                module, region = module_location(change.get('module_address'), suffixes)
+                if action is None or module == ROOT_MODULE:
+                    continue
+                weights[region] = weights.get(region, 0) + (2 if action == 'replace' else 1)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            stderr.seek(0)
+            errors = stderr.read().decode('utf-8', errors='replace')
+    if returncode != 0:
+        raise Exception("ERROR: terraform show failed for %s - (%s)" % (terraform.plan_file, errors.strip()))
+    return weights
+
+def state_weights(project_path: Path, variables: Dict, regions: List[str]) -> Dict[str, int]:
+    '''
+    Managed resource instances of the local state per region.
+    With a backend, such as the state server, the spec objects of each region are counted instead.
+    '''
+    state_file = Path(project_path) / 'terraform.tfstate'
+    weights = {}
+    if project_backend(project_path) or not state_file.exists():
+        spec = variables.get('spec', {})
+        for name in SPEC_OBJECTS:
+            for item in (spec.get(name) or {}).values():
+                region = item.get('region') if isinstance(item, dict) else None
+                if region:
+                    weights[region] = weights.get(region, 0) + 1
+        return weights
+    if state_file.stat().st_size == 0:
+        return weights
+    suffixes = module_suffixes(regions)
+    with state_file.open('rb') as stream:
+        for _, resource in iter_values(stream, depth=2, match=lambda path: path[0] == 'resources'):
+            module, region = module_location(resource.get('module'), suffixes)
+            if resource.get('mode') == 'data' or module == ROOT_MODULE:
+                continue
+            weights[region] = weights.get(region, 0) + len(resource.get('instances', []))
+    return weights
+
+def process_alive(host: str, pid: int) -> bool:
+    # Processes of other hosts sharing the same directory are only dropped after SCHEDULER_EXPIRY
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def remove_stale(connection: sqlite3.Connection, now: float):
+    # Leases and waiters of processes which stopped without releasing them
+    for table, column in [('leases', 'acquired_at'), ('waiters', 'created_at')]:
+        for row in connection.execute(f'SELECT DISTINCT host, pid FROM {table}').fetchall():
+            if not process_alive(row['host'], row['pid']):
+                logger.warning(f'Removing scheduler {table} of stopped process {row["pid"]}')
+                connection.execute(f'DELETE FROM {table} WHERE host = ? AND pid = ?', [row['host'], row['pid']])
+        connection.execute(f'DELETE FROM {table} WHERE {column} < ?', [now - SCHEDULER_EXPIRY])
+
+def bucket_tokens(connection: sqlite3.Connection, key: str, limits: Dict, now: float) -> float:
+    row = connection.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', [key]).fetchone()
+    if row is None:
+        return float(limits['capacity'])
+    return min(float(limits['capacity']), row['tokens'] + max(0.0, now - row['updated_at']) * limits['rate'])
+
+def try_acquire(connection: sqlite3.Connection, ticket: int, weights: Dict[str, int], lease: Dict) -> Optional[int]:
+    '''
+    Grant the waiter ticket when it is the oldest waiter of each of its buckets,
+      every bucket has a free slot, free parallelism and enough tokens for its weight.
+    Weights above the capacity of a bucket take a full bucket so large plans still run.
+    The parallelism of a bucket is shared by weight between the running and waiting commands.
+
+    Returns the terraform parallelism of the lease or None when it has to wait
+    '''
+    with transaction(connection):
+        now = time.time()
+        remove_stale(connection, now)
+        demands = dict(weights)
+        for row in connection.execute('SELECT ticket, weights FROM waiters WHERE ticket != ?', [ticket]).fetchall():
+            waiting = json.loads(row['weights'])
+            if row['ticket'] < ticket and set(waiting) & set(weights):
+                return None
+            for key in set(waiting) & set(weights):
+                demands[key] += waiting[key]
+
+        parallelism = TERRAFORM_PARALLELISM
+        buckets = {}
+        for key, weight in weights.items():
+            limits = bucket_limits(key)
+            used = connection.execute('SELECT COUNT(*), COALESCE(SUM(parallelism), 0), COALESCE(SUM(weight), 0) FROM leases WHERE key = ?', [key]).fetchone()
+            tokens = bucket_tokens(connection, key, limits, now)
+            cost = min(weight, limits['capacity'])
+            if used[0] >= limits['slots'] or used[1] >= limits['parallelism'] or tokens < cost:
+                return None
+            share = math.ceil(limits['parallelism'] * weight / (demands[key] + used[2]))
+            parallelism = min(parallelism, limits['parallelism'] - used[1], max(share, 1))
+            buckets[key] = tokens - cost
+
+        for key, weight in weights.items():
+            connection.execute(
+                'INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens=excluded.tokens, updated_at=excluded.updated_at',
+                [key, buckets[key], now],
+            )
+            connection.execute(
+                'INSERT INTO leases (id, key, host, pid, project, command, weight, parallelism, acquired_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [lease['id'], key, lease['host'], lease['pid'], lease['project'], lease['command'], weight, parallelism, now],
+            )
+        connection.execute('DELETE FROM waiters WHERE ticket = ?', [ticket])
+        return parallelism
+
+@contextmanager
+def scheduled_slot(
+        project_path: Path,
+        command: str,
+        weights: Dict[str, int],
+        csp: str,
+        timeout: int = SCHEDULER_TIMEOUT,
+        scheduler_file: Path = SCHEDULER_FILE,
+    ) -> Iterator[int]:
+    '''
+    Wait for a slot of every (csp, account, region) bucket with planned changes and hold it until the command finishes.
+    Waiters are served in order of arrival per bucket, so large plans are not starved by smaller ones.
+
+    Yields the terraform parallelism of the command
+    '''
+    account = account_id(csp)
+    weights = {bucket_key(csp, account, region): weight for region, weight in weights.items()}
+    lease = {
+        'id': uuid.uuid4().hex,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'project': str(Path(project_path).resolve()),
+        'command': command,
+    }
+    with closing(connect(scheduler_file)) as connection:
+        ticket = connection.execute(
+            'INSERT INTO waiters (weights, host, pid, project, command, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [json.dumps(weights, sort_keys=True), lease['host'], lease['pid'], lease['project'], command, time.time()],
+        ).lastrowid
+        start = time.monotonic()
+        try:
+            parallelism = try_acquire(connection, ticket, weights, lease)
+            if parallelism is None:
+                logger.info(f'Waiting for a scheduler slot to {command} {project_path} with weights {weights}')
+            while parallelism is None:
+                if time.monotonic() - start > timeout:
+                    raise TimeoutError("ERROR: no scheduler slot for %s of %s after %s seconds, check `edb-terraform scheduler`" % (command, project_path, timeout))
+                time.sleep(SCHEDULER_POLL)
+                parallelism = try_acquire(connection, ticket, weights, lease)
+        except BaseException:
+            connection.execute('DELETE FROM waiters WHERE ticket = ?', [ticket])
+            raise
+        logger.info(f'Scheduler slot for {command} of {project_path} after {round(time.monotonic() - start, 1)} seconds with parallelism {parallelism}')
+        try:
+            yield parallelism
+        finally:
+            connection.execute('DELETE FROM leases WHERE id = ?', [lease['id']])
+
+@contextmanager
+def project_slot(project_path: Path, command: str, terraform: TerraformCLI) -> Iterator[int]:
+    '''
+    Slot of an apply, weighted by the saved plan, or of a destroy, weighted by the state
+
+    Yields the terraform parallelism of the command
+    '''
+    variables = project_variables(project_path)
+    regions = list((variables.get('spec', {}).get('regions') or {}).keys())
+    if command == 'apply':
+        weights = plan_weights(project_path, terraform, regions)
+    else:
+        weights = state_weights(project_path, variables, regions)
+    if not weights:
+        # Nothing to change within the cloud provider, only a refresh
+        yield None
+        return
+    with scheduled_slot(project_path, command, weights, project_csp(variables)) as parallelism:
+        yield parallelism
+
+def scheduler_status(scheduler_file: Path = SCHEDULER_FILE) -> Dict:
+    '''
+    Buckets with their current tokens and limits, the held leases and the waiting commands
+    '''
+    with closing(connect(scheduler_file)) as connection:
+        now = time.time()
+        keys = [row['key'] for row in connection.execute('SELECT key FROM buckets UNION SELECT key FROM leases ORDER BY key')]
+        leases = [dict(row) for row in connection.execute('SELECT * FROM leases ORDER BY acquired_at')]
+        waiters = [dict(row, weights=json.loads(row['weights'])) for row in connection.execute('SELECT * FROM waiters ORDER BY ticket')]
+        buckets = {}
+        for key in keys:
+            limits = bucket_limits(key)
+            held = [lease for lease in leases if lease['key'] == key]
+            buckets[key] = dict(
+                limits,
+                tokens=math.floor(bucket_tokens(connection, key, limits, now)),
+                leases=len(held),
+                parallelism_used=sum(lease['parallelism'] for lease in held),
+            )
+    return {'buckets': buckets, 'leases': leases, 'waiters': waiters}
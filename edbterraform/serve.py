@@ -0,0 +1,374 @@
+import contextvars
+import hmac
+import inspect
+import json
+import logging
+import os
+import re
+import socketserver
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from edbterraform import __dot_project__, api
+from edbterraform.errors import EdbTerraformError
+from edbterraform.utils.files import load_token, write_json_file
+from edbterraform.utils.logs import logger
+
+SERVE_DIRECTORY = Path(__dot_project__) / 'serve'
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 47071
+# Default unix socket of the job API, only the owner of the server can connect to it
+SERVE_SOCKET = 'serve.sock'
+# Token required by the localhost port, which any local user can connect to
+SERVE_TOKEN = 'token'
+SERVE_MAX_WORKERS = 4
+# Finished jobs kept in memory, older jobs are still read from their job file
+MAX_FINISHED_JOBS = 1000
+# Seconds between reads of a followed job log
+FOLLOW_INTERVAL = 0.5
+JOB_STATUSES = ['queued', 'running', 'succeeded', 'failed', 'cancelled']
+FINISHED_STATUSES = ['succeeded', 'failed', 'cancelled']
+JOB_PATH = re.compile(r'^/jobs/([0-9a-f]{32})(/log)?$')
+# Job whose log receives the records of the current thread
+JOB_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('job_id', default=None)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def generate_job(work_path=None, project_name=None, **arguments):
+    # Same project location as `generate --work-path --project-name`
+    if 'project_path' not in arguments and project_name:
+        arguments['project_path'] = Path(work_path or os.getcwd()) / project_name
+    return api.generate(**arguments)
+
+JOB_COMMANDS: Dict[str, Callable] = {
+    'generate': generate_job,
+    'apply': api.apply,
+    'destroy': api.destroy,
+    'outputs': api.outputs,
+}
+
+def job_arguments(command: str, arguments: Dict, bin_path: Path) -> Dict:
+    '''
+    Validate the arguments of a job against its api function.
+    The bin path of the server is used when a job does not set one.
+    '''
+    if command not in JOB_COMMANDS:
+        raise ValueError("ERROR: unknown job command %s, expected one of: %s" % (command, ', '.join(JOB_COMMANDS)))
+    if not isinstance(arguments, dict):
+        raise ValueError("ERROR: job arguments must be an object")
+    function = JOB_COMMANDS[command]
+    parameters = inspect.signature(function).parameters
+    if command == 'generate':
+        parameters = dict(inspect.signature(api.generate).parameters, **parameters)
+    unknown = [name for name in arguments if name not in parameters or parameters[name].kind == inspect.Parameter.VAR_KEYWORD]
+    if unknown:
+        raise ValueError("ERROR: unknown arguments for %s: %s" % (command, ', '.join(sorted(unknown))))
+
+    arguments = dict(arguments)
+    arguments.setdefault('bin_path', bin_path)
+    missing = [
+        name for name, parameter in parameters.items()
+        if parameter.default is inspect.Parameter.empty
+            and parameter.kind not in (inspect.Parameter.VAR_KEYWORD, inspect.Parameter.VAR_POSITIONAL)
+            and name not in arguments
+    ]
+    if command == 'generate' and 'project_name' in arguments:
+        missing = [name for name in missing if name != 'project_path']
+    if missing:
+        raise ValueError("ERROR: missing arguments for %s: %s" % (command, ', '.join(missing)))
+    return arguments
+
+class JobLogHandler(logging.FileHandler):
+    '''
+    Write the log records of a job into its log file, from the thread running it
+      and from the threads it starts through ContextThreadPoolExecutor
+    '''
+    def __init__(self, log_file: Path, job_id: str):
+        super().__init__(str(log_file), mode='a', encoding='utf-8')
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.addFilter(lambda record: JOB_ID.get() == job_id)
+
+class JobQueue:
+    '''
+    Jobs run on a bounded pool of worker threads within the server process,
+      so imports, compiled templates and terraform version checks are reused between jobs.
+    Each job is saved as directory/jobs/<id>.json with its log next to it as <id>.log
+    '''
+    def __init__(self, directory: Path = SERVE_DIRECTORY, max_workers: int = SERVE_MAX_WORKERS, bin_path: Path = Path(__dot_project__)):
+        self.directory = Path(directory) / 'jobs'
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.bin_path = bin_path
+        self.max_workers = max(1, max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self.jobs: Dict[str, Dict] = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def job_file(self, job_id: str) -> Path:
+        return self.directory / f'{job_id}.json'
+
+    def log_file(self, job_id: str) -> Path:
+        return self.directory / f'{job_id}.log'
+
+    def save(self, job: Dict):
+        write_json_file(self.job_file(job['id']), job)
+
+    def submit(self, command: str, arguments: Dict) -> Dict:
+        arguments = job_arguments(command, arguments, self.bin_path)
+        job = {
+            'id': uuid.uuid4().hex,
+            'command': command,
+            'arguments': json.loads(json.dumps(arguments, default=str)),
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        self.log_file(job['id']).touch()
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.save(job)
+            self.futures[job['id']] = self.executor.submit(self.run, job['id'], arguments)
+        logger.info(f'Queued {command} job {job["id"]}')
+        return dict(job)
+
+    def update(self, job_id: str, **values) -> Dict:
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(values)
+            self.save(job)
+            if job['status'] in FINISHED_STATUSES:
+                self.futures.pop(job_id, None)
+                self.forget_finished()
+            return dict(job)
+
+    def forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def run(self, job_id: str, arguments: Dict):
+        job = self.update(job_id, status='running', started_at=time.time())
+        handler = JobLogHandler(self.log_file(job_id), job_id)
+        logger.addHandler(handler)
+        # Worker threads are reused between jobs, the job id is reset once the job finishes
+        token = JOB_ID.set(job_id)
+        try:
+            logger.info(f'Running {job["command"]} job {job_id}')
+            result = JOB_COMMANDS[job['command']](**arguments)
+            self.update(job_id, status='succeeded', result=json.loads(json.dumps(result, default=str)), finished_at=time.time())
+        except EdbTerraformError as e:
+            self.update(job_id, status='failed', error=str(e), error_details=e.to_dict(), finished_at=time.time())
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            self.update(job_id, status='failed', error=str(e), finished_at=time.time())
+        finally:
+            job = self.get(job_id)
+            logger.info(f'Finished {job["command"]} job {job_id}: {job["status"]}')
+            logger.removeHandler(handler)
+            handler.close()
+            JOB_ID.reset(token)
+
+    def cancel(self, job_id: str) -> Dict:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            # A job which already started cannot be cancelled by its future
+            if job is None or job['status'] != 'queued' or not self.futures[job_id].cancel():
+                raise ValueError("ERROR: only queued jobs can be cancelled, job %s is %s" % (job_id, job['status'] if job else 'unknown'))
+        return self.update(job_id, status='cancelled', finished_at=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            if job_id in self.jobs:
+                return dict(self.jobs[job_id])
+        job_file = self.job_file(job_id)
+        return json.loads(job_file.read_text()) if job_file.exists() else None
+
+    def list(self, status: Optional[str] = None) -> List[Dict]:
+        with self.lock:
+            return [dict(job) for job in self.jobs.values() if not status or job['status'] == status]
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            counts = {status: 0 for status in JOB_STATUSES}
+            for job in self.jobs.values():
+                counts[job['status']] += 1
+            return counts
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Job API:
+    - POST /jobs with {"command": "generate|apply|destroy|outputs", "arguments": {...}} queues a job,
+        arguments are the ones of the matching edbterraform.api function, generate specs can be sent as objects
+    - GET /jobs lists the jobs kept in memory, ?status=<status> filters them
+    - GET /jobs/<id> returns a job with its status and result
+    - GET /jobs/<id>/log returns the job log from ?offset=<bytes>, ?follow=true streams it until the job finishes
+    - DELETE /jobs/<id> cancels a queued job
+    - GET /health returns the number of workers and jobs per status
+    '''
+    queue: JobQueue = None
+    # Bearer token of the Authorization header, required when set
+    token: Optional[str] = None
+    protocol_version = 'HTTP/1.1'
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+        if self.token:
+            scheme, _, token = (self.headers.get('Authorization') or '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode('utf-8'), self.token.encode('utf-8')):
+                # The request body is left unread so the connection cannot be reused
+                self.close_connection = True
+                self.respond(HTTPStatus.UNAUTHORIZED, {'error': 'missing or invalid token'})
+                return False
+        return True
+
+    def log_message(self, format, *args):
+        logger.debug('Serve: ' + format % args)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def respond(self, status: HTTPStatus, value=None):
+        body = json.dumps(value, separators=(',', ':')).encode('utf-8') if value is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def query(self) -> Dict:
+        return {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+    def job_id(self) -> Optional[str]:
+        found = JOB_PATH.match(urlparse(self.path).path)
+        if not found:
+            self.respond(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+            return None
+        return found.group(1)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            return self.respond(HTTPStatus.OK, {'workers': self.queue.max_workers, 'jobs': self.queue.counts()})
+        if path == '/jobs':
+            return self.respond(HTTPStatus.OK, self.queue.list(self.query().get('status')))
+        job_id = self.job_id()
+        if job_id is None:
+            return
+        job = self.queue.get(job_id)
+        if job is None:
+            return self.respond(HTTPStatus.NOT_FOUND, {'error': f'job {job_id} not found'})
+        if path.endswith('/log'):
+            return self.stream_log(job_id)
+        self.respond(HTTPStatus.OK, job)
+
+    def stream_log(self, job_id: str):
+        query = self.query()
+        offset = int(query['offset']) if query.get('offset', '').isdigit() else 0
+        follow = query.get('follow', '').lower() in ['1', 'true', 'yes']
+        log_file = self.queue.log_file(job_id)
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        with log_file.open('rb') as log:
+            log.seek(offset)
+            while True:
+                finished = self.queue.get(job_id)['status'] in FINISHED_STATUSES
+                # Read everything written before the job was seen as finished
+                for chunk in iter(lambda: log.read(64 * 1024), b''):
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                if finished or not follow:
+                    break
+                self.wfile.flush()
+                time.sleep(FOLLOW_INTERVAL)
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/jobs':
+            return self.respond(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            job = self.queue.submit(request.get('command'), request.get('arguments') or {})
+        except (ValueError, AttributeError) as e:
+            return self.respond(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+        self.respond(HTTPStatus.ACCEPTED, job)
+
+    def do_DELETE(self):
+        job_id = self.job_id()
+        if job_id is None:
+            return
+        try:
+            self.respond(HTTPStatus.OK, self.queue.cancel(job_id))
+        except ValueError as e:
+            self.respond(HTTPStatus.CONFLICT, {'error': str(e)})
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_token(directory: Path = SERVE_DIRECTORY) -> str:
+    '''
+    Token of the localhost port saved as directory/token, readable by its owner only, created when missing
+    '''
+    return load_token(Path(directory) / SERVE_TOKEN)
+
+def serve_jobs(
+        directory: Path = SERVE_DIRECTORY,
+        host: str = SERVE_HOST,
+        port: Optional[int] = None,
+        socket_path: Optional[Path] = None,
+        max_workers: int = SERVE_MAX_WORKERS,
+        bin_path: Path = Path(__dot_project__),
+    ):
+    '''
+    Serve the job API until interrupted, on a unix socket which defaults to directory/serve.sock,
+      or on a localhost port when port is set where requests need the token of directory/token
+    '''
+    directory = Path(directory)
+    if port:
+        server_token = serve_token(directory)
+        server = ThreadingHTTPServer((host, port), None)
+        server.daemon_threads = True
+        address = f'http://{host}:{port}'
+    else:
+        server_token = None
+        socket_path = Path(socket_path) if socket_path else directory / SERVE_SOCKET
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        socket_path.unlink(missing_ok=True)
+        # Bound before any worker thread exists so the umask change only applies to the socket
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixHTTPServer(str(socket_path), None)
+        finally:
+            os.umask(umask)
+        address = f'unix://{socket_path}'
+    queue = JobQueue(directory, max_workers, bin_path)
+    server.RequestHandlerClass = type('Handler', (JobRequestHandler,), {'queue': queue, 'token': server_token})
+    logger.info(f'Serving jobs on {address} with {queue.max_workers} workers, jobs saved under {queue.directory}')
+    if server_token:
+        logger.info(f'Requests need the header "Authorization: Bearer <token>" with the token of {directory / SERVE_TOKEN}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.shutdown()
+        if not port:
+            socket_path.unlink(missing_ok=True)
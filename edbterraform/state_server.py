@@ -0,0 +1,406 @@
+import base64
+import fcntl
+import hashlib
+import hmac
+import json
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+from contextlib import closing
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+from urllib import request as Request
+from urllib.error import URLError
+from urllib.parse import parse_qs, urlparse
+
+from edbterraform import __dot_project__
+from edbterraform.utils.files import load_token
+from edbterraform.utils.logs import logger
+
+STATE_SERVER_DIRECTORY = Path(__dot_project__) / 'state-server'
+STATE_SERVER_HOST = '127.0.0.1'
+STATE_SERVER_PORT = 47070
+# Remote state type which uses the embedded state server
+REMOTE_STATE_TYPE = 'local-http'
+# Older versions of each state kept after an update
+STATE_VERSIONS = 20
+COMPRESSION_LEVEL = 6
+# Seconds to wait for a started state server to answer
+START_TIMEOUT = 10
+# Seconds to wait on another request writing to the database
+DATABASE_TIMEOUT = 30
+HEALTH_SERVICE = 'edb-terraform-state'
+# Token of the state server under its directory, sent by terraform as the password of the http backend
+STATE_SERVER_TOKEN = 'token'
+STATE_SERVER_USERNAME = 'edb-terraform'
+STATE_PATH = re.compile(r'^/state/([A-Za-z0-9_.-]+)$')
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS states (
+    project TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    md5 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (project, version)
+);
+CREATE TABLE IF NOT EXISTS locks (
+    project TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    info TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+'''
+
+class StateLocked(Exception):
+    '''
+    State is locked by another lock, holds the lock info of the current lock
+    '''
+    def __init__(self, info: str):
+        super().__init__("ERROR: state is locked - %s" % info)
+        self.info = info
+
+def lock_info_id(info: str) -> Optional[str]:
+    # ID of terraform's lock info, raises ValueError when the lock info is not a json object
+    try:
+        lock_info = json.loads(info)
+    except ValueError as e:
+        raise ValueError("ERROR: lock info is not valid json - (%s)" % e) from e
+    if not isinstance(lock_info, dict):
+        raise ValueError("ERROR: lock info must be a json object")
+    return lock_info.get('ID')
+
+class StateStore:
+    '''
+    States of terraform's http backend within a SQLite database, compressed with zlib.
+    Each update is saved as a new version and only the latest STATE_VERSIONS versions are kept.
+    '''
+    def __init__(self, database: Path, versions: int = STATE_VERSIONS):
+        self.database = Path(database)
+        self.versions = versions
+        self.database.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self.connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        # A connection per request since requests are handled by separate threads
+        connection = sqlite3.connect(str(self.database), timeout=DATABASE_TIMEOUT, isolation_level=None)
+        return connection
+
+    def get(self, project: str, version: Optional[int] = None) -> Optional[bytes]:
+        query = 'SELECT data FROM states WHERE project = ?'
+        parameters = [project]
+        if version is not None:
+            query += ' AND version = ?'
+            parameters.append(version)
+        query += ' ORDER BY version DESC LIMIT 1'
+        with closing(self.connect()) as connection:
+            row = connection.execute(query, parameters).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def put(self, project: str, data: bytes, lock_id: Optional[str] = None) -> int:
+        '''
+        Save a new version of a state, which must use the current lock when the state is locked
+
+        Returns the saved version
+        '''
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                lock = connection.execute('SELECT id, info FROM locks WHERE project = ?', [project]).fetchone()
+                if lock and lock[0] != lock_id:
+                    raise StateLocked(lock[1])
+                latest = connection.execute('SELECT MAX(version) FROM states WHERE project = ?', [project]).fetchone()[0] or 0
+                connection.execute(
+                    'INSERT INTO states (project, version, data, md5, size, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    [project, latest + 1, zlib.compress(data, COMPRESSION_LEVEL), hashlib.md5(data).hexdigest(), len(data), time.time()],
+                )
+                connection.execute('DELETE FROM states WHERE project = ? AND version <= ?', [project, latest + 1 - self.versions])
+                connection.execute('COMMIT')
+                return latest + 1
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+    def delete(self, project: str):
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM states WHERE project = ?', [project])
+            connection.execute('DELETE FROM locks WHERE project = ?', [project])
+            connection.execute('COMMIT')
+
+    def lock(self, project: str, info: str):
+        # Raises StateLocked with the current lock when the state is already locked and ValueError on invalid lock info
+        lock_id = lock_info_id(info)
+        if not lock_id:
+            raise ValueError("ERROR: lock info needs an ID")
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            current = connection.execute('SELECT info FROM locks WHERE project = ?', [project]).fetchone()
+            if current:
+                connection.execute('ROLLBACK')
+                raise StateLocked(current[0])
+            connection.execute('INSERT INTO locks (project, id, info, created_at) VALUES (?, ?, ?, ?)', [project, lock_id, info, time.time()])
+            connection.execute('COMMIT')
+
+    def unlock(self, project: str, info: str):
+        # Raises StateLocked when the state is locked by another lock, `terraform force-unlock` sends the current lock id
+        lock_id = lock_info_id(info) if info else None
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            current = connection.execute('SELECT id, info FROM locks WHERE project = ?', [project]).fetchone()
+            if current and lock_id and current[0] != lock_id:
+                connection.execute('ROLLBACK')
+                raise StateLocked(current[1])
+            connection.execute('DELETE FROM locks WHERE project = ?', [project])
+            connection.execute('COMMIT')
+
+    def versions_of(self, project: str):
+        with closing(self.connect()) as connection:
+            rows = connection.execute('SELECT version, md5, size, created_at FROM states WHERE project = ? ORDER BY version', [project]).fetchall()
+        return [{'version': row[0], 'md5': row[1], 'size': row[2], 'created_at': row[3]} for row in rows]
+
+class StateRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Terraform http backend protocol:
+    - GET /state/<project> returns the state or 404, ?version=N returns an older version
+    - POST /state/<project>?ID=<lock id> saves a new version of the state
+    - DELETE /state/<project> removes the state and its versions
+    - LOCK and UNLOCK /state/<project> with the lock info as the body, 423 with the current lock when locked
+    - GET /state/<project>/versions lists the kept versions
+    Every request but GET /health needs the token through basic authentication, the password of the http backend,
+      or as a bearer token.
+    '''
+    store: StateStore = None
+    # Token required when set
+    token: Optional[str] = None
+    protocol_version = 'HTTP/1.1'
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+        if self.token and urlparse(self.path).path != '/health' and not self.authorized():
+            # The request body is left unread so the connection cannot be reused
+            self.close_connection = True
+            self.respond(HTTPStatus.UNAUTHORIZED, b'{"error":"missing or invalid token"}')
+            return False
+        return True
+
+    def authorized(self) -> bool:
+        scheme, _, credentials = (self.headers.get('Authorization') or '').partition(' ')
+        if scheme.lower() == 'basic':
+            try:
+                credentials = base64.b64decode(credentials.strip(), validate=True).decode('utf-8').partition(':')[2]
+            except ValueError:
+                return False
+        elif scheme.lower() != 'bearer':
+            return False
+        return hmac.compare_digest(credentials.strip().encode('utf-8'), self.token.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        logger.debug('State server: ' + format % args)
+
+    def respond(self, status: HTTPStatus, body: bytes = b'', content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def project(self) -> Optional[str]:
+        found = STATE_PATH.match(urlparse(self.path).path)
+        if not found:
+            self.respond(HTTPStatus.NOT_FOUND)
+            return None
+        return found.group(1)
+
+    def query(self) -> Dict:
+        return {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            return self.respond(HTTPStatus.OK, json.dumps({'service': HEALTH_SERVICE}).encode('utf-8'))
+        if path.startswith('/state/') and path.endswith('/versions'):
+            return self.respond(HTTPStatus.OK, json.dumps(self.store.versions_of(path[len('/state/'):-len('/versions')])).encode('utf-8'))
+        project = self.project()
+        if project is None:
+            return
+        version = self.query().get('version')
+        data = self.store.get(project, int(version) if version and version.isdigit() else None)
+        if data is None:
+            return self.respond(HTTPStatus.NOT_FOUND)
+        self.respond(HTTPStatus.OK, data)
+
+    def do_POST(self):
+        project = self.project()
+        if project is None:
+            return
+        data = self.read_body()
+        md5 = self.headers.get('Content-MD5')
+        if md5 and base64.b64decode(md5) != hashlib.md5(data).digest():
+            return self.respond(HTTPStatus.BAD_REQUEST, b'{"error":"Content-MD5 does not match"}')
+        try:
+            self.store.put(project, data, self.query().get('ID'))
+        except StateLocked as e:
+            return self.respond(HTTPStatus.LOCKED, e.info.encode('utf-8'))
+        self.respond(HTTPStatus.OK)
+
+    def do_DELETE(self):
+        project = self.project()
+        if project is None:
+            return
+        self.store.delete(project)
+        self.respond(HTTPStatus.OK)
+
+    def do_LOCK(self):
+        project = self.project()
+        if project is None:
+            return
+        try:
+            self.store.lock(project, self.read_body().decode('utf-8'))
+        except StateLocked as e:
+            return self.respond(HTTPStatus.LOCKED, e.info.encode('utf-8'))
+        except ValueError as e:
+            return self.respond(HTTPStatus.BAD_REQUEST, json.dumps({'error': str(e)}).encode('utf-8'))
+        self.respond(HTTPStatus.OK)
+
+    def do_UNLOCK(self):
+        project = self.project()
+        if project is None:
+            return
+        try:
+            self.store.unlock(project, self.read_body().decode('utf-8'))
+        except StateLocked as e:
+            return self.respond(HTTPStatus.LOCKED, e.info.encode('utf-8'))
+        except ValueError as e:
+            return self.respond(HTTPStatus.BAD_REQUEST, json.dumps({'error': str(e)}).encode('utf-8'))
+        self.respond(HTTPStatus.OK)
+
+def serve_states(directory: Path = STATE_SERVER_DIRECTORY, host: str = STATE_SERVER_HOST, port: int = STATE_SERVER_PORT):
+    '''
+    Serve the states saved under directory/states.db until interrupted,
+      requests need the token of directory/token
+    '''
+    handler = type('Handler', (StateRequestHandler,), {
+        'store': StateStore(Path(directory) / 'states.db'),
+        'token': state_server_token(directory),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logger.info(f'Serving terraform states from {directory} on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def state_server_token(directory: Path = STATE_SERVER_DIRECTORY) -> str:
+    return load_token(Path(directory) / STATE_SERVER_TOKEN)
+
+def state_server_url(port: int = STATE_SERVER_PORT) -> str:
+    return f'http://{STATE_SERVER_HOST}:{port}'
+
+def state_server_is_running(port: int = STATE_SERVER_PORT) -> bool:
+    # Proxies from the environment are skipped since the server only listens on localhost
+    opener = Request.build_opener(Request.ProxyHandler({}))
+    try:
+        with opener.open(f'{state_server_url(port)}/health', timeout=2) as response:
+            return json.loads(response.read()).get('service') == HEALTH_SERVICE
+    except (URLError, OSError, ValueError):
+        return False
+
+def ensure_state_server(port: int = STATE_SERVER_PORT, directory: Path = STATE_SERVER_DIRECTORY) -> str:
+    '''
+    Reuse a running state server or start one in the background with `edb-terraform state-server`.
+    Concurrent callers wait on a file lock so a single server is started.
+
+    Returns the url of the state server
+    '''
+    if state_server_is_running(port):
+        return state_server_url(port)
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'start.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not state_server_is_running(port):
+            log_file = directory / 'state-server.log'
+            logger.info(f'Starting the state server on {state_server_url(port)}, logs under {log_file}')
+            with open(log_file, 'a') as log:
+                subprocess.Popen(
+                    [sys.executable, '-m', 'edbterraform', 'state-server', '--state-server-port', str(port), '--state-directory', str(directory)],
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    stdin=subprocess.DEVNULL,
+                    start_new_session=True,
+                )
+            deadline = time.monotonic() + START_TIMEOUT
+            while not state_server_is_running(port):
+                if time.monotonic() > deadline:
+                    raise Exception("ERROR: state server did not start on %s, check %s" % (state_server_url(port), log_file))
+                time.sleep(0.2)
+    return state_server_url(port)
+
+def project_state_name(project_path: Path) -> str:
+    # Projects with the same name under different work paths use separate states
+    project_path = Path(project_path).resolve()
+    name = re.sub(r'[^A-Za-z0-9_.-]', '-', project_path.name)
+    return f'{name}-{hashlib.sha256(str(project_path).encode("utf-8")).hexdigest()[:12]}'
+
+def backend_configuration(project_path: Path, port: int = STATE_SERVER_PORT, directory: Path = STATE_SERVER_DIRECTORY) -> Dict:
+    # Configuration of terraform's http backend for a project, authenticated with the token of the state server
+    address = f'{state_server_url(port)}/state/{project_state_name(project_path)}'
+    return {
+        'username': STATE_SERVER_USERNAME,
+        'password': state_server_token(directory),
+        'address': address,
+        'lock_address': address,
+        'unlock_address': address,
+        'lock_method': 'LOCK',
+        'unlock_method': 'UNLOCK',
+        'update_method': 'POST',
+    }
+
+def project_state_server_port(project_path: Path) -> Optional[int]:
+    '''
+    Port of the state server used by a project's backend
+
+    Returns None when the project does not use the state server
+    '''
+    providers_file = Path(project_path) / 'providers.tf.json'
+    if not providers_file.exists():
+        return None
+    try:
+        address = json.loads(providers_file.read_text())['terraform']['backend']['http']['address']
+    except (KeyError, TypeError, ValueError):
+        return None
+    found = re.match(r'^http://%s:(\d+)/state/' % re.escape(STATE_SERVER_HOST), address)
+    return int(found.group(1)) if found else None
+
+def project_backend(project_path: Path) -> Optional[str]:
+    '''
+    Backend of a project from its providers.tf.json, such as http with the state server
+
+    Returns None when the state is kept in the local terraform.tfstate
+    '''
+    providers_file = Path(project_path) / 'providers.tf.json'
+    if not providers_file.exists():
+        return None
+    try:
+        backends = json.loads(providers_file.read_text())['terraform']['backend'] or {}
+    except (KeyError, TypeError, ValueError):
+        return None
+    return next((name for name in backends if name != 'local'), None)
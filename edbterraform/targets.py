@@ -0,0 +1,120 @@
+import json
+import shlex
+from pathlib import Path
+from typing import Dict, List
+
+# Spec object types and the per region module which creates them: module.<prefix>_<region>["<name>"]
+# BigAnimal is not region specific and uses a single module: module.biganimal["<name>"]
+OBJECT_MODULES = {
+    'machines': 'machine',
+    'databases': 'database',
+    'aurora': 'aurora',
+    'alloy': 'alloy',
+    'kubernetes': 'kubernetes',
+    'biganimal': 'biganimal',
+}
+REGIONLESS_OBJECTS = ['biganimal']
+# Network modules of each region, in the order they are created by the templates
+NETWORK_MODULES = {
+    'aws': ['vpc', 'network', 'routes', 'security'],
+    'gcloud': ['vpc', 'network', 'service_connection', 'security'],
+    'azure': ['vpc', 'network', 'security'],
+}
+# Additional per region modules needed by an object type
+OBJECT_DEPENDENCIES = {
+    'machines': ['key_pair'],
+}
+# Additional project wide resources needed by an object type
+PROJECT_DEPENDENCIES = {
+    'azure': {
+        'machines': ['module.agreements'],
+    },
+}
+VALIDATION_TARGET = 'null_resource.validation'
+
+def parse_selectors(selectors: List[str]) -> Dict[str, List[str]]:
+    '''
+    Parse selectors of spec objects, TYPE:NAME[,NAME...] or TYPE:* for all objects of a type,
+      ex: ['machines:pg1,pg2', 'biganimal:*']
+
+    Returns {<type>: [<name>, ...]} with '*' kept as a name
+    '''
+    selected = {}
+    for selector in selectors or []:
+        object_type, separator, names = str(selector).partition(':')
+        object_type = object_type.strip()
+        names = [name.strip() for name in names.split(',') if name.strip()]
+        if not separator or not names:
+            raise ValueError("ERROR: invalid selector %s, expected TYPE:NAME[,NAME...] or TYPE:*" % selector)
+        if object_type not in OBJECT_MODULES:
+            raise ValueError("ERROR: invalid selector type %s, expected one of %s" % (object_type, ', '.join(OBJECT_MODULES)))
+        selected.setdefault(object_type, [])
+        for name in names:
+            if name not in selected[object_type]:
+                selected[object_type].append(name)
+    return selected
+
+def object_address(object_type: str, name: str, region: str = None) -> str:
+    # Module addresses are set with jinja2 in the templates, with dashes in regions replaced by underscores
+    prefix = OBJECT_MODULES[object_type]
+    if object_type in REGIONLESS_OBJECTS:
+        return f'module.{prefix}[{json.dumps(name)}]'
+    return f'module.{prefix}_{region.replace("-", "_")}[{json.dumps(name)}]'
+
+def resolve_targets(spec: Dict, cloud_service_provider: str, selectors: List[str]) -> List[str]:
+    '''
+    Map selected spec objects to terraform target addresses.
+    Objects are found by name in the spec and their region decides which module creates them.
+    The validation resource and the network modules of each selected region are included,
+      terraform adds any other dependency of the targets when planning.
+
+    Returns a list of terraform addresses
+    '''
+    csp = 'gcloud' if cloud_service_provider == 'gcp' else cloud_service_provider
+    selected = parse_selectors(selectors)
+    targets = [VALIDATION_TARGET]
+    regions = []
+    region_modules = []
+
+    def add(address):
+        if address not in targets:
+            targets.append(address)
+
+    for object_type, names in selected.items():
+        objects = spec.get(object_type) or {}
+        if '*' in names:
+            names = sorted(objects)
+        for name in names:
+            if name not in objects:
+                raise ValueError("ERROR: %s %s not found in the spec, expected one of: %s" % (object_type, name, ', '.join(sorted(objects)) or 'none'))
+            if object_type in REGIONLESS_OBJECTS:
+                add(object_address(object_type, name))
+                continue
+            region = objects[name].get('region')
+            if not region:
+                raise ValueError("ERROR: %s %s is missing a region" % (object_type, name))
+            if region not in regions:
+                regions.append(region)
+            for module in OBJECT_DEPENDENCIES.get(object_type, []):
+                if (module, region) not in region_modules:
+                    region_modules.append((module, region))
+            for address in PROJECT_DEPENDENCIES.get(csp, {}).get(object_type, []):
+                add(address)
+            add(object_address(object_type, name, region))
+
+    dependencies = []
+    for region in regions:
+        for module in NETWORK_MODULES.get(csp, []):
+            dependencies.append(f'module.{module}_{region.replace("-", "_")}')
+    for module, region in region_modules:
+        dependencies.append(f'module.{module}_{region.replace("-", "_")}')
+    return targets[:1] + dependencies + targets[1:]
+
+def load_project_targets(project_path: Path, selectors: List[str]) -> List[str]:
+    # Resolve targets with the spec saved in a generated project
+    variables = json.loads((Path(project_path) / 'terraform.tfvars.json').read_text())
+    return resolve_targets(variables['spec'], variables['cloud_service_provider'], selectors)
+
+def target_arguments(targets: List[str]) -> List[str]:
+    # Commands are run through a shell, addresses are quoted since they contain double quotes and brackets
+    return [shlex.quote(f'-target={target}') for target in targets or []]
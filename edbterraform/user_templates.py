@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+import yaml
+from jinja2 import ChainableUndefined, Environment, TemplateError
+
+from edbterraform.outputs import iter_servers
+from edbterraform.utils.logs import ContextThreadPoolExecutor, logger
+
+TEMPLATES_DIRECTORY = 'templates'
+CACHE_FILE = Path('edb-terraform') / 'templates.cache.json'
+# Template suffixes and whether they use terraform's template syntax
+TEMPLATE_SUFFIXES = {
+    '.tftpl': True,
+    '.j2': False,
+}
+FILE_PERMISSIONS = 0o600
+
+class TerraformUndefined(ChainableUndefined):
+    '''
+    Allow missing attributes to be chained so try() and can() are able to handle them,
+    but fail when they are rendered as terraform does.
+    '''
+    def __str__(self):
+        self._fail_with_undefined_error()
+
+def tf_string(value):
+    # Render values the same way as terraform string interpolation
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if value is None:
+        return ''
+    return value
+
+def tf_pairs(collection):
+    # for key, value in map or for index, value in list
+    if isinstance(collection, dict):
+        return [(key, collection[key]) for key in sorted(collection)]
+    return list(enumerate(collection))
+
+def tf_values(collection):
+    if isinstance(collection, dict):
+        return [collection[key] for key in sorted(collection)]
+    return list(collection)
+
+def tf_try(*values):
+    for value in values:
+        if not isinstance(value, ChainableUndefined):
+            return value
+    raise TemplateError("ERROR: try() did not have a successful argument")
+
+# Subset of terraform functions available to .tftpl templates
+TERRAFORM_FUNCTIONS = {
+    'lower': lambda value: str(value).lower(),
+    'upper': lambda value: str(value).upper(),
+    'trimspace': lambda value: str(value).strip(),
+    'replace': lambda value, old, new: str(value).replace(old, new),
+    'tostring': lambda value: tf_string(value),
+    'tonumber': lambda value: float(value) if '.' in str(value) else int(value),
+    'length': len,
+    'join': lambda separator, items: separator.join(str(tf_string(item)) for item in items),
+    'split': lambda separator, value: str(value).split(separator),
+    'keys': lambda collection: sorted(collection),
+    'values': tf_values,
+    'contains': lambda collection, value: value in collection,
+    'lookup': lambda collection, key, default=None: collection.get(key, default),
+    'coalesce': lambda *values: next(value for value in values if value not in (None, '')),
+    'jsonencode': lambda value: json.dumps(value, separators=(',', ':')),
+    'yamlencode': lambda value: yaml.dump(value, default_flow_style=False),
+    'try': tf_try,
+    'can': lambda value: not isinstance(value, ChainableUndefined),
+    'tf_pairs': tf_pairs,
+    'tf_values': tf_values,
+}
+
+EXPRESSION_TOKENS = re.compile(r'''
+    (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<attribute>\.\s*(?:[A-Za-z_][\w-]*|\d+))
+  | (?P<name>[A-Za-z_][\w-]*)
+  | (?P<operator>&&|\|\||==|!=|<=|>=|!|[-+*/%<>()\[\],])
+  | (?P<space>\s+)
+  | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+def tftpl_expression(expression: str) -> str:
+    '''
+    Convert a terraform expression into a jinja2 expression.
+    Supported: literals, attribute and index access, function calls, comparisons and logical operators.
+    '''
+    converted = []
+    for token in EXPRESSION_TOKENS.finditer(expression):
+        kind, value = token.lastgroup, token.group()
+        if kind == 'attribute':
+            # Use item access since attribute access prefers python attributes, such as dict.values
+            name = value[1:].strip()
+            converted.append(f'[{name}]' if name.isdigit() else f'["{name}"]')
+        elif kind == 'name':
+            converted.append({'null': 'none'}.get(value, value))
+        elif kind == 'operator':
+            converted.append({'&&': ' and ', '||': ' or ', '!': ' not '}.get(value, value))
+        elif kind == 'other':
+            raise TemplateError("ERROR: unsupported terraform template expression - %s" % expression)
+        else:
+            converted.append(value)
+    return ''.join(converted)
+
+DIRECTIVE_START = re.compile(r'(\$\$\{|%%\{|\$\{|%\{)')
+JINJA_SYNTAX = re.compile(r'\{[{%#]')
+
+def tftpl_to_jinja(source: str) -> str:
+    '''
+    Convert a practical subset of terraform's template syntax into a jinja2 template
+    - ${ expression } interpolation
+    - %{ for name in collection }, %{ for key, value in collection } and %{ endfor }
+    - %{ if condition }, %{ else } and %{ endif }
+    - ~ strip markers and $${ or %%{ escapes
+    '''
+    output = []
+    position = 0
+
+    def text(value):
+        if JINJA_SYNTAX.search(value):
+            output.append('{%% raw %%}%s{%% endraw %%}' % value)
+        elif value:
+            output.append(value)
+
+    while True:
+        found = DIRECTIVE_START.search(source, position)
+        if not found:
+            text(source[position:])
+            break
+        text(source[position:found.start()])
+        marker = found.group()
+        if marker in ('$${', '%%{'):
+            text(marker[1:])
+            position = found.end()
+            continue
+
+        # Find the closing brace while skipping strings and nested braces
+        depth = 1
+        index = found.end()
+        while depth and index < len(source):
+            character = source[index]
+            if character == '"':
+                string = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL).match(source, index)
+                index = string.end() if string else index + 1
+                continue
+            depth += {'{': 1, '}': -1}.get(character, 0)
+            index += 1
+        if depth:
+            raise TemplateError("ERROR: unterminated template directive - %s" % source[found.start():found.start()+40])
+
+        body = source[found.end():index-1]
+        strip_left = '-' if body.startswith('~') else ''
+        strip_right = '-' if body.endswith('~') else ''
+        body = body.strip('~').strip()
+        position = index
+
+        if marker == '${':
+            output.append('{{%s %s %s}}' % (strip_left, tftpl_expression(body), strip_right))
+            continue
+
+        keyword, _, rest = body.partition(' ')
+        if keyword == 'for':
+            names, _, collection = rest.partition(' in ')
+            names = [name.strip() for name in names.split(',')]
+            if len(names) == 2:
+                statement = 'for %s, %s in tf_pairs(%s)' % (names[0], names[1], tftpl_expression(collection))
+            else:
+                statement = 'for %s in tf_values(%s)' % (names[0], tftpl_expression(collection))
+        elif keyword == 'if':
+            statement = 'if %s' % tftpl_expression(rest)
+        elif keyword in ('else', 'endif', 'endfor'):
+            statement = keyword
+        else:
+            raise TemplateError("ERROR: unsupported terraform template directive - %s" % body)
+        output.append('{%%%s %s %s%%}' % (strip_left, statement, strip_right))
+
+    return ''.join(output)
+
+def compute_data_hash(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def render_user_template(template_file: Path, destination: Path, servers: Dict) -> str:
+    '''
+    Render a .tftpl or .j2 user template with the servers output, the same as terraform's templatefile().
+    The destination is only written when its contents change.
+
+    Returns 'rendered' or 'unchanged'
+    '''
+    try:
+        source = template_file.read_text()
+        if TEMPLATE_SUFFIXES[template_file.suffix]:
+            environment = Environment(keep_trailing_newline=True, undefined=TerraformUndefined, finalize=tf_string, autoescape=False)
+            environment.globals.update(TERRAFORM_FUNCTIONS)
+            source = tftpl_to_jinja(source)
+        else:
+            environment = Environment(keep_trailing_newline=True, trim_blocks=True, autoescape=False)
+        content = environment.from_string(source).render(servers=servers)
+
+        if destination.exists() and destination.read_text() == content:
+            return 'unchanged'
+        temporary = destination.with_name(f'.{destination.name}.tmp')
+        temporary.write_text(content)
+        os.chmod(temporary, FILE_PERMISSIONS)
+        os.replace(temporary, destination)
+        return 'rendered'
+    except Exception as e:
+        raise TemplateError("ERROR: could not render user template %s - (%s)" % (template_file, repr(e))) from e
+
+def render_user_templates(project_path: Path, servers: Dict, max_workers: Optional[int] = None, force=False) -> Dict:
+    '''
+    Render all user templates under project/templates in parallel.
+    Templates are skipped when the servers output, the template and the rendered file
+      are unchanged since the last render, tracked with hashes under project/edb-terraform/templates.cache.json
+
+    Returns the status of each template: 'rendered', 'unchanged' or 'cached'
+    '''
+    project_path = Path(project_path)
+    templates_directory = project_path / TEMPLATES_DIRECTORY
+    cache_file = project_path / CACHE_FILE
+    cache = {}
+    if cache_file.exists() and not force:
+        cache = json.loads(cache_file.read_text())
+
+    servers_hash = compute_data_hash(servers)
+    templates = sorted(
+        template for template in templates_directory.glob('*')
+        if template.is_file() and template.suffix in TEMPLATE_SUFFIXES
+    ) if templates_directory.exists() else []
+
+    def render(template):
+        destination = project_path / template.stem
+        template_hash = hashlib.sha256(template.read_bytes()).hexdigest()
+        entry = cache.get(template.name, {})
+        if entry.get('servers') == servers_hash \
+            and entry.get('template') == template_hash \
+            and destination.exists() \
+            and hashlib.sha256(destination.read_bytes()).hexdigest() == entry.get('output'):
+            return template.name, 'cached', entry
+
+        status = render_user_template(template, destination, servers)
+        return template.name, status, {
+            'servers': servers_hash,
+            'template': template_hash,
+            'output': hashlib.sha256(destination.read_bytes()).hexdigest(),
+        }
+
+    results = {}
+    new_cache = {}
+    with ContextThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='templates') as executor:
+        for name, status, entry in executor.map(render, templates):
+            logger.info(f'User template {name}: {status}')
+            results[name] = status
+            new_cache[name] = entry
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(json.dumps(new_cache, indent=2, sort_keys=True))
+    return results
+
+def load_servers(project_path: Path, bin_path, terraform_version, output_name='servers', from_state=False) -> Dict:
+    # Collect the streamed servers output since templates can reference any server
+    servers = {}
+    for server_type, name, attributes in iter_servers(project_path, bin_path, terraform_version, output_name, from_state):
+        servers.setdefault(server_type, {})
+        if name is not None:
+            servers[server_type][name] = attributes
+    return servers
@@ -1,9 +1,15 @@
 import yaml
+import json
 from pathlib import Path
 import os
+import pickle
+import secrets
 import hashlib
 import base64
-from typing import Union, Tuple
+import filecmp
+import threading
+from collections import OrderedDict
+from typing import Optional, Union, Tuple
 from jinja2 import (
     Environment,
     FileSystemLoader,
@@ -17,13 +23,118 @@ from jinja2 import (
 MAX_PATH_LENGTH = os.pathconf('/', 'PC_PATH_MAX')
 MAX_NAME_LENGTH = os.pathconf('/', 'PC_NAME_MAX')
 
+# libyaml bindings are used when pyyaml was built with them
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+# Number of parsed documents kept for repeated loads of the same content
+PARSE_CACHE_SIZE = 32
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+def parse_document(content: str, is_json: bool = False):
+    '''
+    Parse yaml or json content.
+    - json is parsed natively when is_json is set or the content starts as a json object or array,
+      falling back to yaml for yaml flow collections such as `{a: 1}`
+    - yaml is parsed with libyaml when available
+    - parsed yaml documents are cached pickled by the hash of their content, so each load returns a new copy
+      which callers are free to change, json is parsed again since it is faster than any copy
+
+    Args:
+        content (str): yaml or json document
+        is_json (bool): content is expected to be json, such as from a .json file
+    Returns:
+        the parsed document
+    '''
+    if is_json or content.lstrip()[:1] in ('{', '['):
+        try:
+            return json.loads(content)
+        except ValueError:
+            if is_json:
+                raise
+
+    key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    with _parse_cache_lock:
+        if key in _parse_cache:
+            _parse_cache.move_to_end(key)
+            return pickle.loads(_parse_cache[key])
+
+    values = yaml.load(content, Loader=YAML_LOADER)
+    with _parse_cache_lock:
+        _parse_cache[key] = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+        _parse_cache.move_to_end(key)
+        while len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return values
+
+def dump_yaml(data, stream=None, **kwargs):
+    '''
+    yaml.dump with libyaml when available, limited to standard yaml tags.
+    Returns the yaml as a string when stream is not set.
+    '''
+    return yaml.dump(data, stream, Dumper=YAML_DUMPER, **kwargs)
+
+def write_json_file(file: Union[str,Path], data, compact: bool = False, permissions: Optional[int] = None) -> bool:
+    '''
+    Stream json into a temporary file next to file and rename it into place,
+      so readers never see a partially written file.
+    - keys are always sorted so the same data results in the same bytes
+    - compact drops indentation and whitespace, which is faster to write and parse for large specs
+    - file is left untouched when its content would not change, keeping its mtime stable
+    - permissions of an existing file are kept, unless permissions is set,
+      such as 0o600 for files only readable by their owner
+
+    Returns True when file was written
+    '''
+    file = Path(file)
+    options = {'separators': (',', ':')} if compact else {'indent': 2}
+    # Created as 0666 so the kernel applies the umask, the same as any new file,
+    #   instead of reading the process-wide umask which is not thread safe
+    temporary = str(file.parent / f'.{file.name}.{secrets.token_hex(8)}.tmp')
+    descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666 if permissions is None else permissions)
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(data, f, sort_keys=True, **options)
+        if file.exists():
+            if os.path.getsize(temporary) == file.stat().st_size \
+                and filecmp.cmp(temporary, file, shallow=False):
+                os.unlink(temporary)
+                if permissions is not None:
+                    os.chmod(file, permissions)
+                return False
+        if permissions is not None:
+            os.chmod(temporary, permissions)
+        elif file.exists():
+            os.chmod(temporary, file.stat().st_mode & 0o7777)
+        os.replace(temporary, file)
+        return True
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+def load_token(token_file: Union[str,Path]) -> str:
+    '''
+    Secret token saved in token_file, readable by its owner only, created when missing
+    '''
+    token_file = Path(token_file)
+    token_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return token_file.read_text().strip()
+    with os.fdopen(fd, 'w') as f:
+        f.write(secrets.token_urlsafe(32))
+    return token_file.read_text().strip()
+
 def load_yaml_file(
     input: Union[str,Path],
     top_level_types: Tuple[type] = (dict,),
 ) -> Union[list, dict, str, int, float, bool, None,]:
     '''
     Load yaml from a file or a string.
-    - Valid json accepted as well since it is valid yaml.
+    - Valid json accepted as well since it is valid yaml, .json files are parsed as json.
+    - Parsing is done with parse_document.
     - Allow restricting the top level type to a list of valid types.
 
     Args:
@@ -34,6 +145,7 @@ def load_yaml_file(
     '''
     mod_inputs = input
     values = {}
+    is_json = False
 
     try:
         if not isinstance(top_level_types, tuple):
@@ -46,9 +158,9 @@ def load_yaml_file(
 
         # Fallback to reading as a string not set as a Path
         try:
-            mod_inputs = Path(mod_inputs) \
-                            .resolve(strict=True) \
-                            .read_text()
+            path = Path(mod_inputs).resolve(strict=True)
+            mod_inputs = path.read_text()
+            is_json = path.suffix == '.json'
 
         except OSError as e:
             # When input is not an explicit Path,
@@ -59,7 +171,7 @@ def load_yaml_file(
         except:
             raise
 
-        values = yaml.safe_load(mod_inputs)
+        values = parse_document(mod_inputs, is_json)
 
         # Allow restricting the top level type to a list of valid types
         if top_level_types and not isinstance(values, top_level_types):
@@ -0,0 +1,156 @@
+import codecs
+import json
+import re
+from typing import IO, Any, Callable, Iterator, Optional, Tuple
+
+# Characters which change the structure outside of a string
+STRUCTURE_PATTERN = re.compile(r'["{}\[\],:]')
+# Characters which change the nesting within values deeper than the requested depth
+NESTING_PATTERN = re.compile(r'["{}\[\]]')
+# Characters which end or escape within a string
+STRING_PATTERN = re.compile(r'["\\]')
+# A complete string, used to skip over strings contained within a chunk
+STRING_BODY_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+def iter_values(
+    stream: IO,
+    depth: int = 1,
+    match: Optional[Callable[[tuple], bool]] = None,
+    include_empty: bool = False,
+    chunk_size: int = 1 << 20,
+) -> Iterator[Tuple[tuple, Any]]:
+    '''
+    Incrementally parse a json document and yield the values nested at a given depth.
+    Only a single value at the requested depth is held in memory at a time,
+      which allows for documents larger than memory such as `terraform show -json`.
+
+    ex.
+    iter_values(io.StringIO('{"machines": {"pg1": {"a": 1}, "pg2": {"a": 2}}}'), depth=2)
+    => (('machines', 'pg1'), {'a': 1}), (('machines', 'pg2'), {'a': 2})
+
+    Args:
+        stream (IO): text or binary stream with a json document
+        depth (int): number of objects/arrays the values are nested within
+        match (callable): receives the path of a value and returns False to skip parsing it
+        include_empty (bool): yield (path, {}) for empty objects directly above depth
+        chunk_size (int): number of characters/bytes read from the stream at a time
+    Returns:
+        Iterator of (path, value), where path is a tuple of object keys and array indexes
+    '''
+    if depth < 1:
+        raise ValueError("ERROR: depth must be at least 1 - %s" % depth)
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    # Frames are [container, key or index, expecting a key]
+    stack = []
+    in_string = False
+    escaped = False
+    key_parts = None
+    key_from = 0
+    capture_parts = None
+    capture_from = 0
+    capture_path = None
+
+    def start_value(position):
+        nonlocal capture_parts, capture_from, capture_path
+        capture_path = tuple(frame[1] for frame in stack)
+        capture_parts = [] if match is None or match(capture_path) else None
+        capture_from = position + 1
+
+    while True:
+        raw = stream.read(chunk_size)
+        if not raw:
+            break
+        # Multi-byte characters may be split across chunks
+        chunk = decoder.decode(raw) if isinstance(raw, bytes) else raw
+
+        position = 0
+        end = len(chunk)
+        while position < end:
+            if in_string:
+                if escaped:
+                    escaped = False
+                    position += 1
+                    continue
+                found = STRING_PATTERN.search(chunk, position)
+                if not found:
+                    break
+                position = found.start()
+                if chunk[position] == '\\':
+                    escaped = True
+                    position += 1
+                    continue
+                in_string = False
+                if key_parts is not None:
+                    key_parts.append(chunk[key_from:position])
+                    stack[-1][1] = json.loads('"%s"' % ''.join(key_parts))
+                    key_parts = None
+                position += 1
+                continue
+
+            pattern = NESTING_PATTERN if len(stack) > depth else STRUCTURE_PATTERN
+            found = pattern.search(chunk, position)
+            if not found:
+                break
+            position = found.start()
+            character = chunk[position]
+
+            if character == '"':
+                is_key = stack and stack[-1][0] == '{' and stack[-1][2] and len(stack) <= depth
+                found = STRING_BODY_PATTERN.match(chunk, position)
+                if found:
+                    if is_key:
+                        stack[-1][1] = json.loads(found.group())
+                    position = found.end()
+                    continue
+                in_string = True
+                if is_key:
+                    key_parts = []
+                    key_from = position + 1
+            elif character in '{[':
+                stack.append([character, 0 if character == '[' else None, character == '{'])
+                if character == '[' and len(stack) == depth:
+                    start_value(position)
+            elif character in '}]':
+                if len(stack) == depth:
+                    frame = stack[-1]
+                    text = ''
+                    if capture_parts is not None:
+                        capture_parts.append(chunk[capture_from:position])
+                        text = ''.join(capture_parts).strip()
+                        capture_parts = None
+                    if text:
+                        yield (capture_path, json.loads(text))
+                    elif include_empty and frame[0] == '{' and frame[1] is None:
+                        yield (tuple(item[1] for item in stack[:-1]), {})
+                stack.pop()
+            elif character == ':':
+                stack[-1][2] = False
+                if len(stack) == depth:
+                    start_value(position)
+            elif character == ',':
+                frame = stack[-1]
+                if len(stack) == depth:
+                    if capture_parts is not None:
+                        capture_parts.append(chunk[capture_from:position])
+                        text = ''.join(capture_parts).strip()
+                        capture_parts = None
+                        yield (capture_path, json.loads(text))
+                if frame[0] == '[':
+                    frame[1] += 1
+                    if len(stack) == depth:
+                        start_value(position)
+                else:
+                    frame[2] = True
+            position += 1
+
+        # Carry partial keys and values into the next chunk
+        if capture_parts is not None:
+            capture_parts.append(chunk[capture_from:])
+            capture_from = 0
+        if key_parts is not None:
+            key_parts.append(chunk[key_from:])
+            key_from = 0
+
+    if stack or in_string:
+        raise ValueError("ERROR: incomplete json document, %s containers left open" % len(stack))
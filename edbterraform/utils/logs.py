@@ -1,4 +1,6 @@
+import contextvars
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 import os
 from pathlib import Path
@@ -10,6 +12,14 @@ import itertools
 
 logger = logging.getLogger(__project_name__)
 
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    '''
+    ThreadPoolExecutor running each call within a copy of the submitting thread's context variables,
+      so records logged by its threads keep the context of the caller, such as the job of `serve`
+    '''
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
 class EnumDefaults(EnumMeta):
     def __call__(cls, value='', default=None, *args, **kwargs):
         '''
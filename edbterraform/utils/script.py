@@ -189,6 +189,19 @@ class Version:
 
         return version
 
+class ShellCommandError(subprocess.CalledProcessError):
+    '''
+    Failed shell command which keeps the command output for callers,
+      such as the resources reported by a failed `terraform apply`.
+    '''
+    HINT = (
+        "If executable fails to execute, check the path."
+        "If options --destroy or --apply fail, manual intervention may be required to allow for a recovery."
+    )
+
+    def __str__(self):
+        return self.HINT
+
 def execute_shell(args, environment=os.environ, cwd=None):
     fmt_args = ' '.join([str(x) for x in args])
     logger.info("Executing command: %s", fmt_args)
@@ -207,10 +220,30 @@ def execute_shell(args, environment=os.environ, cwd=None):
         logger.error("Command failed: %s", e.cmd)
         logger.error("Return code: %s", e.returncode)
         logger.error("Output: %s", e.output)
-        raise Exception(
-            "If executable fails to execute, check the path."
-            "If options --destroy or --apply fail, manual intervention may be required to allow for a recovery."
-        )
+        raise ShellCommandError(e.returncode, e.cmd, e.output) from e
+
+def execute_command(args, environment=os.environ, cwd=None) -> bytes:
+    '''
+    Run a command without a shell and return its standard output alone,
+      so warnings written to standard error never end up within parsed output.
+    On failure, ShellCommandError holds the standard error as its output.
+    '''
+    args = [str(x) for x in args]
+    logger.info("Executing command: %s", ' '.join(args))
+    logger.debug("environment=%s", environment)
+    process = subprocess.run(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=environment,
+    )
+    if process.returncode != 0:
+        logger.error("Command failed: %s", ' '.join(args))
+        logger.error("Return code: %s", process.returncode)
+        logger.error("Output: %s", process.stderr)
+        raise ShellCommandError(process.returncode, args, process.stderr)
+    return process.stdout
 
 def execute_live_shell(args, environment=os.environ, cwd=None):
     fmt_args = ' '.join([str(x) for x in args])
@@ -0,0 +1,59 @@
+import os
+import textwrap
+
+import pytest
+
+from edbterraform.CLI import TerraformCLI
+
+# Stands in for terraform, `providers mirror` copies the providers of a local directory standing in for the registry
+TERRAFORM = textwrap.dedent('''
+    #!/bin/sh
+    if [ "$1" = "--version" ]; then
+      echo '{"terraform_version": "1.5.5"}'
+      exit 0
+    fi
+    if [ "$1 $2" = "providers mirror" ] && [ -f versions.tf ] && [ -z "$TF_CLI_CONFIG_FILE" ]; then
+      cp .terraform.lock.hcl "$4/" 2>/dev/null
+      cp -R "$REGISTRY"/. "$4"
+      exit 0
+    fi
+    echo "unexpected terraform command: $@" >&2
+    exit 1
+''').lstrip()
+
+@pytest.fixture
+def terraform(tmp_path, monkeypatch):
+    registry = tmp_path / 'registry'
+    for provider in ['registry.terraform.io/hashicorp/aws', 'registry.terraform.io/bryan-bar/toolbox']:
+        (registry / provider).mkdir(parents=True)
+        (registry / provider / 'index.json').write_text('{"versions": {}}')
+    monkeypatch.setenv('REGISTRY', str(registry))
+    monkeypatch.setenv('TF_CLI_CONFIG_FILE', str(tmp_path / 'ignored.tfrc'))
+    cli = TerraformCLI(tmp_path / 'bin')
+    cli.bin_path.mkdir(parents=True)
+    cli.binary_full_path.write_text(TERRAFORM)
+    os.chmod(cli.binary_full_path, 0o755)
+    return cli
+
+def test_mirror_providers(terraform, monkeypatch):
+    config_file = terraform.mirror_providers()
+
+    assert (terraform.mirror_path / 'registry.terraform.io/hashicorp/aws/index.json').exists()
+    config = config_file.read_text()
+    providers = '["registry.terraform.io/bryan-bar/toolbox", "registry.terraform.io/hashicorp/aws"]'
+    assert f'path    = "{terraform.mirror_path}"' in config
+    assert f'include = {providers}' in config
+    # Providers of registry modules, which are not mirrored, are still installed from their registry
+    assert f'exclude = {providers}' in config
+
+    assert terraform.environment()['TF_CLI_CONFIG_FILE'] != str(config_file)
+    monkeypatch.delenv('TF_CLI_CONFIG_FILE')
+    assert terraform.environment()['TF_CLI_CONFIG_FILE'] == str(config_file)
+
+def test_mirror_providers_lock_file(terraform, tmp_path):
+    lock_file = tmp_path / 'terraform.lock.hcl'
+    lock_file.write_text('# locked versions\n')
+
+    terraform.mirror_providers(lock_file)
+
+    assert (terraform.mirror_path / '.terraform.lock.hcl').read_text() == '# locked versions\n'
@@ -0,0 +1,86 @@
+import json
+import os
+import textwrap
+
+from edbterraform.cloud_lookups import AwsLookupBackend, CloudLookupBackend, CloudLookupCache, resolve_cloud_lookups
+
+class LookupBackend(CloudLookupBackend):
+    # Stands in for a cloud provider and counts its calls
+    def __init__(self):
+        self.calls = []
+
+    def zones(self, region):
+        self.calls.append(('zones', region))
+        return [f'{region}a', f'{region}b']
+
+    def image_id(self, region, image):
+        self.calls.append(('image_id', region))
+        return f'ami-{image["name"]}'
+
+    def instance_types(self, region):
+        self.calls.append(('instance_types', region))
+        return ['t3.micro']
+
+def test_cache_reuses_entries_within_ttl(tmp_path):
+    backend = LookupBackend()
+    cache = CloudLookupCache('aws', backend, tmp_path)
+
+    assert cache.zones('us-east-1') == ['us-east-1a', 'us-east-1b']
+    assert cache.zones('us-east-1') == ['us-east-1a', 'us-east-1b']
+    assert backend.calls == [('zones', 'us-east-1')]
+    assert oct(os.stat(cache.entry_path('zones', 'us-east-1')).st_mode & 0o777) == '0o600'
+
+def test_cache_looks_up_expired_entries(tmp_path):
+    backend = LookupBackend()
+    cache = CloudLookupCache('aws', backend, tmp_path, ttls={'zones': 60})
+    cache.zones('us-east-1')
+    path = cache.entry_path('zones', 'us-east-1')
+    entry = json.loads(path.read_text())
+    entry['created'] -= 61
+    path.write_text(json.dumps(entry))
+
+    cache.zones('us-east-1')
+
+    assert backend.calls == [('zones', 'us-east-1')] * 2
+
+def test_cache_refresh(tmp_path):
+    backend = LookupBackend()
+    CloudLookupCache('aws', backend, tmp_path).instance_types('us-east-1')
+
+    CloudLookupCache('aws', backend, tmp_path, refresh=True).instance_types('us-east-1')
+    CloudLookupCache('aws', backend, tmp_path).instance_types('us-east-1')
+
+    assert backend.calls == [('instance_types', 'us-east-1')] * 2
+
+def test_cache_keys_images(tmp_path):
+    backend = LookupBackend()
+    cache = CloudLookupCache('aws', backend, tmp_path)
+
+    assert cache.image_id('us-east-1', {'name': 'rocky', 'owner': '1'}) == 'ami-rocky'
+    assert cache.image_id('us-east-1', {'name': 'debian', 'owner': '1'}) == 'ami-debian'
+    assert cache.image_id('us-east-1', {'name': 'rocky', 'owner': '1'}) == 'ami-rocky'
+    assert len(backend.calls) == 2
+
+def test_resolve_cloud_lookups(tmp_path):
+    spec = {
+        'regions': {'us-east-1': {}, 'us-west-2': {}},
+        'images': {'rocky': {'name': 'rocky', 'owner': '1'}},
+        'machines': {'pg1': {'region': 'us-west-2', 'image_name': 'rocky'}},
+    }
+
+    lookups = resolve_cloud_lookups('aws', spec, backend=LookupBackend(), directory=tmp_path)
+
+    assert lookups['regions']['us-east-1'] == {'zones': ['us-east-1a', 'us-east-1b'], 'instance_types': ['t3.micro'], 'images': {}}
+    assert lookups['regions']['us-west-2']['images'] == {'rocky': {'id': 'ami-rocky'}}
+
+def test_aws_backend_ignores_stderr(tmp_path, monkeypatch):
+    aws = tmp_path / 'aws'
+    aws.write_text(textwrap.dedent('''
+        #!/bin/sh
+        echo "WARNING: the credentials file has insecure permissions" >&2
+        echo '{"AvailabilityZones": [{"ZoneName": "us-east-1b"}, {"ZoneName": "us-east-1a"}]}'
+    ''').lstrip())
+    os.chmod(aws, 0o755)
+    monkeypatch.setenv('PATH', f'{tmp_path}{os.pathsep}{os.environ["PATH"]}')
+
+    assert AwsLookupBackend(tmp_path / 'bin').zones('us-east-1') == ['us-east-1a', 'us-east-1b']